@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Measure the import time of the Macrobot modules, i.e. the startup cost of a worker process.
+
+Every module is imported in a fresh interpreter, the best of several runs is reported::
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py -r 10 macrobot.cli skimage.filters
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+# Modules imported by the pipeline workers and the command line entry point
+MODULES = [
+    'numpy',
+    'cv2',
+    'macrobot.thresholding',
+    'macrobot.segmentation',
+    'macrobot.mb_pipeline',
+    'macrobot.cli',
+    'macrobot.data_managment',
+]
+
+_TIMER = 'import time; start = time.perf_counter(); import {}; print(time.perf_counter() - start)'
+
+
+def import_time(module: str, repeat: int) -> float:
+    """Return the best import time of `module` in seconds over `repeat` fresh interpreters."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get('PYTHONPATH')])))
+    times = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', _TIMER.format(module)], env=env, check=True,
+                                stdout=subprocess.PIPE, universal_newlines=True).stdout
+        times.append(float(output))
+    return min(times)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Import time of the Macrobot modules.')
+    parser.add_argument('modules', nargs='*', default=MODULES, help='Modules to import.')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Number of runs per module.')
+    args = parser.parse_args(argv)
+
+    for module in args.modules:
+        print(f'{module:<32} {import_time(module, args.repeat) * 1000:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,7 @@
 import numpy as np
 import cv2
-import os
-from macrobot.helpers import rgb_features
 from macrobot import segmentation
 from macrobot.mb_pipeline import MacrobotPipeline
-from macrobot.prediction import predict_min_rgb
 
 
 
@@ -20,8 +17,9 @@ class BgtSegmenter(MacrobotPipeline):
     """
 
     NAME = 'BGT'
+    PREDICTOR = 'min_rgb'
 
-    def get_frames(self, image_source: np.ndarray) -> np.ndarray:
+    def get_frames(self, image_source: np.ndarray, scale: float = 1.0) -> np.ndarray:
         """
         Segment the white frame region on a microtiter plate using Otsu's thresholding.
 
@@ -33,6 +31,8 @@ class BgtSegmenter(MacrobotPipeline):
         ----------
         image_source : np.ndarray
             The UVS image (grayscale) used as the source for thresholding.
+        scale : float, optional
+            Size of the image relative to the images the settings were made for, e.g. for thumbnails.
 
         Returns
         -------
@@ -44,11 +44,13 @@ class BgtSegmenter(MacrobotPipeline):
         >>> binary_frames = segmenter.get_frames(segmenter.image_uvs)
         """
         # Apply Otsu thresholding to segment the white frame
-        _, image_tresholded = cv2.threshold(image_source, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        _, image_tresholded = cv2.threshold(image_source, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU,
+                                            dst=self.buffer(image_source.shape, np.uint8))
 
         # Define a kernel for dilation to smooth and close gaps in the segmented frame
-        kernel = np.ones((8, 8), np.uint8)
-        image_tresholded = cv2.dilate(image_tresholded, kernel, iterations=3)
+        kernel = self.scaled_kernel(8, scale)
+        image_tresholded = cv2.dilate(image_tresholded, kernel, dst=self.buffer(image_source.shape, np.uint8),
+                                      iterations=3)
 
         return image_tresholded
 
@@ -68,10 +70,10 @@ class BgtSegmenter(MacrobotPipeline):
             If lane segmentation fails due to unexpected image conditions.
         """
         # Generate a binary mask for the white frame using UVS image
-        self.image_tresholded = self.get_frames(self.image_uvs)
+        self.image_tresholded = self.get_frames(self.image_uvs, scale=self.pixel_scale)
 
         # Extract lanes using the mask and store lane data
-        self.lanes_roi_rgb, self.lanes_roi_backlight, self.numer_of_lanes = segmentation.segment_lanes_rgb(
+        self.lanes, self.numer_of_lanes = segmentation.segment_lanes(
             self.image_rgb,
             self.image_backlight,
             self.image_tresholded,
@@ -98,68 +100,9 @@ class BgtSegmenter(MacrobotPipeline):
         -------
         >>> features = segmenter.get_features()
         """
-        # Initialize a list to store features and positions
-        self.lanes_feature = []
-
         # Loop through each detected lane and compute MinIP features
-        for lane in self.lanes_roi_rgb:
-            # Create a copy of the lane to avoid modifying the original data
-            copy_lane = np.copy(lane[1])
-
-            # Extract the minimum RGB features from the lane
-            min_rgb_feature = rgb_features(copy_lane, "minimum")
-
-            # Append lane position and extracted features to the list
-            self.lanes_feature.append([lane[0], min_rgb_feature])
+        for lane in self.lanes:
+            # Stack the minimum RGB channels of the lane, which are shared with the prediction
+            lane.feature = np.dstack([lane.channels[f'minrgb_{channel}'] for channel in 'bgr'])
 
         return self.lanes_feature
-
-    def get_prediction_per_lane(self, plate_id: str, destination_path: str) -> list:
-        """
-        Predict the presence of the Bgt pathogen in each lane using thresholding.
-
-        This method performs pathogen prediction for each lane based on the extracted MinIP features
-        and backlight images. The predictions are saved as binary images, and the results are
-        stored for further analysis or reporting.
-
-        Parameters
-        ----------
-        plate_id : str
-            Identifier for the microtiter plate being processed.
-        destination_path : str
-            Directory path where the prediction result images will be saved.
-
-        Returns
-        -------
-        list of list
-            A list where each sublist contains:
-                - lane_position (int): The position of the lane.
-                - predicted_image (np.ndarray): The binary image prediction for the lane.
-                  (255 = pathogen, 0 = background)
-
-        Example
-        -------
-        >>> predictions = segmenter.get_prediction_per_lane("PlateA1", "/path/to/destination")
-        """
-        # Initialize a list to store predictions and positions
-        self.predicted_lanes = []
-
-        # Loop through each lane to generate predictions
-        for i in range(len(self.lanes_feature)):
-            # Predict pathogen presence using MinIP features and backlight information
-            predicted_image = predict_min_rgb(
-                self.lanes_feature[i][1],
-                self.lanes_roi_backlight[i][1],
-                self.lanes_roi_rgb[i][1]
-            )
-
-            # Save the predicted image with a descriptive filename
-            cv2.imwrite(
-                os.path.join(destination_path, f"{plate_id}_{self.lanes_feature[i][0]}_disease_predict.png"),
-                predicted_image
-            )
-
-            # Append lane position and prediction result to the list
-            self.predicted_lanes.append([self.lanes_feature[i][0], predicted_image])
-
-        return self.predicted_lanes
\ No newline at end of file
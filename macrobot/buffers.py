@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Reusable image buffers for the per-plate arrays of the pipeline.
+
+Plates taken with one hardware setting always have the same shape, so the arrays of a plate
+(resized channels, RGB image, frame mask, predicted lanes) can be reused for the next plate.
+A pipeline takes its buffers from a `BufferPool` and returns all of them when the plate is
+finished. Each worker process uses its own pool, see `worker_pool`.
+"""
+
+from collections import defaultdict
+
+import numpy as np
+
+
+class BufferPool(object):
+    """
+    Pool of numpy arrays keyed by shape and dtype.
+
+    Buffers are handed out uninitialized. Arrays taken from the pool must not be used after
+    they were released, e.g. the images returned by `MacrobotPipeline.start_pipeline` are only
+    valid until the next plate is analysed with the same pool.
+
+    Attributes:
+        hits (int): Number of buffers which were reused.
+        misses (int): Number of buffers which had to be allocated.
+    """
+
+    def __init__(self):
+        self._free = defaultdict(list)
+        self._in_use = []
+        self.hits = 0
+        self.misses = 0
+
+    def take(self, shape, dtype) -> np.ndarray:
+        """
+        Return a buffer of the given shape and dtype, allocating it if no free buffer is available.
+
+        :param shape: Shape of the buffer.
+        :param dtype: Data type of the buffer.
+        :return: The uninitialized buffer.
+        """
+        key = (tuple(shape), np.dtype(dtype))
+        if self._free[key]:
+            buffer = self._free[key].pop()
+            self.hits += 1
+        else:
+            buffer = np.empty(*key)
+            self.misses += 1
+        self._in_use.append(buffer)
+        return buffer
+
+    def release_all(self) -> None:
+        """Return all buffers handed out since the last release to the pool."""
+        for buffer in self._in_use:
+            self._free[(buffer.shape, buffer.dtype)].append(buffer)
+        self._in_use = []
+
+    def stats(self) -> dict:
+        """
+        Return the usage statistics of the pool.
+
+        :return: Dictionary with the number of ``hits`` and ``misses``, the number of buffers
+                 ``in_use`` and ``free`` and the ``allocated_bytes`` of all buffers.
+        """
+        free = [buffer for buffers in self._free.values() for buffer in buffers]
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'in_use': len(self._in_use),
+            'free': len(free),
+            'allocated_bytes': sum(buffer.nbytes for buffer in free + self._in_use),
+        }
+
+
+_WORKER_POOL = None
+
+
+def worker_pool() -> BufferPool:
+    """Return the buffer pool of the current process."""
+    global _WORKER_POOL
+    if _WORKER_POOL is None:
+        _WORKER_POOL = BufferPool()
+    return _WORKER_POOL
@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Threshold sweeps for calibrating the pathogen predictors.
+
+The predictors are the rule sets of `macrobot.rules`. Tuning their thresholds for new
+hardware would require a full pipeline run per threshold combination. Instead, this
+module collects the feature values of the leaf pixels once per leaf as a joint
+histogram and evaluates a whole grid of threshold combinations on the histograms,
+giving the ``%_Inf`` per leaf and combination without touching the images again.
+
+The sweepable thresholds are the conditions of the rule set, see `rule_thresholds`, so
+``[RULES <name>]`` sections of the settings file are swept like the built-in rule sets.
+
+Feature values are only kept at the resolution the grid can distinguish: for every
+compared channel, values between two neighbouring cut points of the grid behave the
+same for every combination, so they share one histogram bin. The result is exact.
+"""
+
+import itertools
+from configparser import ConfigParser
+
+import numpy as np
+
+from macrobot import lane_cache
+from macrobot.rules import LaneChannels, Rule, RuleSet
+from macrobot.segmentation import detect_leaves
+
+
+def rule_thresholds(rule_set: RuleSet) -> dict:
+    """
+    List the thresholds of a rule set which can be swept.
+
+    Identical conditions of several rules share one threshold. A threshold is named after its
+    channel, numbered in order of appearance if the rule set compares the channel more than once.
+
+    Parameters
+    ----------
+    rule_set : RuleSet
+        The rule set, e.g. ``rules.load_rules(setting_file)['saturation']``.
+
+    Returns
+    -------
+    dict
+        For every threshold name a dict with the compared ``channel``, the ``operator``, the
+        ``default`` value of the rule set and the (rule, condition) positions of its ``conditions``.
+
+    Example
+    -------
+    >>> list(rule_thresholds(rules.RULES['max_rgb']))
+    ['maxrgb_g', 'maxrgb_r_1', 'maxrgb_r_2', 'maxrgb_r_3']
+    """
+    groups = {}
+    for rule_id, rule in enumerate(rule_set.rules):
+        for condition_id, condition in enumerate(rule.conditions):
+            groups.setdefault(condition, []).append((rule_id, condition_id))
+
+    channels = [channel for channel, _, _ in groups]
+    numbers = {}
+    thresholds = {}
+    for (channel, operator, threshold), conditions in groups.items():
+        name = channel
+        if channels.count(channel) > 1:
+            numbers[channel] = numbers.get(channel, 0) + 1
+            name = f'{channel}_{numbers[channel]}'
+        thresholds[name] = {'channel': channel, 'operator': operator, 'default': threshold, 'conditions': conditions}
+    return thresholds
+
+
+def apply_thresholds(rule_set: RuleSet, thresholds: dict) -> RuleSet:
+    """
+    Return a copy of a rule set with other threshold values.
+
+    Parameters
+    ----------
+    rule_set : RuleSet
+        The rule set.
+    thresholds : dict
+        New values by threshold name, see `rule_thresholds`. Thresholds not given keep their value.
+
+    Returns
+    -------
+    RuleSet
+        The rule set with the new thresholds.
+    """
+    conditions = [list(rule.conditions) for rule in rule_set.rules]
+    for name, threshold in rule_thresholds(rule_set).items():
+        if name in thresholds:
+            for rule_id, condition_id in threshold['conditions']:
+                channel, operator, _ = conditions[rule_id][condition_id]
+                conditions[rule_id][condition_id] = (channel, operator, thresholds[name])
+    return RuleSet([Rule(rule_conditions, rule.value) for rule_conditions, rule in zip(conditions, rule_set.rules)],
+                   rule_set.default)
+
+
+def parse_grid(rule_set: RuleSet, specs: list) -> dict:
+    """
+    Parse threshold grid specifications of the form ``name=v1,v2,...`` or ``name=start:stop:step``.
+
+    Ranges include `stop`. Thresholds without a specification keep their default value.
+
+    Parameters
+    ----------
+    rule_set : RuleSet
+        The rule set of the predictor.
+    specs : list
+        The grid specifications, e.g. ``['saturation=100:160:10', 'backlight=800,1000']``.
+
+    Returns
+    -------
+    dict
+        The list of values to sweep for every threshold of the predictor.
+
+    Raises
+    ------
+    ValueError
+        If a specification is malformed or names an unknown threshold.
+
+    Example
+    -------
+    >>> parse_grid(rules.RULES['green'], ['green=20:36:4'])
+    {'green': [20, 24, 28, 32, 36]}
+    """
+    thresholds = rule_thresholds(rule_set)
+    grid = {name: [threshold['default']] for name, threshold in thresholds.items()}
+
+    for spec in specs:
+        name, _, values = spec.partition('=')
+        name = name.strip()
+        if name not in thresholds or not values:
+            available = ', '.join(f"{name} ({threshold['channel']} {threshold['operator']} {threshold['default']})"
+                                  for name, threshold in thresholds.items())
+            raise ValueError(f"Invalid threshold specification '{spec}', thresholds of the rule set: {available}")
+        if ':' in values:
+            start, stop, step = (int(value) for value in values.split(':'))
+            grid[name] = list(range(start, stop + 1, step))
+        else:
+            grid[name] = [int(value) for value in values.split(',')]
+
+    return grid
+
+
+def _cut_points(rule_set: RuleSet, grid: dict) -> dict:
+    """Return the sorted values at which the outcome of the grid comparisons can change, per channel."""
+    cuts = {}
+    for name, threshold in rule_thresholds(rule_set).items():
+        # v < t and v >= t change at t, v > t and v <= t at t + 1, v == t and v != t at both
+        offsets = {'<': (0,), '>=': (0,), '>': (1,), '<=': (1,)}.get(threshold['operator'], (0, 1))
+        cuts.setdefault(threshold['channel'], set()).update(value + offset for value in grid[name]
+                                                            for offset in offsets)
+    return {channel: np.array(sorted(values)) for channel, values in cuts.items()}
+
+
+def leaf_histogram(rule_set: RuleSet, rgb: np.ndarray, backlight: np.ndarray, leaf_mask: np.ndarray,
+                   cuts: dict) -> tuple:
+    """
+    Compute the joint histogram of the feature channels over the pixels of one leaf.
+
+    Parameters
+    ----------
+    rule_set : RuleSet
+        The rule set of the predictor, the histogram covers the channels it compares.
+    rgb : np.ndarray
+        The RGB bounding box of the leaf.
+    backlight : np.ndarray
+        The backlight bounding box of the leaf.
+    leaf_mask : np.ndarray
+        Boolean mask of the leaf pixels within the bounding box.
+    cuts : dict
+        Cut points per channel, see `_cut_points`. Channels are reduced to the largest cut
+        point not above the value, which keeps the outcome of every comparison of the grid.
+
+    Returns
+    -------
+    tuple
+        A tuple containing:
+            - bins (dict): Channel name to array with the channel value of every histogram bin.
+            - counts (np.ndarray): Number of leaf pixels per bin.
+    """
+    channels = LaneChannels(rgb, backlight)
+    names = rule_set.channels
+
+    columns = []
+    for name in names:
+        values = channels[name][leaf_mask].astype(np.int64)
+        if name in cuts:
+            points = cuts[name]
+            index = np.searchsorted(points, values, side='right') - 1
+            values = np.where(index >= 0, points[np.maximum(index, 0)], points[0] - 1)
+        columns.append(values)
+
+    bins, counts = np.unique(np.stack(columns, axis=1), axis=0, return_counts=True)
+    return {name: bins[:, i] for i, name in enumerate(names)}, counts
+
+
+def sweep_histograms(rule_set: RuleSet, histograms: list, grid: dict):
+    """
+    Evaluate every threshold combination of the grid on a list of leaf histograms.
+
+    Parameters
+    ----------
+    rule_set : RuleSet
+        The rule set of the predictor.
+    histograms : list
+        List of (bins, counts) tuples from `leaf_histogram`, one per leaf.
+    grid : dict
+        The values to sweep for every threshold, see `parse_grid`.
+
+    Yields
+    ------
+    tuple
+        (thresholds, percent_infection) where `thresholds` is a dict with one value per threshold
+        and `percent_infection` holds the ``%_Inf`` of every leaf, rounded as in `predict_leaf`.
+    """
+    names = list(grid)
+
+    # Concatenate all leaves, so each combination is evaluated with one vectorized call
+    leaf_index = np.concatenate([np.full(len(counts), i) for i, (_, counts) in enumerate(histograms)])
+    counts = np.concatenate([counts for _, counts in histograms])
+    bins = {name: np.concatenate([leaf_bins[name] for leaf_bins, _ in histograms]) for name in histograms[0][0]}
+    white_counter = np.bincount(leaf_index, weights=counts, minlength=len(histograms))
+
+    for values in itertools.product(*(grid[name] for name in names)):
+        thresholds = dict(zip(names, values))
+        # Each bin is a pixel of the prediction, 0 is the background
+        background = apply_thresholds(rule_set, thresholds)(bins) == 0
+        black = np.bincount(leaf_index, weights=counts * background, minlength=len(histograms))
+        percent_infection = [round(100 - (black_counter * 100 / white)) for black_counter, white
+                             in zip(black.astype(np.int64).tolist(), white_counter.astype(np.int64).tolist())]
+        yield thresholds, percent_infection
+
+
+def plate_leaves(setting_file: str, lanes_roi_rgb: list, lanes_roi_backlight: list, lanes_roi_binary: list):
+    """
+    Iterate over the scored leaves of a plate, as selected by `segment_leaf_binary`.
+
+    Yields
+    ------
+    tuple
+        (lane position, leaf_id, RGB bounding box, backlight bounding box, leaf mask)
+    """
+    config = ConfigParser()
+    config.read(setting_file)
+    y_position = config.getint('SEGMENTATION', 'y_position')
+    min_leaf_size = config.getint('SEGMENTATION', 'min_leaf_size')
+    leaves_per_lane = config.getint('SEGMENTATION', 'leaves_per_lane')
+
+    for lane_id in range(len(lanes_roi_binary)):
+        lane_position, image_binary_lane = lanes_roi_binary[lane_id]
+        image_rgb_lane = lanes_roi_rgb[lane_id][1]
+        image_backlight_lane = lanes_roi_backlight[lane_id][1]
+
+        image_binary_lane, leaves = detect_leaves(image_binary_lane, y_position, min_leaf_size)
+        for leaf_id, _, (x, y, w, h) in leaves:
+            if leaf_id <= leaves_per_lane:
+                yield (lane_position, leaf_id, image_rgb_lane[y:y + h, x:x + w],
+                       image_backlight_lane[y:y + h, x:x + w], image_binary_lane[y:y + h, x:x + w] == 255)
+
+
+def sweep_lane_cache(cache_dir: str, setting_file: str, rule_set: RuleSet, grid: dict, file_sweep,
+                     procedure: str = None) -> tuple:
+    """
+    Run a threshold sweep on all plates of a lane cache and write the results as a table.
+
+    The table has one row per leaf and threshold combination with the columns of the
+    leaf results (``index;expNr;dai;Plate_ID;Lane_ID;Leaf_ID``), one column per threshold
+    and ``%_Inf``, so it can be joined with manual scores.
+
+    Like `cli.reanalyse`, plates whose lanes were segmented with other frame or lane settings
+    than those of `setting_file` (see `lane_cache.settings_digest`) are skipped.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Lane cache directory, see `macrobot.lane_cache`.
+    setting_file : str
+        Path to the configuration file with the leaf segmentation parameters.
+    rule_set : RuleSet
+        The rule set of the predictor, see `rules.load_rules`.
+    grid : dict
+        The values to sweep for every threshold, see `parse_grid`.
+    file_sweep : file object
+        Output file for the table.
+    procedure : str, optional
+        Only plates cached by this segmentation pipeline (its ``NAME``) are used.
+
+    Returns
+    -------
+    tuple
+        The number of leaves in the sweep and the list of skipped lane containers, which are not
+        valid or were created with other lane settings.
+
+    Example
+    -------
+    >>> saturation = rules.load_rules('settings_ipk.ini')['saturation']
+    >>> with open('sweep.csv', 'w') as fh:
+    ...     sweep_lane_cache('mb_cache', 'settings_ipk.ini', saturation, parse_grid(saturation, []), fh)
+    """
+    cuts = _cut_points(rule_set, grid)
+    names = list(grid)
+
+    leaves = []
+    histograms = []
+    skipped = []
+    digests = {}
+    for experiment, dai, cache_file in lane_cache.iter_cached_plates(cache_dir):
+        metadata = lane_cache.read_metadata(cache_file)
+        if metadata is None:
+            skipped.append(cache_file)
+            continue
+        if procedure and metadata['procedure'] != procedure:
+            continue
+        if metadata['procedure'] not in digests:
+            digests[metadata['procedure']] = lane_cache.settings_digest(setting_file, metadata['procedure'])
+        # Lanes segmented with other frame or lane settings do not match the setting file
+        if metadata.get('settings') != digests[metadata['procedure']]:
+            skipped.append(cache_file)
+            continue
+
+        metadata, lanes_roi_rgb, lanes_roi_backlight, lanes_roi_binary = lane_cache.load_lanes(cache_file)
+
+        plate_id = metadata['plate_id']
+        for lane_position, leaf_id, rgb, backlight, leaf_mask in plate_leaves(
+                setting_file, lanes_roi_rgb, lanes_roi_backlight, lanes_roi_binary):
+            unique_ID = f"{experiment}_{plate_id.split('_')[-1]}_{lane_position}"
+            leaves.append(f"{unique_ID};{experiment};{dai};{plate_id};{lane_position};{leaf_id}")
+            histograms.append(leaf_histogram(rule_set, rgb, backlight, leaf_mask, cuts))
+
+    file_sweep.write(';'.join(['index', 'expNr', 'dai', 'Plate_ID', 'Lane_ID', 'Leaf_ID'] + names + ['%_Inf']) + '\n')
+    if not histograms:
+        return 0, skipped
+
+    for thresholds, percent_infection in sweep_histograms(rule_set, histograms, grid):
+        values = ';'.join(str(thresholds[name]) for name in names)
+        for leaf, percent in zip(leaves, percent_infection):
+            file_sweep.write(f"{leaf};{values};{percent}\n")
+
+    return len(leaves), skipped
@@ -1,28 +1,179 @@
 import os
+import sys
 import argparse
+import functools
 import re
+import sqlite3
 from pathlib import Path
 from macrobot.puccinia import RustSegmenter
 from macrobot.puccinia_ipk import RustSegmenterIPK
 from macrobot.bgt import BgtSegmenter
 from macrobot.bipolaris import BipolarisSegmenter
 from macrobot.net_blotch_latrobe import NetBlotchSegmenter
+from macrobot import buffers
+from macrobot import calibration
+from macrobot import events
+from macrobot import lane_cache
 from macrobot import orga
+from macrobot import overlays
+from macrobot import preview
+from macrobot import qc
+from macrobot import results
+from macrobot import rules
+from macrobot import stage_cache
+from macrobot import store
+from macrobot import training_data
 
+# Segmentation pipelines by procedure name
+SEGMENTERS = {
+    'rust': RustSegmenter,
+    'rust_ipk': RustSegmenterIPK,
+    'mildew': BgtSegmenter,
+    'bipolaris': BipolarisSegmenter,
+    'netblotch': NetBlotchSegmenter
+}
 
-def main():
+
+def add_pipeline_arguments(parser):
+    """Add the procedure and hardware arguments shared by all analysis commands."""
+    parser.add_argument('-p', '--procedure', required=True,
+                        choices=list(SEGMENTERS),
+                        help='Pathogen to analyze: rust, rust_ipk, mildew, bipolaris, or netblotch.')
+    parser.add_argument('-hw', '--hardware', required=True,
+                        choices=['ipk', 'latrobe'],
+                        help='Hardware type: "ipk" or "latrobe".')
+
+
+def add_rules_argument(parser):
+    """Add the argument selecting the prediction rule set."""
+    parser.add_argument('--rules', default=None,
+                        help='Name of the prediction rule set, e.g. one defined in a "[RULES <name>]" section '
+                             'of the setting file. Defaults to the rule set of the procedure.')
+
+
+def select_rule_set(parser, args, segmenter_class, setting_file):
+    """Return the prediction rule set selected with --rules, the rule set of the procedure by default."""
+    rule_sets = rules.load_rules(setting_file)
+    rule_set = rule_sets.get(args.rules or segmenter_class.PREDICTOR)
+    if rule_set is None:
+        parser.error(f"Unknown rule set '{args.rules}', available: {', '.join(rule_sets)}")
+    return rule_set
+
+
+def add_prediction_arguments(parser):
+    """Add the arguments to keep the feature images of the lanes and to restrict the prediction to the leaves."""
+    parser.add_argument('--debug', action='store_true',
+                        help='Save the feature images of the lanes next to the predictions.')
+    parser.add_argument('--roi-prediction', action='store_true',
+                        help='Only predict the pixels of the scored leaves. The prediction images of the '
+                             'whole lanes are not saved, unless --debug is given.')
+
+
+def add_verbosity_argument(parser):
+    """Add the argument selecting which events of the run are printed."""
+    parser.add_argument('--verbosity', default='info', choices=events.VERBOSITIES,
+                        help='Print events of this severity or higher (default info), "warning" or "quiet" for '
+                             'production runs. All events from info on are written to '
+                             f'"{events.EVENTS_NAME}" in the destination directory.')
+
+
+def open_event_log(destination_path, verbosity):
+    """Open the event log of a run in the destination directory."""
+    return events.EventLog(os.path.join(destination_path, events.EVENTS_NAME), verbosity=verbosity)
+
+
+def hardware_settings(hardware, source_path):
+    """
+    Return the setting file and the training data location for a hardware type.
+
+    :param hardware: Hardware type, "ipk" or "latrobe".
+    :param source_path: Directory containing the images to segment.
+    :return: A tuple (setting_file, store_leaf_path).
+    """
+    if hardware == 'ipk':
+        setting_file = "settings_ipk.ini"
+        # For IPK, we collect training data
+        path = Path(source_path)
+        store_leaf_path = Path('//psg-09/Mikroskop/Images/Training_data_hsm/').joinpath(*path.parts[-2:])
+        #print (store_leaf_path)
+    elif hardware == 'latrobe':
+        #matt
+        setting_file = "settings_latrobe.ini"
+        store_leaf_path = None
+    else:
+        # This else block is optional since argparse enforces choices
+        raise ValueError(f"Unsupported hardware type: {hardware}")
+    return setting_file, store_leaf_path
+
+
+def add_results_argument(parser):
+    """Add the argument selecting the output format of the results per leaf."""
+    parser.add_argument('--results-format', default='csv', choices=results.FORMATS,
+                        help='Format of the results per leaf: the ";" separated "<experiment>_leaf.csv" (default), '
+                             'compressed columnar arrays or a SQLite database.')
+
+
+def add_store_arguments(parser):
+    """Add the arguments selecting the results store every run adds its results to."""
+    parser.add_argument('--results-db', default=None, metavar='PATH',
+                        help='SQLite results store for "mb query". Defaults to the MACROBOT_RESULTS_DB '
+                             'environment variable or ~/.macrobot/results.sqlite.')
+    parser.add_argument('--no-results-db', action='store_true',
+                        help='Do not add the results to the results store.')
+
+
+def open_store(args):
+    """Open the results store of a run, None if disabled."""
+    if args.no_results_db:
+        return None
+    return store.ResultsStore(args.results_db)
+
+
+def open_results(destination_path, experiment, dai, results_format='csv', results_store=None):
+    """
+    Open the results sink recording the results of an experiment and dai, e.g. the CSV file with its header.
+
+    The results are also added to the results store, if given.
+    """
+    os.makedirs(os.path.join(destination_path, experiment, dai), exist_ok=True)
+    sink = results.open_sink(results_format, os.path.join(destination_path, experiment, dai, f'{experiment}_leaf'))
+    if results_store is not None:
+        sink = results.TeeSink(sink, results_store)
+    return sink
+
+
+def analyse(argv=None):
+    """Run the Macrobot pipeline on all experiments in the source directory."""
     # Create argument parser to handle command-line inputs
     parser = argparse.ArgumentParser(description='Macrobot analysis software.')
     parser.add_argument('-s', '--source_path', required=True,
                         help='Directory containing images to segment.')
     parser.add_argument('-d', '--destination_path', required=True,
                         help='Directory to store the result images.')
-    parser.add_argument('-p', '--procedure', required=True,
-                        choices=['rust', 'rust_ipk', 'mildew', 'bipolaris', 'netblotch'],
-                        help='Pathogen to analyze: rust, rust_ipk, mildew, bipolaris, or netblotch.')
-    parser.add_argument('-hw', '--hardware', required=True,
-                        choices=['ipk', 'latrobe'],
-                        help='Hardware type: "ipk" or "latrobe".')
+    add_pipeline_arguments(parser)
+    parser.add_argument('--lane-cache', default=None,
+                        help='Directory to store the segmented lanes for "mb reanalyse".')
+    parser.add_argument('--cache-dir', default=None,
+                        help='Directory of the stage cache. Plates analysed before with the same images and '
+                             'settings restart from the deepest cached stage.')
+    parser.add_argument('--cache-size', type=float, default=stage_cache.CACHE_SIZE / 2 ** 30, metavar='GB',
+                        help='Size of the stage cache, the least recently used entries are removed first '
+                             '(default: %(default)g GB).')
+    parser.add_argument('--qc', action='store_true',
+                        help='Check every plate on thumbnails first and only analyse the plates which pass. '
+                             'The results are written to "<experiment>_qc.csv", the thresholds are read from '
+                             'the QC section of the setting file.')
+    parser.add_argument('--preview', type=float, default=None, metavar='SCALING_FACTOR',
+                        help='Run a fast preview with a reduced scaling factor of the raw images, e.g. 0.125. '
+                             'The pixel based segmentation settings are rescaled, the %%_Inf is approximate.')
+    parser.add_argument('--preview-sample', type=int, default=0, metavar='PLATES',
+                        help='Number of plates per experiment and dai which are also analysed at full '
+                             'resolution to report the agreement of the preview.')
+    add_results_argument(parser)
+    add_store_arguments(parser)
+    add_rules_argument(parser)
+    add_prediction_arguments(parser)
+    add_verbosity_argument(parser)
 
     # Define current path and set up the data directory for test images
     CURRENT_PATH = os.path.dirname(os.path.abspath(__file__))
@@ -32,7 +183,9 @@ def main():
     orga.download_test_images(data_path)
 
     # Parse command-line arguments
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    if args.preview_sample and args.results_format != 'csv':
+        parser.error('--preview-sample compares the CSV results, use --results-format csv')
 
     # Assign the source path from arguments, default to test images if specified
     source_path = args.source_path
@@ -43,32 +196,31 @@ def main():
     destination_path = args.destination_path
 
     # Determine the segmentation method based on the selected procedure
-    segmenter_class = {
-        'rust': RustSegmenter,
-        'rust_ipk': RustSegmenterIPK,
-        'mildew': BgtSegmenter,
-        'bipolaris': BipolarisSegmenter,
-        'netblotch': NetBlotchSegmenter
-    }.get(args.procedure)
+    segmenter_class = SEGMENTERS.get(args.procedure)
 
     # Raise an error if an invalid procedure is provided
     if not segmenter_class:
         raise argparse.ArgumentError(None, f"Invalid segmentation method '{args.procedure}'")
 
     # Set the setting_file based on the hardware parameter
-    if args.hardware == 'ipk':
-        setting_file = "settings_ipk.ini"
-        # For IPK, we collect training data
-        path = Path(source_path)
-        store_leaf_path = Path('//psg-09/Mikroskop/Images/Training_data_hsm/').joinpath(*path.parts[-2:])
-        #print (store_leaf_path)
-    elif args.hardware == 'latrobe':
-        #matt
-        setting_file = "settings_latrobe.ini"
+    setting_file, store_leaf_path = hardware_settings(args.hardware, source_path)
+    full_setting_file = setting_file
+    if args.preview:
+        # Preview leaves are not stored as training data
+        setting_file = preview.write_preview_settings(setting_file, args.preview, destination_path)
         store_leaf_path = None
-    else:
-        # This else block is optional since argparse enforces choices
-        raise ValueError(f"Unsupported hardware type: {args.hardware}")
+    # Build the lookup tables of the prediction before the first plate, instead of while analysing it
+    rules.build_tables([select_rule_set(parser, args, segmenter_class, path)
+                        for path in (setting_file, full_setting_file)])
+
+    # The plates of one run have the same size, so their arrays are reused from plate to plate
+    buffer_pool = buffers.worker_pool()
+    # The approximate results of a preview are not added to the results store
+    results_store = None if args.preview else open_store(args)
+    event_log = open_event_log(destination_path, args.verbosity)
+    plate_cache = None
+    if args.cache_dir:
+        plate_cache = stage_cache.StageCache(args.cache_dir, max_bytes=int(args.cache_size * 2 ** 30))
 
     # List all experiments (subdirectories) in the source directory
     experiments = os.listdir(source_path)
@@ -78,19 +230,32 @@ def main():
             dais = os.listdir(os.path.join(source_path, experiment))
 
             for dai in dais:
-                # Create output directory for the current 'dai' (if it doesn't already exist)
-                os.makedirs(os.path.join(destination_path, experiment, dai), exist_ok=True)
-
                 # Print progress information
-                print(f'\n=== Start Macrobot pipeline === \n Experiment: {experiment}')
+                event_log.info('run', f'\n=== Start Macrobot pipeline === \n Experiment: {experiment}',
+                               experiment=experiment, dai=dai)
 
-                # Open a CSV file to record results for the current experiment and dai
-                file_results = open(os.path.join(destination_path, experiment, dai, f'{experiment}_leaf.csv'), 'w')
-                file_results.write('index;expNr;dai;Plate_ID;Lane_ID;Leaf_ID;%_Inf\n')
+                # Create the output directory and open a CSV file to record results for the current experiment and dai
+                file_results = open_results(destination_path, experiment, dai, args.results_format,
+                                            results_store)
+                qc_report = qc.open_report(destination_path, experiment, dai) if args.qc else None
+                # The leaves are packed into tar shards on the training data share
+                leaf_writer = None
+                if store_leaf_path is not None:
+                    leaf_writer = training_data.ShardWriter(store_leaf_path,
+                                                            prefix=f'{experiment}_{dai}_{event_log.run_id}')
 
                 # List all plates in the current 'dai' directory
                 plates = os.listdir(os.path.join(source_path, experiment, dai))
 
+                # Plates of a preview which are also analysed at full resolution
+                sample = []
+                if args.preview:
+                    sample = preview.sample_plates([plate for plate in plates
+                                                    if not re.search('colou?r', plate, re.IGNORECASE)],
+                                                   args.preview_sample)
+                    full_destination_path = os.path.join(destination_path, 'full_resolution')
+                    full_results = open_results(full_destination_path, experiment, dai) if sample else None
+
                 for plate in plates:
 
                     # Skip directories that don't match the required naming conventions (e.g., color/colour)
@@ -107,21 +272,281 @@ def main():
                             images,
                             img_dir,
                             destination_path,
-                            store_leaf_path,
+                            leaf_writer,
                             experiment,
                             dai,
                             file_results,
-                            setting_file  # Pass the setting_file parameter
+                            setting_file,  # Pass the setting_file parameter
+                            lane_cache_dir=args.lane_cache,
+                            rule_name=args.rules,
+                            debug=args.debug,
+                            roi_prediction=args.roi_prediction,
+                            buffer_pool=buffer_pool,
+                            qc_report=qc_report,
+                            event_log=event_log,
+                            stage_cache=plate_cache
                         )
 
                         # Start the segmentation pipeline
                         processor.start_pipeline()
+
+                        if plate in sample:
+                            segmenter_class(images, img_dir, full_destination_path, None, experiment, dai,
+                                            full_results, full_setting_file, rule_name=args.rules,
+                                            buffer_pool=buffer_pool, event_log=event_log).start_pipeline()
+
+                file_results.close()
+                if leaf_writer is not None:
+                    close_leaf_writer(event_log, leaf_writer, experiment, dai)
+                orga.create_experiment_report(destination_path, experiment, dai, file_results.name)
+                if qc_report is not None:
+                    qc_report.close()
+                if sample:
+                    full_results.close()
+                    summary = preview.write_agreement_report(
+                        os.path.join(destination_path, experiment, dai, f'{experiment}_preview_agreement.csv'),
+                        preview.read_leaf_results(file_results.name), preview.read_leaf_results(full_results.name))
+                    event_log.info('preview', preview.format_agreement(summary), experiment=experiment, dai=dai,
+                                   **{name: value for name, value in summary.items() if value is not None})
         except NotADirectoryError:
             # Skip any files or invalid directories in the source path
-            print(f'Skip {os.path.join(source_path, experiment)} because it is not a valid directory.')
+            event_log.warning('run', f'Skip {os.path.join(source_path, experiment)} because it is not a valid directory.',
+                              experiment=experiment)
 
         # Print completion message for the current experiment
-        print('\n=== End Macrobot pipeline ===')
+        event_log.info('run', '\n=== End Macrobot pipeline ===', experiment=experiment)
+
+    if results_store is not None:
+        results_store.close()
+    log_buffer_stats(event_log, buffer_pool)
+    if plate_cache is not None:
+        stats = plate_cache.stats()
+        event_log.info('cache', f"Stage cache: {stats['hits']} stages restored, {stats['stored']} stored, "
+                                f"{stats['evicted']} removed", **stats)
+    event_log.close()
+
+
+def close_leaf_writer(event_log, leaf_writer, experiment, dai):
+    """Complete the training data shards of an experiment and dai, a failing share does not stop the run."""
+    try:
+        stats = leaf_writer.close()
+    except OSError as error:
+        event_log.warning('training_data', f'Training data not stored in {leaf_writer.path}: {error}',
+                          experiment=experiment, dai=dai)
+        return
+    event_log.info('training_data', f"Training data: {stats['samples']} leaves in {stats['shards']} shards "
+                                    f"({stats['mb_per_second']:.1f} MB/s)", experiment=experiment, dai=dai, **stats)
+
+
+def log_buffer_stats(event_log, buffer_pool):
+    """Record how many plate arrays were reused from the buffer pool."""
+    stats = buffer_pool.stats()
+    event_log.info('run', f"Buffer pool: {stats['hits']} arrays reused, {stats['misses']} allocated "
+                          f"({stats['allocated_bytes'] / 2 ** 20:.1f} MB)", **stats)
+
+
+def reanalyse(argv=None):
+    """Re-run feature extraction, prediction and leaf scoring from a lane cache."""
+    parser = argparse.ArgumentParser(prog='mb reanalyse',
+                                     description='Re-analyse plates from lanes cached with --lane-cache.')
+    parser.add_argument('-c', '--cache_path', required=True,
+                        help='Lane cache directory written by a previous run.')
+    parser.add_argument('-d', '--destination_path', required=True,
+                        help='Directory to store the result images.')
+    add_pipeline_arguments(parser)
+    add_results_argument(parser)
+    add_store_arguments(parser)
+    add_rules_argument(parser)
+    add_prediction_arguments(parser)
+    add_verbosity_argument(parser)
+    args = parser.parse_args(argv)
+
+    segmenter_class = SEGMENTERS[args.procedure]
+    # Training data was already collected by the original run
+    setting_file, _ = hardware_settings(args.hardware, args.cache_path)
+    current_settings = lane_cache.settings_digest(setting_file, segmenter_class.NAME)
+    rules.build_tables([select_rule_set(parser, args, segmenter_class, setting_file)])
+
+    results_store = open_store(args)
+    event_log = open_event_log(args.destination_path, args.verbosity)
+    sinks = {}
+    for experiment, dai, cache_file in lane_cache.iter_cached_plates(args.cache_path):
+        metadata = lane_cache.read_metadata(cache_file)
+        if metadata is None:
+            event_log.warning('reanalysis', f"Skip {cache_file} because it is not a valid lane container.",
+                              experiment=experiment, dai=dai)
+            continue
+
+        # Lanes segmented with other frame or lane settings do not match the current configuration
+        if metadata['settings'] != current_settings:
+            event_log.warning('reanalysis', f"Skip {cache_file} because it was created with other lane settings or "
+                                            f"another procedure.", experiment=experiment, dai=dai)
+            continue
+
+        if (experiment, dai) not in sinks:
+            event_log.info('run', f'\n=== Start Macrobot re-analysis === \n Experiment: {experiment}',
+                           experiment=experiment, dai=dai)
+            sinks[(experiment, dai)] = open_results(args.destination_path, experiment, dai, args.results_format,
+                                                   results_store)
+
+        processor = segmenter_class(
+            metadata['image_list'],
+            None,
+            args.destination_path,
+            None,
+            experiment,
+            dai,
+            sinks[(experiment, dai)],
+            setting_file,
+            rule_name=args.rules,
+            debug=args.debug,
+            roi_prediction=args.roi_prediction,
+            event_log=event_log
+        )
+        processor.start_reanalysis(cache_file)
+
+    for file_results in sinks.values():
+        file_results.close()
+    if results_store is not None:
+        results_store.close()
+
+    event_log.info('run', '\n=== End Macrobot re-analysis ===')
+    event_log.close()
+
+
+def sweep(argv=None):
+    """Evaluate a grid of prediction thresholds on the leaves of a lane cache."""
+    parser = argparse.ArgumentParser(prog='mb sweep',
+                                     description='Threshold sweep for calibrating the pathogen prediction.')
+    parser.add_argument('-c', '--cache_path', required=True,
+                        help='Lane cache directory written by a previous run.')
+    parser.add_argument('-o', '--output', required=True,
+                        help='CSV file for the %%_Inf per leaf and threshold combination.')
+    add_pipeline_arguments(parser)
+    add_rules_argument(parser)
+    parser.add_argument('-t', '--threshold', action='append', default=[],
+                        help='Threshold values to sweep, e.g. "saturation=100:160:10" or "backlight=800,1000". '
+                             'Thresholds are named after the channel of their condition in the rule set, '
+                             'thresholds not given keep their value.')
+    args = parser.parse_args(argv)
+
+    segmenter_class = SEGMENTERS[args.procedure]
+    setting_file, _ = hardware_settings(args.hardware, args.cache_path)
+    rule_set = select_rule_set(parser, args, segmenter_class, setting_file)
+    try:
+        grid = calibration.parse_grid(rule_set, args.threshold)
+    except ValueError as error:
+        parser.error(str(error))
+
+    with open(args.output, 'w') as file_sweep:
+        leaf_count, skipped = calibration.sweep_lane_cache(args.cache_path, setting_file, rule_set, grid,
+                                                           file_sweep, procedure=segmenter_class.NAME)
+
+    for cache_file in skipped:
+        print(f"Skip {cache_file} because it is not a valid lane container or was created with other lane settings.")
+
+    print(f'Swept {leaf_count} leaves, results written to {args.output}')
+
+
+def render(argv=None):
+    """Render the images with the leaf hulls from the leaf polygons of the plates."""
+    parser = argparse.ArgumentParser(prog='mb render',
+                                     description='Render the lane and plate images with the detected leaves.')
+    parser.add_argument('-d', '--destination_path', required=True,
+                        help='Results directory of a run or a re-analysis.')
+    parser.add_argument('--experiment', default=None, help='Only plates of this experiment.')
+    parser.add_argument('--dai', default=None, help='Only plates of this dai.')
+    parser.add_argument('--workers', type=int, default=4, help='Number of plates rendered at the same time.')
+    parser.add_argument('--force', action='store_true', help='Render images which are up to date again.')
+    args = parser.parse_args(argv)
+
+    plates = overlays.find_plates(args.destination_path, args.experiment, args.dai)
+    rendered = overlays.render_plates(plates, force=args.force, workers=args.workers)
+    print(f'Rendered {rendered} images of {len(plates)} plates')
+
+
+def query(argv=None):
+    """Print aggregated infection statistics from the results store."""
+    parser = argparse.ArgumentParser(prog='mb query',
+                                     description='Aggregated %%_Inf of the leaves in the results store.')
+    parser.add_argument('--experiment', default=None, help='Only leaves of this experiment, e.g. MB0274.')
+    parser.add_argument('--dai', default=None, help='Only leaves of this dai, e.g. 7dai.')
+    parser.add_argument('--plate', default=None, help='Only leaves of this plate.')
+    parser.add_argument('--by', default='dai', choices=list(store.GROUPS),
+                        help='Compute the statistics per experiment, dai (default), plate or lane.')
+    parser.add_argument('--db', default=None,
+                        help='Path of the results store, defaults to the MACROBOT_RESULTS_DB environment '
+                             'variable or ~/.macrobot/results.sqlite.')
+    args = parser.parse_args(argv)
+
+    try:
+        statistics = store.query(args.db, experiment=args.experiment, dai=args.dai, plate_id=args.plate,
+                                 group_by=args.by)
+    except FileNotFoundError as error:
+        parser.exit(1, f'{error}\n')
+
+    columns = store.GROUPS[args.by] + store.STATISTICS
+    print(';'.join(columns))
+    for row in statistics:
+        print(';'.join(f'{row[column]:.2f}' if isinstance(row[column], float) else str(row[column])
+                       for column in columns))
+
+
+def ingest(argv=None):
+    """Merge the results files of all experiments with their metadata and export them to the database."""
+    parser = argparse.ArgumentParser(prog='mb ingest',
+                                     description='Batch ingestion of Macrobot results into the database.')
+    parser.add_argument('-s', '--source_path', required=True,
+                        help='Results directory with the "<experiment>/<dai>/<experiment>_leaf.csv" files.')
+    parser.add_argument('-m', '--metadata', required=True,
+                        help='Tab separated metadata file of the plates.')
+    parser.add_argument('-o', '--output_path', required=True,
+                        help='Directory of the merged files and the record of the ingested files.')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='Number of results files ingested at the same time.')
+    parser.add_argument('--no-export', action='store_true',
+                        help='Only merge the results files, do not export them to the database.')
+    parser.add_argument('--sqlite', default=None, metavar='PATH',
+                        help='Export into the MACROBOT_DB table of a SQLite database instead of Oracle.')
+    parser.add_argument('--db-config', default=None,
+                        help='JSON file with the connection settings of the Oracle database.')
+    parser.add_argument('--instant-client', default=None,
+                        help='Directory of the Oracle instant client.')
+    args = parser.parse_args(argv)
+
+    # pandas is only needed by this command
+    from macrobot import data_managment
+
+    if args.sqlite:
+        connect = functools.partial(sqlite3.connect, args.sqlite)
+        date_expression = ':{column}'
+    else:
+        options = {'config_path': args.db_config, 'client_path': args.instant_client}
+        connect = functools.partial(data_managment.oracle_connection,
+                                    **{name: value for name, value in options.items() if value is not None})
+        date_expression = data_managment.ORACLE_DATE
+
+    stats = data_managment.ingest(args.source_path, args.metadata, args.output_path, workers=args.workers,
+                                  export=not args.no_export, connect=connect, date_expression=date_expression)
+    return 1 if stats['failed'] else 0
+
+
+# Sub-commands, the pipeline itself is run when no sub-command is given
+COMMANDS = {
+    'reanalyse': reanalyse,
+    'sweep': sweep,
+    'render': render,
+    'query': query,
+    'ingest': ingest,
+}
+
+
+def main(argv=None):
+    """Entry point of the ``mb`` command."""
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in COMMANDS:
+        return COMMANDS[argv[0]](argv[1:])
+    return analyse(argv)
 
 
 if __name__ == "__main__":
@@ -1,23 +1,108 @@
+"""
+Archiving of the Macrobot images and export of the results to the database.
+
+Importing the module has no side effects. pandas and the database drivers are only imported
+by the functions which need them, so the copy functions can be used in lightweight workers.
+"""
+
+import argparse
 import shutil
 import os
+import hashlib
 import json
-import cx_Oracle
-import pandas as pd
-from pathlib import Path
-import numpy as np
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Name of the manifest of the copied files in the destination directory
+MANIFEST_NAME = 'macrobot_manifest.jsonl'
+# Bytes read and written at once while copying
+COPY_CHUNK_SIZE = 4 * 2 ** 20
+
+
+def read_manifest(path, name=MANIFEST_NAME):
+    """
+    Read the manifest of a destination directory.
+
+    Args:
+        path (str): Destination directory.
+        name (str): File name of the manifest.
+
+    Returns:
+        dict: The last record of every file by relative path, e.g. with its ``size``, ``mtime_ns`` and ``sha256``.
+    """
+    manifest = {}
+    manifest_file = os.path.join(path, name)
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # The last line of an interrupted copy may be incomplete
+                    continue
+                manifest[record['path']] = record
+    return manifest
+
+
+def file_sha256(path):
+    """Return the SHA-256 checksum of a file."""
+    checksum = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(COPY_CHUNK_SIZE), b''):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def copy_file(src_file, dest_file):
+    """
+    Copy a file with its metadata and compute its checksum while copying.
 
-# Temporarily adjust display settings
-pd.set_option('display.max_rows', None)  # Show all rows
-pd.set_option('display.max_columns', None)  # Show all columns
-pd.set_option('display.width', None)  # Adjust width for wide DataFrames
+    The file is written under a temporary name and renamed once complete, so an interrupted
+    copy never leaves an incomplete file behind.
 
-def copy_and_verify(path1, path2):
+    Args:
+        src_file (str): Source file.
+        dest_file (str): Destination file.
+
+    Returns:
+        str: The SHA-256 checksum of the copied data.
+
+    Raises:
+        ValueError: If the size of the copy differs from the source file.
+    """
+    checksum = hashlib.sha256()
+    partial = dest_file + '.partial'
+    size = 0
+    with open(src_file, 'rb') as src, open(partial, 'wb') as dest:
+        for chunk in iter(lambda: src.read(COPY_CHUNK_SIZE), b''):
+            checksum.update(chunk)
+            dest.write(chunk)
+            size += len(chunk)
+    shutil.copystat(src_file, partial)
+    if size != os.path.getsize(src_file) or os.path.getsize(partial) != size:
+        os.remove(partial)
+        raise ValueError(f"File '{src_file}' changed or was not completely copied.")
+    os.replace(partial, dest_file)
+    return checksum.hexdigest()
+
+
+def copy_and_verify(path1, path2, workers=8):
     """
     Copies all folders and files from psg-09 to hsm and verifies the copy.
 
+    Files are copied in parallel and their checksums are written to a manifest in the
+    destination directory. Files whose size and modification time match the manifest (or the
+    checksum of an existing copy) are skipped, so an interrupted copy can be resumed.
+
     Args:
         path1 (str): Source directory.
         path2 (str): Destination directory.
+        workers (int): Number of files copied at the same time.
+
+    Returns:
+        dict: Number of ``copied``, ``skipped`` and ``failed`` files and the copied ``bytes``,
+        None if the copy failed.
 
     Raises:
         ValueError: If the copy verification fails.
@@ -30,71 +115,134 @@ def copy_and_verify(path1, path2):
         if not os.path.exists(path2):
             os.makedirs(path2)
 
-        # Copy files and directories
-        for root, dirs, files in os.walk(path1):
-            # Create destination folder structure
+        # Create destination folder structure and list the files
+        files = []
+        for root, dirs, names in os.walk(path1):
             relative_path = os.path.relpath(root, path1)
             destination_dir = os.path.join(path2, relative_path)
             if not os.path.exists(destination_dir):
                 os.makedirs(destination_dir)
-
-            # Copy files
-            for file in files:
-                src_file = os.path.join(root, file)
-                dest_file = os.path.join(destination_dir, file)
-                shutil.copy2(src_file, dest_file)
+            for name in names:
+                files.append(os.path.normpath(os.path.join(relative_path, name)))
+
+        manifest = read_manifest(path2)
+        stats = {'copied': 0, 'skipped': 0, 'failed': 0, 'bytes': 0}
+
+        def copy(relative_file):
+            src_file = os.path.join(path1, relative_file)
+            dest_file = os.path.join(path2, relative_file)
+            src_stat = os.stat(src_file)
+            record = manifest.get(relative_file)
+            if os.path.exists(dest_file):
+                dest_stat = os.stat(dest_file)
+                same = (dest_stat.st_size == src_stat.st_size and dest_stat.st_mtime_ns == src_stat.st_mtime_ns)
+                if same and record is not None and (record['size'], record['mtime_ns']) == \
+                        (src_stat.st_size, src_stat.st_mtime_ns):
+                    return None
+                # Copies without a manifest record, e.g. of earlier versions, are compared by checksum
+                if same and record is None:
+                    checksum = file_sha256(dest_file)
+                    if checksum == file_sha256(src_file):
+                        return {'path': relative_file, 'size': src_stat.st_size, 'mtime_ns': src_stat.st_mtime_ns,
+                                'sha256': checksum}, 0
+            checksum = copy_file(src_file, dest_file)
+            return {'path': relative_file, 'size': src_stat.st_size, 'mtime_ns': src_stat.st_mtime_ns,
+                    'sha256': checksum}, src_stat.st_size
+
+        start = time.perf_counter()
+        with open(os.path.join(path2, MANIFEST_NAME), 'a') as manifest_file, \
+                ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(copy, relative_file): relative_file for relative_file in files}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except (OSError, ValueError) as e:
+                    print(f"Error copying '{futures[future]}': {e}")
+                    stats['failed'] += 1
+                    continue
+                if result is None or not result[1]:
+                    stats['skipped'] += 1
+                else:
+                    stats['copied'] += 1
+                    stats['bytes'] += result[1]
+                if result is not None:
+                    # Completed files are recorded at once, so an interrupted copy is resumed from here
+                    manifest[result[0]['path']] = result[0]
+                    manifest_file.write(json.dumps(result[0]) + '\n')
+                    manifest_file.flush()
+        seconds = time.perf_counter() - start
 
         # Verify the copy
-        for root, dirs, files in os.walk(path1):
-            relative_path = os.path.relpath(root, path1)
-            destination_dir = os.path.join(path2, relative_path)
-
-            for file in files:
-                src_file = os.path.join(root, file)
-                dest_file = os.path.join(destination_dir, file)
-                if not os.path.exists(dest_file):
-                    raise ValueError(f"File '{dest_file}' is missing in the destination.")
+        for relative_file in files:
+            dest_file = os.path.join(path2, relative_file)
+            if not os.path.exists(dest_file) or relative_file not in manifest:
+                raise ValueError(f"File '{dest_file}' is missing in the destination.")
+            if os.path.getsize(dest_file) != manifest[relative_file]['size']:
+                raise ValueError(f"File '{dest_file}' differs from the source.")
+
+        # Rewrite the manifest with one record per file
+        partial = os.path.join(path2, MANIFEST_NAME + '.partial')
+        with open(partial, 'w') as manifest_file:
+            for relative_file in sorted(files):
+                manifest_file.write(json.dumps(manifest[relative_file]) + '\n')
+        os.replace(partial, os.path.join(path2, MANIFEST_NAME))
 
         print(f"All files and folders successfully copied from '{path1}' to '{path2}'.")
+        print(f"{stats['copied']} files copied ({stats['bytes'] / 2 ** 20:.1f} MB in {seconds:.1f} s, "
+              f"{stats['bytes'] / 2 ** 20 / seconds if seconds else 0:.1f} MB/s), "
+              f"{stats['skipped']} files already copied.")
+        return stats
     except Exception as e:
         print(f"An error occurred: {e}")
 
 
-def process_and_merge_files(excel_file, csv_file, identifier, output_file):
+# Metadata files by path and modification time, see `load_metadata`
+_METADATA = {}
 
-    # Extract the first word after splitting the filenames by '_'
-    excel_base = os.path.basename(excel_file).split('_')[0]
-    csv_base = os.path.basename(csv_file).split('_')[0]
 
-    if csv_base.startswith('gb2'):
-        csv_base = csv_base + '_' + os.path.basename(csv_file).split('_')[1]
+def load_metadata(excel_file):
+    """
+    Read a metadata file and add its `plate_index` column.
 
-    if output_file is None:
-        output_file = r"\\psg-09\Mikroskop\Images\hsm_db\\" + csv_base + '_db.csv'
+    The file is read once and reused for all results files merged with it, until it changes.
 
-    # Read the Excel file
-    df1 = pd.read_csv(excel_file, delimiter='\t')
-    df1.columns = df1.columns.str.replace('-', '_')
-    df1 = df1.drop(columns=['dai'], errors='ignore')
+    :param excel_file: Tab separated metadata file with the experiment, plate_id and lane_id columns.
+    :return: The metadata, which must not be modified.
+    """
+    import pandas as pd
 
-    # Read the CSV file
-    df2 = pd.read_csv(csv_file, delimiter=';')
+    key = (os.path.abspath(excel_file), os.path.getmtime(excel_file))
+    if key not in _METADATA:
+        df1 = pd.read_csv(excel_file, delimiter='\t')
+        df1.columns = df1.columns.str.replace('-', '_')
+        df1 = df1.drop(columns=['dai'], errors='ignore')
+        df1['plate_index'] = (df1['experiment'].astype(str) + '-' + df1['plate_id'] + '-'
+                              + df1['lane_id'].astype(str)).str.replace('-', '_')
+        _METADATA[key] = df1
+    return _METADATA[key]
 
 
-    # Create the `plate_index` column by splitting `Plate_ID` and taking the last entry
-    #print(df2['Plate_ID'])
-    # only if plate id is with underscore
-    df2['Plate_ID'] = df2['Plate_ID'].apply(lambda x: '-'.join(x.rsplit('_', 1)))
-    #print(df2['Plate_ID'])
-    df2['plate_index'] = df2['expNr'].astype(str) + '-' + df2['Plate_ID'].apply(lambda x: x.split('_')[-1]) + '-' + df2['Lane_ID'].astype(str)
+def merge_leaf_results(df1, csv_file, identifier):
+    """
+    Merge the results per leaf of an experiment with its metadata.
 
-    df1['plate_index'] = df1['experiment'].astype(str) + '-' + df1['plate_id'] + '-' + df1['lane_id'].astype(str)
+    :param df1: The metadata, see `load_metadata`.
+    :param csv_file: The ``<experiment>_leaf.csv`` file of the pipeline.
+    :param identifier: Column the files are merged on, e.g. plate_index.
+    :return: The merged results.
+    """
+    import pandas as pd
 
-    df1['plate_index'] = df1['plate_index'].str.replace('-', '_')
-    df2['plate_index'] = df2['plate_index'].str.replace('-', '_')
-    #df2['plate_index'] = df2['plate_index'].str.replace('_exp79_', '_')
-    #df2['plate_index'] = df2['plate_index'].str.replace('__', '_')
-    #print (df2['plate_index'], df1['plate_index'])
+    # Extract the first word after splitting the filenames by '_'
+    csv_base = experiment_name(csv_file)
+
+    # Read the CSV file
+    df2 = pd.read_csv(csv_file, delimiter=';')
+
+    # Replace the last underscore of `Plate_ID` and build the `plate_index` from its last part
+    df2['Plate_ID'] = df2['Plate_ID'].astype(str).str.replace(r'_([^_]*)$', r'-\1', regex=True)
+    df2['plate_index'] = (df2['expNr'].astype(str) + '-' + df2['Plate_ID'].str.rsplit('_', n=1).str[-1] + '-'
+                          + df2['Lane_ID'].astype(str)).str.replace('-', '_')
 
     # Check if both DataFrames contain the identifier column
     if identifier not in df1.columns:
@@ -107,13 +255,10 @@ def process_and_merge_files(excel_file, csv_file, identifier, output_file):
     merged_df = merged_df.drop(columns=['expNr', 'barcode'], errors='ignore')
     # Add a new column `type` with the value `macrobot`
     merged_df['type'] = 'macrobot'
-    # Add a new column `url1` with the path `\\hsm\AGR-BIM\macrobot\ + csv_base`
-    merged_df['url1'] = merged_df.apply(
-        lambda row: f"\\\\hsm\\AGR-BIM\\macrobot\\{row['experiment']}\\{row['dai']}", axis=1
-    )
-    merged_df['url2'] = merged_df.apply(
-        lambda row: f"\\\\hsm\\AGR-BIM\\Results\\BluVisionMacro\\{row['experiment']}\\{row['dai']}", axis=1
-    )
+    # Add the paths of the images and the results of the experiment and dai
+    location = merged_df['experiment'].astype(str) + '\\' + merged_df['dai'].astype(str)
+    merged_df['url1'] = '\\\\hsm\\AGR-BIM\\macrobot\\' + location
+    merged_df['url2'] = '\\\\hsm\\AGR-BIM\\Results\\BluVisionMacro\\' + location
     # Validate the merged DataFrame
     if len(merged_df.columns) < len(df2.columns):
         raise ValueError("Merged DataFrame does not contain at least as many columns as the CSV file.")
@@ -126,142 +271,368 @@ def process_and_merge_files(excel_file, csv_file, identifier, output_file):
     merged_df = merged_df.rename(columns={'%_Inf': 'INFECTION', 'Lane_ID': 'LANE_ID2', 'Plate_ID': 'PLATE_ID2',
                                           'index': 'index_', 'user': 'user_'})
     merged_df['experiment'] = csv_base
-    # Save the merged DataFrame to a new CSV file
-    print (len(merged_df), len(df2))
-    merged_df.to_csv(output_file, index=False, sep=";")
+    return merged_df
+
+
+def experiment_name(csv_file):
+    """Return the experiment of a results file, the first part of its name (two parts for gb2 experiments)."""
+    parts = os.path.basename(csv_file).split('_')
+    if parts[0].startswith('gb2'):
+        return parts[0] + '_' + parts[1]
+    return parts[0]
+
+
+def merge_files(excel_file, csv_files, identifier, output_files=None):
+    """
+    Merge the results files of several experiments or dai with one metadata file.
+
+    :param excel_file: Tab separated metadata file.
+    :param csv_files: The ``<experiment>_leaf.csv`` files.
+    :param identifier: Column the files are merged on, e.g. plate_index.
+    :param output_files: Path of the merged file per results file, None for the default path on psg-09.
+    :return: The paths of the merged files.
+    """
+    df1 = load_metadata(excel_file)
+    if output_files is None:
+        output_files = [None] * len(csv_files)
+
+    written = []
+    for csv_file, output_file in zip(csv_files, output_files):
+        if output_file is None:
+            output_file = r"\\psg-09\Mikroskop\Images\hsm_db\\" + experiment_name(csv_file) + '_db.csv'
+        # Save the merged DataFrame to a new CSV file
+        merge_leaf_results(df1, csv_file, identifier).to_csv(output_file, index=False, sep=";")
+        written.append(output_file)
+    return written
 
 
-def export_db(csv_file_path):
-    os.chdir('C:/instantclient_19_3/')
+def process_and_merge_files(excel_file, csv_file, identifier, output_file):
+    """Merge a results file with its metadata file, see `merge_files`."""
+    merge_files(excel_file, [csv_file], identifier, [output_file])
+
+
+# Columns of the database table which hold dates
+DATE_COLUMNS = ('SAW_DATE', 'INOC_DATE')
+# Date used if a date column has no valid date at all
+DEFAULT_DATE = '1900-01-01'
+# Bind expression of the date columns in the insert statement
+ORACLE_DATE = "TO_DATE(:{column}, 'YYYY-MM-DD')"
+# Directory of the Oracle instant client loaded by this process, see `init_oracle_client`
+_oracle_client_path = None
+_oracle_client_lock = threading.Lock()
+
+
+def init_oracle_client(client_path):
+    """
+    Load the Oracle instant client, once per process.
+
+    The client is loaded by its directory, the working directory of the process is not changed,
+    so connections can be opened from several threads.
+
+    :param client_path: Directory of the Oracle instant client.
+    """
+    global _oracle_client_path
+    import cx_Oracle
+
+    with _oracle_client_lock:
+        if _oracle_client_path is None:
+            cx_Oracle.init_oracle_client(lib_dir=client_path)
+            _oracle_client_path = client_path
+
+
+def oracle_connection(config_path='C:/Users/lueck/PycharmProjects/macrobot/macrobot/config.json',
+                      client_path='C:/instantclient_19_3/'):
+    """
+    Connect to the Oracle database of the Macrobot results.
+
+    :param config_path: JSON file with the ip, port, service_name, username and password of the database.
+    :param client_path: Directory of the Oracle instant client.
+    :return: A DB-API connection.
+    """
+    import cx_Oracle
+
+    init_oracle_client(client_path)
 
     # Load configuration from a JSON file
-    with open('C:/Users/lueck/PycharmProjects/macrobot/macrobot/config.json', 'r') as config_file:
+    with open(config_path, 'r') as config_file:
         config = json.load(config_file)
 
-    # Extract the configuration parameters
-    ip = config['ip']
-    port = config['port']
-    service_name = config['service_name']
-    username = config['username']
-    password = config['password']
-    # Construct the DSN
-    dsn = cx_Oracle.makedsn(ip, port, service_name=service_name)
-    # Connect to the database
-    db_con = cx_Oracle.connect(username, password, dsn)
-    # Create a cursor
-    cursor = db_con.cursor()
-    # Query the database table
-    cursor.execute("SELECT * FROM MACROBOT_DB")
+    # Construct the DSN and connect to the database
+    dsn = cx_Oracle.makedsn(config['ip'], config['port'], service_name=config['service_name'])
+    return cx_Oracle.connect(config['username'], config['password'], dsn)
 
-    # Get the database table column headers
-    db_headers = [x[0] for x in cursor.description]
 
-    # Load CSV file
-    csv_data = pd.read_csv(csv_file_path, delimiter=';')
+def prepare_export(csv_data, db_headers):
+    """
+    Convert the columns of a merged results table to the values inserted into the database.
+
+    Dates are formatted as ``YYYY-MM-DD`` (`DEFAULT_DATE` if a date column has no valid date),
+    missing numbers and empty texts become NULL and other missing texts ``NA``.
+
+    :param csv_data: The merged results, see `process_and_merge_files`.
+    :param db_headers: The column names of the database table.
+    :return: The columns of the table with the values to insert.
+    """
+    import pandas as pd
+
+    csv_data = csv_data.copy()
     csv_data.columns = [col.upper() for col in csv_data.columns]  # Convert CSV headers to uppercase
-    #csv_data['DAI'] = csv_data['DAI'].str.replace('dai', '')
-
-    csv_data = csv_data.fillna('NA')
-
-    # Format date columns
-    date_columns = ['SAW_DATE', 'INOC_DATE']
-    for col in date_columns:
-        if col in csv_data.columns:
-            csv_data[col] = pd.to_datetime(csv_data[col], errors='coerce')
-            csv_data[col] = csv_data[col].dt.strftime('%Y-%m-%d')
-            if csv_data[col].isna().all():
-                csv_data[col] = pd.Timestamp('1900-01-01')  # Example default date
-
-    # Compare and ensure CSV columns exist in the database
-    matching_headers = set(db_headers).intersection(csv_data.columns)
-    if not matching_headers:
-        print("No matching columns between CSV and database.")
-        return
-
-    # Insert CSV data into the database
-    for _, row in csv_data.iterrows():
-        # Prepare the columns and values for the SQL statement
-        columns = ', '.join([col for col in db_headers if col in csv_data.columns])
-        values = ', '.join([
-            f"TO_DATE(:{col}, 'YYYY-MM-DD')" if col in date_columns else f":{col}"
-            for col in db_headers if col in csv_data.columns
-        ])
-        sql = f"INSERT INTO MACROBOT_DB ({columns}) VALUES ({values})"
-
-        # Prepare the parameters dictionary
-        params = {}
-        for col in db_headers:
-            if col in csv_data.columns:
-                value = row[col]
-                if col in date_columns:  # Handle date columns
+    csv_data = csv_data[[col for col in db_headers if col in csv_data.columns]]
+
+    for col in csv_data.columns:
+        values = csv_data[col]
+        if col in DATE_COLUMNS:
+            dates = pd.to_datetime(values, errors='coerce')
+            if dates.isna().all():
+                csv_data[col] = DEFAULT_DATE
+            else:
+                csv_data[col] = dates.dt.strftime('%Y-%m-%d').astype(object).where(dates.notna(), None)
+        elif pd.api.types.is_numeric_dtype(values):
+            csv_data[col] = values.astype(object).where(values.notna(), None)
+        else:
+            values = values.fillna('NA').astype(object)
+            csv_data[col] = values.where(values.astype(str).str.strip() != '', None)
+    return csv_data
+
+
+def export_db(csv_file_path, connect=oracle_connection, table='MACROBOT_DB', batch_size=1000,
+              date_expression=ORACLE_DATE, replace=None):
+    """
+    Insert a merged results file into the database.
+
+    The rows are inserted with ``executemany`` in batches. If a batch fails, its rows are
+    inserted one by one and the failing rows are reported.
+
+    With `replace`, the rows of the database with the same values in these columns as the rows
+    of the file (e.g. the experiment and dai) are deleted first. The deletion and all batches are
+    one transaction, which is rolled back if a row cannot be inserted.
+
+    :param csv_file_path: The ``;`` separated file written by `process_and_merge_files`.
+    :param connect: Function returning a DB-API connection with the ``named`` parameter style,
+                    e.g. ``lambda: sqlite3.connect(path)`` for a local database.
+    :param table: Name of the table.
+    :param batch_size: Number of rows per ``executemany``.
+    :param date_expression: Bind expression of the date columns, ``:{column}`` to bind the
+                            ``YYYY-MM-DD`` texts directly.
+    :param replace: Columns identifying the rows the file replaces, e.g. `REPLACE_COLUMNS` (optional).
+    :return: The number of inserted rows.
+    :raises ValueError: With `replace`, if rows cannot be inserted or the file lacks the columns.
+    """
+    import pandas as pd
+
+    db_con = connect()
+    cursor = db_con.cursor()
+    try:
+        # Get the database table column headers
+        cursor.execute(f"SELECT * FROM {table} WHERE 1 = 0")
+        db_headers = [x[0] for x in cursor.description]
+
+        # Load CSV file and compare with the database columns
+        csv_data = prepare_export(pd.read_csv(csv_file_path, delimiter=';'), db_headers)
+        if csv_data.columns.empty:
+            print("No matching columns between CSV and database.")
+            return 0
+
+        # The statement is the same for all rows
+        columns = list(csv_data.columns)
+        values = ', '.join(date_expression.format(column=col) if col in DATE_COLUMNS else f":{col}"
+                           for col in columns)
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({values})"
+
+        start = time.perf_counter()
+        if replace:
+            if not set(replace) <= set(columns):
+                raise ValueError(f"{csv_file_path} has no columns {', '.join(replace)} to replace rows by.")
+            where = ' AND '.join(f'{col} = :{col}' for col in replace)
+            cursor.executemany(f"DELETE FROM {table} WHERE {where}",
+                               csv_data[list(replace)].drop_duplicates().to_dict('records'))
+
+        inserted = 0
+        failed = 0
+        for offset in range(0, len(csv_data), batch_size):
+            rows = csv_data.iloc[offset:offset + batch_size].to_dict('records')
+            if replace:
+                cursor.execute("SAVEPOINT export_batch")
+            try:
+                cursor.executemany(sql, rows)
+                inserted += len(rows)
+            except Exception:
+                # Find the rows which cannot be inserted
+                if replace:
+                    cursor.execute("ROLLBACK TO SAVEPOINT export_batch")
+                else:
+                    db_con.rollback()
+                for row in rows:
                     try:
-                        # Attempt to parse the date; if invalid, use a default
-                        value = pd.to_datetime(value, errors='coerce').strftime('%Y-%m-%d') if pd.notnull(
-                            value) else None
-                    except Exception:
-                        value = None  # Fallback for invalid dates
-                elif isinstance(value, str) and not value.strip():  # Handle empty strings for numeric fields
-                    value = None
-                elif pd.isnull(value):  # Handle NaN values
-                    value = None
-                params[col] = value
-
-        try:
-            cursor.execute(sql, params)
-        except cx_Oracle.DatabaseError as e:
-            print(f"Error inserting row: {row}\n{e}")
-
-    # Commit changes to the database
-    db_con.commit()
-    print("Data from CSV inserted successfully into the database.")
-    #cursor.execute("SELECT * FROM MACROBOT_DB")
-   #rv = cursor.fetchall()
-    #for result in rv:
-     #   print(result)
-
-    # Close the cursor and connection
-    cursor.close()
-    db_con.close()
-  
+                        cursor.execute(sql, row)
+                        inserted += 1
+                    except Exception as e:
+                        failed += 1
+                        print(f"Error inserting row: {row}\n{e}")
+            # Commit every batch, so a failing batch does not roll back earlier ones
+            if not replace:
+                db_con.commit()
+
+        if replace:
+            # The replaced rows are only deleted if the whole file is inserted
+            if failed:
+                db_con.rollback()
+                raise ValueError(f"{failed} rows of {csv_file_path} could not be inserted into {table}.")
+            db_con.commit()
+
+        seconds = time.perf_counter() - start
+        print(f"{inserted} rows from CSV inserted into {table} in {seconds:.2f} s "
+              f"({inserted / seconds if seconds else 0:.0f} rows/s).")
+        return inserted
+    finally:
+        # Close the cursor and connection
+        cursor.close()
+        db_con.close()
+
+
+# Record of the ingested results files in the directory of the merged files
+INGESTED_NAME = 'macrobot_ingested.jsonl'
+# Columns identifying the rows of a results file in the database, which are replaced when it changes
+REPLACE_COLUMNS = ('EXPERIMENT', 'DAI')
+
+
+def find_leaf_files(source_path):
+    """
+    Find the results files of all experiments and dai, ``<experiment>/<dai>/*_leaf.csv``.
+
+    Args:
+        source_path (str): Results directory of the pipeline.
+
+    Returns:
+        list: The paths of the results files.
+    """
+    leaf_files = []
+    with os.scandir(source_path) as experiments:
+        for experiment in experiments:
+            if not experiment.is_dir():
+                continue
+            with os.scandir(experiment.path) as dais:
+                for dai in dais:
+                    if not dai.is_dir():
+                        continue
+                    with os.scandir(dai.path) as entries:
+                        leaf_files.extend(entry.path for entry in entries
+                                          if entry.name.endswith('_leaf.csv') and entry.is_file())
+    return sorted(leaf_files)
+
+
+def ingest(source_path, metadata_file, merged_path, identifier='plate_index', workers=4, export=True,
+           connect=oracle_connection, date_expression=ORACLE_DATE):
+    """
+    Merge the results files of all experiments with their metadata and export them to the database.
+
+    The files are merged and exported in parallel. Ingested files are recorded in the directory
+    of the merged files and skipped by later runs until they change. The export of a changed file
+    replaces the rows of its experiment and dai in the database. Files with rows which cannot be
+    inserted are reported as failed and ingested again by the next run.
+
+    Args:
+        source_path (str): Results directory of the pipeline, see `find_leaf_files`.
+        metadata_file (str): Tab separated metadata file, see `load_metadata`.
+        merged_path (str): Directory of the merged ``<experiment>_<dai>_db.csv`` files.
+        identifier (str): Column the files are merged on.
+        workers (int): Number of files ingested at the same time.
+        export (bool): Export the merged files to the database, see `export_db`.
+        connect: Function returning a DB-API connection to the database.
+        date_expression (str): Bind expression of the date columns, see `export_db`.
+
+    Returns:
+        dict: Number of ``ingested``, ``skipped`` and ``failed`` files, the exported ``rows`` and the
+        ``errors`` by file.
+    """
+    os.makedirs(merged_path, exist_ok=True)
+    df1 = load_metadata(metadata_file)
+    ingested = read_manifest(merged_path, INGESTED_NAME)
+
+    pending = []
+    stats = {'ingested': 0, 'skipped': 0, 'failed': 0, 'rows': 0, 'errors': {}}
+    for csv_file in find_leaf_files(source_path):
+        relative_file = os.path.relpath(csv_file, source_path)
+        stat = os.stat(csv_file)
+        record = ingested.get(relative_file)
+        if record is not None and (record['size'], record['mtime_ns']) == (stat.st_size, stat.st_mtime_ns) \
+                and (record['exported'] or not export):
+            stats['skipped'] += 1
+        else:
+            pending.append((relative_file, stat))
+
+    def ingest_file(relative_file, stat):
+        csv_file = os.path.join(source_path, relative_file)
+        dai = os.path.basename(os.path.dirname(csv_file))
+        output_file = os.path.join(merged_path, f'{experiment_name(csv_file)}_{dai}_db.csv')
+        merge_leaf_results(df1, csv_file, identifier).to_csv(output_file, index=False, sep=";")
+        rows = export_db(output_file, connect=connect, date_expression=date_expression,
+                         replace=REPLACE_COLUMNS) if export else 0
+        return {'path': relative_file, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'output': output_file,
+                'exported': export, 'rows': rows}
+
+    start = time.perf_counter()
+    with open(os.path.join(merged_path, INGESTED_NAME), 'a') as ingested_file, \
+            ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(ingest_file, *file): file[0] for file in pending}
+        for future in as_completed(futures):
+            try:
+                record = future.result()
+            except Exception as e:
+                print(f"Error ingesting '{futures[future]}': {e}")
+                stats['failed'] += 1
+                stats['errors'][futures[future]] = str(e)
+                continue
+            stats['ingested'] += 1
+            stats['rows'] += record['rows']
+            ingested_file.write(json.dumps(record) + '\n')
+            ingested_file.flush()
+
+    print(f"{stats['ingested']} files ingested ({stats['rows']} rows exported) in "
+          f"{time.perf_counter() - start:.1f} s, {stats['skipped']} files already ingested, "
+          f"{stats['failed']} files failed.")
+    return stats
+
+
 def old_mb_data():
-    #for old data
-    #Define the source directory
-    source_dir = os.listdir(r"\\psg-09\Mikroskop\Images\BluVisionMacro")
-    # Use glob to search recursively for files ending with _leaf.csv
-    leaf_csv_files = []
-
-    # Walk through all directories and files
-    for folder in source_dir:
-        folder_dai = os.listdir(r"\\psg-09\Mikroskop\Images\BluVisionMacro\\" + folder)
-        for dai in folder_dai:
-            if not dai.endswith('.txt'):
-                #print (folder, folder_dai, dai)
-                csv_dir =  os.listdir(r"\\psg-09\Mikroskop\Images\BluVisionMacro\\" + folder + '\\' + '\\' + dai)
-                for csv in csv_dir:
-                    if csv.endswith('_leaf.csv'):
-                        #print (folder, folder_dai, dai, csv)
-                        print (folder)
-                        process_and_merge_files("meta_empty.csv",
-                                                r"\\psg-09\Mikroskop\Images\BluVisionMacro\\" + folder + '\\' + dai + '\\' + csv,
-                                                "plate_index", r"\\psg-09\Mikroskop\Images\hsm_db\\" + folder + "_db.csv")
-
-    # # Use glob to search recursively for files ending with _leaf.csv
-    leaf_csv_files = os.listdir(r"\\psg-09\Mikroskop\Images\hsm_db\\")
-
-    # Check if any files were found
-
-    for file in leaf_csv_files[1:]:
-        print (file)
-        try:
-            export_db(r"\\psg-09\Mikroskop\Images\hsm_db\\" + file)
-        except:
-            print ('erorr')
-
-
-exp_name = "MB0274"
-dai = "/7dai/"
-process_and_merge_files("//psg-09/Mikroskop/Exchange/!to_analyze/metadata/MB/" + exp_name + "_meta.csv", "//psg-09/Mikroskop/Images/BluVisionMacro/" + exp_name + dai + exp_name + "_leaf.csv", "plate_index", None)
-#export_db("//psg-09/Mikroskop/Images/hsm_db/" + exp_name + "_db.csv")
-#copy_and_verify("//psg-09/Mikroskop/Images/BluVisionMacro/" + exp_name + dai, "//hsm/AGR-BIM/Results/BluVisionMacro/" + exp_name + dai)
+    """Ingest all results of the BluVisionMacro directory on psg-09, see `ingest`."""
+    ingest(r"\\psg-09\Mikroskop\Images\BluVisionMacro", "meta_empty.csv", r"\\psg-09\Mikroskop\Images\hsm_db")
+
 
+def main(argv=None):
+    """
+    Command line of the data management steps of one experiment, e.g.::
 
+        python -m macrobot.data_managment merge MB0274_meta.csv BluVisionMacro/MB0274/7dai/MB0274_leaf.csv
+        python -m macrobot.data_managment export hsm_db/MB0274_db.csv
+        python -m macrobot.data_managment copy BluVisionMacro/MB0274/7dai Results/BluVisionMacro/MB0274/7dai
+
+    Use ``mb ingest`` for many experiments.
+    """
+    parser = argparse.ArgumentParser(prog='python -m macrobot.data_managment',
+                                     description='Merge, export and archive the results of an experiment.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    merge = commands.add_parser('merge', help='Merge a results file with its metadata file.')
+    merge.add_argument('metadata', help='Tab separated metadata file.')
+    merge.add_argument('csv_file', help='The <experiment>_leaf.csv file.')
+    merge.add_argument('-o', '--output', default=None,
+                       help='Merged file, defaults to <experiment>_db.csv in hsm_db on psg-09.')
+    export = commands.add_parser('export', help='Export a merged file to the database.')
+    export.add_argument('csv_file', help='The merged file.')
+    export.add_argument('--batch-size', type=int, default=1000, help='Number of rows inserted at once.')
+    copy = commands.add_parser('copy', help='Copy a directory to the archive and verify the copy.')
+    copy.add_argument('source', help='Source directory.')
+    copy.add_argument('destination', help='Destination directory.')
+    copy.add_argument('--workers', type=int, default=8, help='Number of files copied at the same time.')
+    args = parser.parse_args(argv)
+
+    if args.command == 'merge':
+        process_and_merge_files(args.metadata, args.csv_file, 'plate_index', args.output)
+    elif args.command == 'export':
+        export_db(args.csv_file, batch_size=args.batch_size)
+    else:
+        copy_and_verify(args.source, args.destination, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Structured event log of a run.
+
+The pipeline records what it does as events, e.g. the start of a plate, warnings about missing
+lanes or the counters of a finished plate. Every event is one JSON line with the run ID, the
+process, the experiment, dai and plate, the stage, the severity, a message and counters::
+
+    {"time": 1718000000.0, "run_id": "20240610-101500-3f2a", "pid": 4242, "severity": "warning",
+     "stage": "lanes", "experiment": "MB0274", "dai": "7dai", "plate": "P01", "message": "...",
+     "counters": {"lanes": 3}}
+
+Each worker buffers its events and appends them in one write to ``macrobot_events.jsonl`` in the
+results directory, so events of parallel workers do not interleave. Events at or above the
+verbosity are also printed; ``quiet`` prints nothing.
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+
+# Severities of the events, in increasing order
+SEVERITIES = ('debug', 'info', 'warning', 'error')
+VERBOSITIES = SEVERITIES + ('quiet',)
+
+# File name of the event log in the results directory
+EVENTS_NAME = 'macrobot_events.jsonl'
+
+
+def new_run_id() -> str:
+    """Return a new run ID, the start time and a random suffix."""
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:4]}"
+
+
+class EventLog(object):
+    """
+    Buffered JSON lines event log.
+
+    Attributes:
+        path (str): Path of the log file, None to only print the events.
+        run_id (str): ID of the run the events belong to.
+        verbosity (str): Events of this severity or higher are printed, one of `VERBOSITIES`.
+        buffer_size (int): Number of buffered events which triggers a write.
+    """
+
+    def __init__(self, path=None, run_id=None, verbosity='info', buffer_size=100):
+        if verbosity not in VERBOSITIES:
+            raise ValueError(f"Unknown verbosity '{verbosity}', available: {', '.join(VERBOSITIES)}")
+        self.path = path
+        self.run_id = run_id or new_run_id()
+        self.verbosity = verbosity
+        self.buffer_size = buffer_size
+        # Debug events are only recorded if they are printed
+        self._min_level = min(VERBOSITIES.index(verbosity), SEVERITIES.index('info'))
+        self._echo_level = VERBOSITIES.index(verbosity)
+        self._lines = []
+        self._lock = threading.Lock()
+
+    def enabled(self, severity: str) -> bool:
+        """Return whether events of a severity are recorded, e.g. to skip building expensive messages."""
+        return SEVERITIES.index(severity) >= self._min_level
+
+    def event(self, severity: str, stage: str, message: str, experiment=None, dai=None, plate=None,
+              **counters) -> None:
+        """
+        Record an event.
+
+        :param severity: One of `SEVERITIES`.
+        :param stage: Stage of the pipeline, e.g. ``qc`` or ``lanes``.
+        :param message: Description of the event.
+        :param experiment: Experiment of the event (optional).
+        :param dai: Dai of the event (optional).
+        :param plate: Plate of the event (optional).
+        :param counters: Numbers describing the event, e.g. ``lanes=3``.
+        """
+        level = SEVERITIES.index(severity)
+        if level < self._min_level:
+            return
+        if level >= self._echo_level:
+            print(message)
+        if self.path is None:
+            return
+        line = json.dumps({'time': round(time.time(), 3), 'run_id': self.run_id, 'pid': os.getpid(),
+                           'severity': severity, 'stage': stage, 'experiment': experiment, 'dai': dai,
+                           'plate': plate, 'message': message, 'counters': counters})
+        with self._lock:
+            self._lines.append(line)
+            if len(self._lines) >= self.buffer_size or severity == 'error':
+                self._flush()
+
+    def debug(self, stage, message, **fields):
+        self.event('debug', stage, message, **fields)
+
+    def info(self, stage, message, **fields):
+        self.event('info', stage, message, **fields)
+
+    def warning(self, stage, message, **fields):
+        self.event('warning', stage, message, **fields)
+
+    def error(self, stage, message, **fields):
+        self.event('error', stage, message, **fields)
+
+    def flush(self) -> None:
+        """Write all buffered events."""
+        with self._lock:
+            self._flush()
+
+    def close(self) -> None:
+        self.flush()
+
+    def _flush(self):
+        if self._lines:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            # A single append, so the events of parallel workers are not interleaved
+            data = ''.join(line + '\n' for line in self._lines).encode()
+            descriptor = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(descriptor, data)
+            finally:
+                os.close(descriptor)
+            self._lines = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_events(path: str, run_id=None) -> list:
+    """
+    Read an event log.
+
+    :param path: Path of the log file.
+    :param run_id: Only events of this run (optional).
+    :return: The events as dictionaries.
+    """
+    with open(path) as file:
+        events = [json.loads(line) for line in file if line.strip()]
+    return [event for event in events if run_id is None or event['run_id'] == run_id]
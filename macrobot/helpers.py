@@ -13,7 +13,7 @@ in the HSV color space.
 import numpy as np
 import cv2
 
-def wb_helper(channel: np.ndarray, perc: float) -> np.ndarray:
+def wb_helper(channel: np.ndarray, perc: float, out: np.ndarray = None) -> np.ndarray:
     """
     Perform white balancing on a single image channel using percentile-based scaling.
 
@@ -27,6 +27,8 @@ def wb_helper(channel: np.ndarray, perc: float) -> np.ndarray:
         A 1-channel image represented as a NumPy array.
     perc : float
         The percentile value used for clipping. Typically a small percentage like 1 or 2.
+    out : numpy.ndarray, optional
+        A uint8 array to store the result in, may be `channel` itself.
 
     Returns
     -------
@@ -40,15 +42,82 @@ def wb_helper(channel: np.ndarray, perc: float) -> np.ndarray:
     # Calculate the lower and upper percentile values
     mi = np.percentile(channel, perc)
     ma = np.percentile(channel, 100.0 - perc)
+    return _scale_channel(channel, mi, ma, out)
 
+
+def _scale_channel(channel: np.ndarray, mi: float, ma: float, out: np.ndarray = None) -> np.ndarray:
     # Clip the channel to the percentile range and scale to [0, 255]
     scaled_channel = (channel - mi) * 255.0 / (ma - mi)
-    channel_balanced = np.clip(scaled_channel, 0, 255).astype(np.uint8)
+    if out is None:
+        return np.clip(scaled_channel, 0, 255).astype(np.uint8)
+
+    np.copyto(out, np.clip(scaled_channel, 0, 255), casting='unsafe')
+    return out
+
+
+def whitebalance_lut(channel: np.ndarray, perc: float) -> np.ndarray:
+    """
+    Lookup table performing the white balancing of `wb_helper` on a uint8 channel.
+
+    The percentiles are computed on the channel values sorted by counting, which avoids
+    partitioning a copy of the channel, and the scaling is computed once per value.
+    Applying the table gives the same result as `wb_helper`.
+
+    Parameters
+    ----------
+    channel : numpy.ndarray
+        A 1-channel uint8 image.
+    perc : float
+        The percentile value used for clipping.
+
+    Returns
+    -------
+    numpy.ndarray
+        The uint8 lookup table with 256 entries.
+
+    Example
+    -------
+    >>> balanced_channel = cv2.LUT(channel, whitebalance_lut(channel, 1.0))
+    """
+    values = np.arange(256, dtype=np.uint8)
+    sorted_channel = np.repeat(values, np.bincount(channel.ravel(), minlength=256))
+    mi = np.percentile(sorted_channel, perc)
+    ma = np.percentile(sorted_channel, 100.0 - perc)
+    return _scale_channel(values, mi, ma)
+
+
+def merge_whitebalanced(channels: tuple, perc: float, out: np.ndarray = None) -> np.ndarray:
+    """
+    Merge uint8 channels into one white-balanced image.
+
+    The channels are interleaved into `out` once and their white balance lookup tables
+    are applied in place, which gives the same image as merging the channels and calling
+    `whitebalance` without the intermediate float arrays.
+
+    Parameters
+    ----------
+    channels : tuple
+        The 1-channel uint8 images, e.g. (blue, green, red).
+    perc : float
+        The percentile value used for clipping in each channel.
+    out : numpy.ndarray, optional
+        A uint8 array with one channel per image to store the result in.
 
-    return channel_balanced
+    Returns
+    -------
+    numpy.ndarray
+        The white-balanced image.
+
+    Example
+    -------
+    >>> image_rgb = merge_whitebalanced((image_blue, image_green, image_red), perc=1.0)
+    """
+    luts = np.dstack([whitebalance_lut(channel, perc) for channel in channels])
+    out = cv2.merge(channels, dst=out)
+    return cv2.LUT(out, luts, dst=out)
 
 
-def whitebalance(image: np.ndarray, perc: float = 1.0) -> np.ndarray:
+def whitebalance(image: np.ndarray, perc: float = 1.0, out: np.ndarray = None) -> np.ndarray:
     """
     Perform white balancing on a 3-channel RGB image using percentile-based scaling.
 
@@ -62,6 +131,8 @@ def whitebalance(image: np.ndarray, perc: float = 1.0) -> np.ndarray:
         A 3-channel RGB image represented as a NumPy array.
     perc : float, optional
         The percentile value used for clipping in each channel. Defaults to 1.0.
+    out : numpy.ndarray, optional
+        A uint8 array to store the result in, may be `image` itself.
 
     Returns
     -------
@@ -72,16 +143,19 @@ def whitebalance(image: np.ndarray, perc: float = 1.0) -> np.ndarray:
     -------
     >>> balanced_image = whitebalance(image, perc=1.0)
     """
-    # Split the image into its individual color channels
-    image_split = np.dsplit(image, image.shape[-1])
+    if image.dtype == np.uint8:
+        # Apply the lookup tables of all channels at once
+        luts = np.dstack([whitebalance_lut(image[:, :, index], perc) for index in range(image.shape[-1])])
+        return cv2.LUT(image, luts, dst=out)
 
-    # Apply white balancing to each channel using the helper function
-    balanced_channels = [wb_helper(channel, perc) for channel in image_split]
+    if out is None:
+        out = np.empty(image.shape, dtype=np.uint8)
 
-    # Merge the balanced channels back into a single image
-    image_wb = np.dstack(balanced_channels)
+    # Apply white balancing to each channel using the helper function
+    for index in range(image.shape[-1]):
+        wb_helper(image[:, :, index], perc, out=out[:, :, index])
 
-    return image_wb
+    return out
 
 
 def rgb_features(image_array: np.ndarray, feature_type: str) -> np.ndarray:
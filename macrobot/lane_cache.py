@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Per-plate cache of segmented lanes for re-analysis.
+
+Segmenting lanes requires decoding, resizing and white-balancing the raw TIFF
+images of a plate, which dominates the run time of the pipeline. The lane ROIs
+only depend on the raw images and on a handful of segmentation settings, so they
+can be stored once and replayed whenever only the prediction thresholds or the
+leaf scoring parameters change.
+
+Each plate is stored as one compressed ``.npz`` container holding the RGB,
+backlight and binary lane images together with a small JSON metadata record.
+"""
+
+import hashlib
+import json
+import os
+from configparser import ConfigParser
+
+import numpy as np
+
+#: Settings the lane ROIs depend on, as (section, option) pairs.
+LANE_SETTINGS = (
+    ('HARDWARE1', 'scaling_factor'),
+    ('SEGMENTATION', 'whitebalance'),
+    ('SEGMENTATION', 'last_x'),
+    ('SEGMENTATION', 'min_frame_area'),
+    ('SEGMENTATION', 'max_frame_area'),
+    ('SEGMENTATION', 'max_solidity'),
+    ('SEGMENTATION', 'max_ratio'),
+    ('SEGMENTATION', 'offset_width'),
+    ('SEGMENTATION', 'offset_height'),
+    ('SEGMENTATION', 'offset_x'),
+    ('SEGMENTATION', 'offset_y'),
+    ('SEGMENTATION', 'width_min'),
+    ('SEGMENTATION', 'width_max'),
+    ('SEGMENTATION', 'max_x_distance'),
+    ('SEGMENTATION', 'bordersize'),
+    ('SEGMENTATION', 'lane_positions'),
+    ('SEGMENTATION', 'noise_thresh'),
+    ('SEGMENTATION', 'fix_noise_row_offset'),
+)
+
+# Lane positions may be None, which is stored as -1 in the container
+_NO_POSITION = -1
+
+
+def file_digest(path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    Compute the SHA-1 digest of a file without loading it into memory at once.
+
+    Parameters
+    ----------
+    path : str
+        Path of the file to hash.
+    chunk_size : int, optional
+        Number of bytes read per iteration. Defaults to 1 MiB.
+
+    Returns
+    -------
+    str
+        The hexadecimal SHA-1 digest of the file content.
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def settings_digest(setting_file: str, procedure: str) -> str:
+    """
+    Compute a digest of the settings values the lane ROIs depend on.
+
+    Parameters
+    ----------
+    setting_file : str
+        Path to the configuration file containing segmentation parameters.
+    procedure : str
+        Name of the segmentation pipeline (e.g. ``BgtSegmenter.NAME``). Pipelines
+        differ in frame detection and white balance, so the name is part of the digest.
+
+    Returns
+    -------
+    str
+        The hexadecimal SHA-1 digest of the relevant settings.
+    """
+    config = ConfigParser()
+    config.read(setting_file)
+
+    digest = hashlib.sha1(procedure.encode())
+    for section, option in LANE_SETTINGS:
+        value = config.get(section, option, fallback=None)
+        digest.update(f'{section}.{option}={value}\n'.encode())
+    return digest.hexdigest()
+
+
+def cache_key(image_paths: list, setting_file: str, procedure: str) -> str:
+    """
+    Build the cache key of a plate from its raw images and the lane settings.
+
+    Parameters
+    ----------
+    image_paths : list
+        Paths of the raw images of the plate.
+    setting_file : str
+        Path to the configuration file containing segmentation parameters.
+    procedure : str
+        Name of the segmentation pipeline.
+
+    Returns
+    -------
+    str
+        The hexadecimal cache key.
+
+    Example
+    -------
+    >>> key = cache_key(['/data/P01_red.tif', '/data/P01_green.tif'], 'settings_ipk.ini', 'BGT')
+    """
+    digest = hashlib.sha1()
+    for path in sorted(image_paths):
+        digest.update(f'{os.path.basename(path)}:{file_digest(path)}\n'.encode())
+    digest.update(settings_digest(setting_file, procedure).encode())
+    return digest.hexdigest()
+
+
+def cache_path(cache_dir: str, experiment: str, dai: str, plate_id: str) -> str:
+    """Return the location of the lane container of a plate inside `cache_dir`."""
+    return os.path.join(cache_dir, experiment, dai, f'{plate_id}.npz')
+
+
+def read_metadata(path: str):
+    """
+    Return the metadata of a lane container without decompressing the lanes.
+
+    Parameters
+    ----------
+    path : str
+        Path of the lane container.
+
+    Returns
+    -------
+    dict or None
+        The plate information including the cache key under ``key``, or None if there is no valid container.
+    """
+    try:
+        with np.load(path) as container:
+            return json.loads(str(container['metadata']))
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def read_key(path: str):
+    """Return the cache key stored in a lane container, or None if there is no valid container."""
+    metadata = read_metadata(path)
+    return metadata['key'] if metadata else None
+
+
+def save_lanes(path: str, key: str, metadata: dict, lanes_roi_rgb: list, lanes_roi_backlight: list,
+               lanes_roi_binary: list) -> None:
+    """
+    Store the segmented lanes of a plate in a compressed container.
+
+    Parameters
+    ----------
+    path : str
+        Destination of the container, see `cache_path`.
+    key : str
+        The cache key of the plate, see `cache_key`.
+    metadata : dict
+        JSON serializable plate information (plate id, experiment, dai, image list, ...).
+    lanes_roi_rgb : list
+        A list of [lane position, RGB ROI] pairs.
+    lanes_roi_backlight : list
+        A list of [lane position, backlight ROI] pairs.
+    lanes_roi_binary : list
+        A list of [lane position, binary lane image] pairs.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    positions = [_NO_POSITION if lane[0] is None else lane[0] for lane in lanes_roi_rgb]
+    arrays = {'positions': np.array(positions, dtype=np.int64)}
+    for lane_id in range(len(lanes_roi_rgb)):
+        arrays[f'rgb_{lane_id}'] = lanes_roi_rgb[lane_id][1]
+        arrays[f'backlight_{lane_id}'] = lanes_roi_backlight[lane_id][1]
+        arrays[f'binary_{lane_id}'] = lanes_roi_binary[lane_id][1]
+
+    record = dict(metadata, key=key)
+    # Write to a temporary file first, so an interrupted run never leaves a truncated container behind
+    tmp_path = path + '.tmp.npz'
+    np.savez_compressed(tmp_path, metadata=np.array(json.dumps(record)), **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_lanes(path: str) -> tuple:
+    """
+    Load the segmented lanes of a plate from a container written by `save_lanes`.
+
+    Parameters
+    ----------
+    path : str
+        Path of the lane container.
+
+    Returns
+    -------
+    tuple
+        A tuple containing:
+            - metadata (dict): The plate information, including the cache key under ``key``.
+            - lanes_roi_rgb (list): List of [lane position, RGB ROI] pairs.
+            - lanes_roi_backlight (list): List of [lane position, backlight ROI] pairs.
+            - lanes_roi_binary (list): List of [lane position, binary lane image] pairs.
+    """
+    with np.load(path) as container:
+        metadata = json.loads(str(container['metadata']))
+        positions = [None if position == _NO_POSITION else int(position) for position in container['positions']]
+
+        lanes_roi_rgb = []
+        lanes_roi_backlight = []
+        lanes_roi_binary = []
+        for lane_id, position in enumerate(positions):
+            lanes_roi_rgb.append([position, container[f'rgb_{lane_id}']])
+            lanes_roi_backlight.append([position, container[f'backlight_{lane_id}']])
+            lanes_roi_binary.append([position, container[f'binary_{lane_id}']])
+
+    return metadata, lanes_roi_rgb, lanes_roi_backlight, lanes_roi_binary
+
+
+def iter_cached_plates(cache_dir: str):
+    """
+    Iterate over all lane containers in a cache directory.
+
+    Yields
+    ------
+    tuple
+        (experiment, dai, path) for every container, sorted by experiment, dai and plate.
+    """
+    for experiment in sorted(os.listdir(cache_dir)):
+        experiment_path = os.path.join(cache_dir, experiment)
+        if not os.path.isdir(experiment_path):
+            continue
+        for dai in sorted(os.listdir(experiment_path)):
+            dai_path = os.path.join(experiment_path, dai)
+            if not os.path.isdir(dai_path):
+                continue
+            for name in sorted(os.listdir(dai_path)):
+                if name.endswith('.npz') and not name.endswith('.tmp.npz'):
+                    yield experiment, dai, os.path.join(dai_path, name)
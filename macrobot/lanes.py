@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compact records for the lanes and leaves of a plate.
+
+A `Lane` holds its position and bounding box on the plate together with views into the plate
+RGB and backlight images, so cutting a lane copies no pixels. The images derived by the pipeline
+stages (binary lane, prediction, feature image) are stored on the same record, which replaces
+the parallel ``[position, image]`` lists matched by index. A `Leaf` refers to its lane and
+returns views of the lane images within its bounding box.
+"""
+
+import cv2
+import numpy as np
+
+from macrobot.rules import LaneChannels
+
+
+class Lane(object):
+    """
+    A lane of a plate and the images derived from it.
+
+    Attributes:
+        position (int or None): Lane position on the plate (1-4), None if the lane could not be assigned.
+        bbox (tuple or None): Bounding box (x, y, w, h) of the lane on the plate, None for cached lanes.
+        rgb (np.ndarray): RGB lane image (BGR channel order), usually a view into the plate image.
+        backlight (np.ndarray): Backlight lane image, usually a view into the plate image.
+        binary (np.ndarray): Binary lane image (255 = leaf), see `segmentation.binarize_lanes`.
+        prediction (np.ndarray): Predicted lane image (255 = pathogen).
+        feature (np.ndarray): Feature image of the lane, only computed in debug mode.
+        leaves (list): The detected `Leaf` records, None before leaf detection.
+    """
+
+    __slots__ = ('position', 'bbox', 'rgb', 'backlight', 'binary', 'prediction', 'feature', 'leaves',
+                 '_eroded', '_channels')
+
+    def __init__(self, position, rgb, backlight, bbox=None, binary=None):
+        self.position = position
+        self.bbox = bbox
+        self.rgb = rgb
+        self.backlight = backlight
+        self.binary = binary
+        self.prediction = None
+        self.feature = None
+        self.leaves = None
+        self._eroded = None
+        self._channels = None
+
+    @property
+    def eroded(self) -> np.ndarray:
+        """The binary lane eroded with a 3x3 kernel to remove small artifacts, computed on first access."""
+        if self._eroded is None:
+            self._eroded = cv2.erode(self.binary, np.ones((3, 3), np.uint8), iterations=1)
+        return self._eroded
+
+    @property
+    def channels(self) -> LaneChannels:
+        """The feature channels of the lane for the prediction rules, computed on first access."""
+        if self._channels is None:
+            self._channels = LaneChannels(self.rgb, self.backlight)
+        return self._channels
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes of the images derived from the lane, the views into the plate images are not counted."""
+        arrays = (self.binary, self.prediction, self.feature, self._eroded)
+        return sum(array.nbytes for array in arrays if array is not None)
+
+    def __repr__(self):
+        return f'Lane(position={self.position}, bbox={self.bbox})'
+
+
+class Leaf(object):
+    """
+    A leaf detected on a binary lane.
+
+    Attributes:
+        leaf_id (int): Number of the leaf within the lane, starting at 1.
+        contour (np.ndarray): Contour of the leaf in lane coordinates.
+        bbox (tuple): Bounding box (x, y, w, h) of the leaf in lane coordinates.
+        lane (Lane): The lane of the leaf.
+    """
+
+    __slots__ = ('leaf_id', 'contour', 'bbox', 'lane', '_hull')
+
+    def __init__(self, leaf_id, contour, bbox, lane):
+        self.leaf_id = leaf_id
+        self.contour = contour
+        self.bbox = bbox
+        self.lane = lane
+        self._hull = None
+
+    def crop(self, image: np.ndarray) -> np.ndarray:
+        """Return the view of a lane image within the bounding box of the leaf."""
+        x, y, w, h = self.bbox
+        return image[y:y + h, x:x + w]
+
+    @property
+    def hull(self) -> np.ndarray:
+        """Convex hull of the leaf contour, computed on first access."""
+        if self._hull is None:
+            self._hull = cv2.convexHull(self.contour)
+        return self._hull
+
+    @property
+    def rgb(self) -> np.ndarray:
+        return self.crop(self.lane.rgb)
+
+    @property
+    def backlight(self) -> np.ndarray:
+        return self.crop(self.lane.backlight)
+
+    @property
+    def binary(self) -> np.ndarray:
+        """The eroded binary lane within the bounding box, which defines the leaf area."""
+        return self.crop(self.lane.eroded)
+
+    @property
+    def prediction(self) -> np.ndarray:
+        return self.crop(self.lane.prediction)
+
+    def __repr__(self):
+        return f'Leaf(lane={self.lane.position}, leaf_id={self.leaf_id}, bbox={self.bbox})'
+
+
+def from_lists(lanes_roi_rgb: list, lanes_roi_backlight: list, lanes_roi_binary: list = None) -> list:
+    """
+    Create lane records from parallel ``[position, image]`` lists, e.g. loaded from the lane cache.
+
+    :param lanes_roi_rgb: List of [position, RGB lane] pairs.
+    :param lanes_roi_backlight: List of [position, backlight lane] pairs.
+    :param lanes_roi_binary: List of [position, binary lane] pairs (optional).
+    :return: List of `Lane` records.
+    """
+    lanes = [Lane(position, rgb, backlight) for (position, rgb), (_, backlight)
+             in zip(lanes_roi_rgb, lanes_roi_backlight)]
+    for lane, (_, binary) in zip(lanes, lanes_roi_binary or []):
+        lane.binary = binary
+    return lanes
+
+
+def to_list(lanes: list, attribute: str) -> list:
+    """Return one image of each lane as a list of [position, image] pairs, e.g. ``to_list(lanes, 'rgb')``."""
+    return [[lane.position, getattr(lane, attribute)] for lane in lanes]
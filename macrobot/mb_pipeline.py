@@ -4,10 +4,20 @@
 import cv2
 import numpy as np
 import os
+import time
 from configparser import ConfigParser
-from macrobot.helpers import whitebalance
+from macrobot.helpers import merge_whitebalanced
+from macrobot import events
+from macrobot import lane_cache
+from macrobot import lanes
 from macrobot import orga
+from macrobot import overlays
+from macrobot import qc
+from macrobot import results
+from macrobot import resolution
+from macrobot import rules
 from macrobot import segmentation
+from macrobot import stage_cache
 
 class MacrobotPipeline(object):
     """
@@ -21,31 +31,63 @@ class MacrobotPipeline(object):
         image_list (list): A list of image file names for the plate (red, blue, green, backlight, UVS).
         path (str): Path to the raw images from macrobot acquisition.
         destination_path (str): Path to store results (images, reports, etc.).
-        store_leaf_path (str): Path to store segmented leaves.
+        store_leaf_path (str or training_data.ShardWriter): Path or shard writer to store segmented leaves.
         experiment (str): Experiment name.
         dai (str): Days after inoculation.
         file_results (file): CSV file for pathogen predictions.
         plate_id (str): Plate ID derived from the first image name.
         resize_scale (float): Scaling factor for resizing images.
+        pixel_scale (float): Factor by which the pixel based settings were scaled for the resolution of the
+                             resized images, e.g. for a preview, see `resolution.scale_settings`.
         y_position (float): Y-coordinate for leaves segmentation.
         whitebalance (float): White balance factor for RGB correction.
         leaves_per_lane (float): Number of leaves per lane.
+        lane_cache_dir (str): Directory to store the segmented lanes for re-analysis (None to disable).
+        rule_set (rules.RuleSet): Threshold rules for the pathogen prediction.
+        debug (bool): Keep and save the feature images of the lanes, they are not needed for the prediction.
+        roi_prediction (bool): Only predict the pixels within the bounding boxes of the scored leaves.
+        lanes (list): The `lanes.Lane` records of the plate with views into the plate images and the derived
+                      binary, predicted and feature images.
+        buffer_pool (buffers.BufferPool): Pool for the arrays of the plate, which are returned to it when the
+                                          plate is finished (None to allocate new arrays).
+        qc_report (file): CSV file for the quality check results (None to skip the quality check).
+        event_log (events.EventLog): Log of the events of the run.
+        stage_cache (stage_cache.StageCache): Cache of the stage outputs (None to disable), not used in debug mode.
+        restored_stages (tuple): The stages of the plate which were read from the stage cache.
     """
     NAME = "invalid"
+    # Name of the predictor rule set (see `rules.RULES`), also used for threshold sweeps
+    PREDICTOR = None
+    # Image in which `get_frames` segments the white frames
+    FRAME_CHANNEL = 'uvs'
 
     def __init__(self, image_list, path_source, destination_path, store_leaf_path, experiment, dai, file_results,
-                 setting_file):
+                 setting_file, lane_cache_dir=None, rule_name=None, debug=False,
+                 roi_prediction=False, buffer_pool=None, qc_report=None, event_log=None, stage_cache=None):
         """
         Initialize the MacrobotPipeline with configuration and file details.
 
         :param image_list: List of image filenames for the plate.
         :param path_source: Path to the directory containing raw images.
         :param destination_path: Path for storing processed results.
-        :param store_leaf_path: Path for storing segmented leaves.
+        :param store_leaf_path: Path for storing segmented leaves, or the `training_data.ShardWriter` of the training data.
         :param experiment: Experiment identifier.
         :param dai: Days after inoculation.
         :param file_results: Output CSV file for pathogen predictions.
         :param settings_file: Setting file for parameters.
+        :param lane_cache_dir: Directory to store the segmented lanes for re-analysis (optional).
+        :param rule_name: Name of the prediction rule set, defaults to the predictor of the pipeline.
+                          Rule sets can be added in ``[RULES <name>]`` sections of the setting file.
+        :param debug: Keep and save the feature images of the lanes.
+        :param roi_prediction: Only predict the pixels within the bounding boxes of the scored leaves.
+                               The full lane predictions are then only computed and saved in debug mode.
+        :param buffer_pool: Pool for the arrays of the plate (optional). The images of the plate are only valid
+                            until the next plate is analysed with the same pool.
+        :param qc_report: CSV file for the quality check results (optional). If given, plates failing the
+                          quality check on thumbnails are only written to this report, see `check_quality`.
+        :param event_log: Log of the events of the run (optional), by default the events are only printed.
+        :param stage_cache: Cache of the stage outputs (optional). The pipeline restarts from the deepest stage
+                            of the plate found in the cache and adds the stages it computes, see `stage_cache`.
         """
         # Load configuration settings
         config = ConfigParser()
@@ -60,13 +102,32 @@ class MacrobotPipeline(object):
         self.experiment = experiment
         self.dai = dai
         self.resize_scale = config.getfloat('HARDWARE1', 'scaling_factor')
+        self.pixel_scale = config.getfloat('SEGMENTATION', 'pixel_scale', fallback=1.0)
         self.numer_of_lanes = None
         self.image_tresholded = None
-        print (self.image_list)
         self.plate_id = self.image_list[0].rsplit('_', 2)[0]
         self.y_position = config.getfloat('SEGMENTATION', 'y_position')
         self.whitebalance = config.getfloat('SEGMENTATION', 'whitebalance')
         self.leaves_per_lane = config.getfloat('SEGMENTATION', 'leaves_per_lane')
+        self.lane_cache_dir = lane_cache_dir
+        rule_sets = rules.load_rules(setting_file)
+        self.rule_set = rule_sets.get(rule_name or self.PREDICTOR)
+        if rule_name and self.rule_set is None:
+            raise ValueError(f"Unknown rule set '{rule_name}', available: {', '.join(rule_sets)}")
+        self.debug = debug
+        self.roi_prediction = roi_prediction
+        self.lanes = []
+        # Lane container of a re-analysed plate
+        self.lane_cache_file = None
+        self.buffer_pool = buffer_pool
+        self.qc_report = qc_report
+        self.event_log = event_log if event_log is not None else events.EventLog()
+        # The feature images of debug mode are not cached
+        self.stage_cache = stage_cache if not debug else None
+        self.stage_keys = {}
+        self.restored_stages = ()
+        if self.event_log.enabled('debug'):
+            self.log('debug', 'init', f'Images: {self.image_list}', images=len(self.image_list))
 
     def create_folder_structure(self):
         """
@@ -89,6 +150,48 @@ class MacrobotPipeline(object):
         """Placeholder for raw image preprocessing. Can be overridden for specific use cases."""
         return image_list
 
+    def buffer(self, shape, dtype):
+        """Return an uninitialized array for the plate, taken from the buffer pool if the pipeline has one."""
+        if self.buffer_pool is None:
+            return np.empty(shape, dtype=dtype)
+        return self.buffer_pool.take(shape, dtype)
+
+    @staticmethod
+    def scaled_kernel(size, scale=1.0):
+        """
+        Square morphology kernel of `size` pixels, scaled for images resized by `scale`.
+
+        :param size: Kernel size for the images the settings were made for.
+        :param scale: Size of the processed images relative to these images.
+        :return: The uint8 kernel, at least one pixel wide.
+        """
+        size = max(1, round(size * scale))
+        return np.ones((size, size), np.uint8)
+
+    def log(self, severity, stage, message, **counters):
+        """Record an event of the plate in the event log, see `events.EventLog.event`."""
+        self.event_log.event(severity, stage, message, experiment=self.experiment, dai=self.dai,
+                             plate=self.plate_id, **counters)
+
+    def release_buffers(self):
+        """Return the arrays of the plate to the buffer pool, so they can be reused for the next plate."""
+        if self.buffer_pool is not None:
+            self.buffer_pool.release_all()
+
+    def read_image(self, image, flags):
+        """
+        Read an image of the plate and resize it by the scaling factor.
+
+        :param image: File name of the image in the source directory.
+        :param flags: The `cv2.imread` flags.
+        :return: The resized image.
+        """
+        source = cv2.imread(os.path.join(self.path, image), flags)
+        # Size computed by cv2.resize for a scaling factor (rounded half to even)
+        shape = (round(source.shape[0] * self.resize_scale), round(source.shape[1] * self.resize_scale))
+        return cv2.resize(source, (0, 0), dst=self.buffer(shape + source.shape[2:], source.dtype),
+                          fx=self.resize_scale, fy=self.resize_scale)
+
     def read_images(self):
         """
         Read and resize the input images based on the scaling factor.
@@ -100,30 +203,85 @@ class MacrobotPipeline(object):
 
             # Read and resize the images based on their suffix
             if image.endswith('_backlight.tif'):
-                self.image_backlight = cv2.resize(cv2.imread(os.path.join(self.path, image), cv2.IMREAD_UNCHANGED), (0, 0), fx=self.resize_scale, fy=self.resize_scale)
+                self.image_backlight = self.read_image(image, cv2.IMREAD_UNCHANGED)
             elif image.endswith('_red.tif'):
-                self.image_red = cv2.resize(cv2.imread(os.path.join(self.path, image), cv2.IMREAD_GRAYSCALE), (0, 0), fx=self.resize_scale, fy=self.resize_scale)
+                self.image_red = self.read_image(image, cv2.IMREAD_GRAYSCALE)
             elif image.endswith('_blue.tif'):
-                self.image_blue = cv2.resize(cv2.imread(os.path.join(self.path, image), cv2.IMREAD_GRAYSCALE), (0, 0), fx=self.resize_scale, fy=self.resize_scale)
+                self.image_blue = self.read_image(image, cv2.IMREAD_GRAYSCALE)
             elif image.endswith('_green.tif'):
-                self.image_green = cv2.resize(cv2.imread(os.path.join(self.path, image), cv2.IMREAD_GRAYSCALE), (0, 0), fx=self.resize_scale, fy=self.resize_scale)
+                self.image_green = self.read_image(image, cv2.IMREAD_GRAYSCALE)
             elif image.endswith('uvs.tif') or image.endswith('uv.tif'):
-                self.image_uvs = cv2.resize(cv2.imread(os.path.join(self.path, image), cv2.IMREAD_GRAYSCALE), (0, 0), fx=self.resize_scale, fy=self.resize_scale)
+                self.image_uvs = self.read_image(image, cv2.IMREAD_GRAYSCALE)
 
         # Ensure all images have the same dimensions
         assert self.image_backlight.shape == self.image_red.shape == self.image_blue.shape == self.image_green.shape == self.image_uvs.shape
 
     def merge_channels(self):
         """
-        Combine the red, green, and blue grayscale images into a 3-channel RGB image.
+        Combine the red, green, and blue grayscale images into a white-balanced 3-channel RGB image.
+
+        The channels are written into the RGB image and white balanced in place with the
+        percentile from the configuration, see `helpers.merge_whitebalanced`.
         """
-        self.image_rgb = np.dstack((self.image_blue, self.image_green, self.image_red))
+        self.image_rgb = merge_whitebalanced((self.image_blue, self.image_green, self.image_red), self.whitebalance,
+                                             out=self.buffer(self.image_red.shape + (3,), np.uint8))
 
-    def do_whitebalance(self):
+    def check_quality(self):
         """
-        Apply white balance to the RGB image using a scaling factor from the configuration.
+        Check the plate on thumbnails of the frame and backlight images.
+
+        Frames, lanes and leaves are detected on the thumbnails with the pixel based settings
+        scaled to the thumbnail size, and the exposure of the backlight image is measured.
+        The thresholds are read from the ``QC`` section of the setting file, see `qc`.
+
+        :return: A tuple (statistics, reasons) with the statistics of the plate and the reasons
+                 why it failed, which are empty if the plate passed.
         """
-        self.image_rgb = whitebalance(self.image_rgb, self.whitebalance)
+        thresholds = qc.load_thresholds(self.setting_file)
+        scale = thresholds['scaling_factor']
+        setting_file = resolution.scaled_setting_file(self.setting_file, scale)
+
+        frame_source = qc.thumbnail(getattr(self, 'image_' + self.FRAME_CHANNEL), scale)
+        backlight = qc.thumbnail(self.image_backlight, scale)
+        thumbnail_lanes, lane_count = segmentation.segment_lanes(frame_source, backlight,
+                                                                 self.get_frames(frame_source,
+                                                                                 scale=self.pixel_scale * scale),
+                                                                 self.experiment, self.plate_id, setting_file)
+        # A lane with a uniform backlight image, e.g. overexposed, has no leaves
+        leaf_lanes = [lane for lane in thumbnail_lanes if lane.backlight.min() < lane.backlight.max()]
+        segmentation.binarize_lanes(leaf_lanes, setting_file)
+        segmentation.detect_lane_leaves(leaf_lanes, setting_file)
+
+        statistics = qc.exposure_statistics(backlight)
+        statistics['lanes'] = lane_count
+        statistics['leaves'] = [(lane.position, len(lane.leaves or [])) for lane in thumbnail_lanes]
+        return statistics, qc.evaluate(statistics, thresholds)
+
+    # The lane images as lists of [position, image] pairs, as returned by the segmentation functions
+    @property
+    def lanes_roi_rgb(self):
+        return lanes.to_list(self.lanes, 'rgb')
+
+    @property
+    def lanes_roi_backlight(self):
+        return lanes.to_list(self.lanes, 'backlight')
+
+    @property
+    def lanes_roi_binary(self):
+        return lanes.to_list(self.lanes, 'binary')
+
+    @property
+    def lanes_feature(self):
+        return [[lane.position, lane.feature] for lane in self.lanes if lane.feature is not None]
+
+    @property
+    def predicted_lanes(self):
+        return lanes.to_list(self.lanes, 'prediction')
+
+    @property
+    def nbytes(self):
+        """Bytes of the images derived from the lanes of the plate, see `lanes.Lane.nbytes`."""
+        return sum(lane.nbytes for lane in self.lanes)
 
     def get_lanes_rgb(self):
         """Placeholder to extract RGB lanes. Should be overridden for pathogen-specific processing."""
@@ -133,10 +291,10 @@ class MacrobotPipeline(object):
         """
         Generate binary masks for the segmented lanes.
 
-        This method calls `segment_lanes_binary` to create binary representations
+        This method calls `binarize_lanes` to create binary representations
         of the detected lanes.
         """
-        self.lanes_roi_binary = segmentation.segment_lanes_binary(self.lanes_roi_backlight, self.setting_file)
+        segmentation.binarize_lanes(self.lanes, self.setting_file)
 
     def get_leaves_binary(self):
         """
@@ -146,20 +304,102 @@ class MacrobotPipeline(object):
         leaves, saving results to the specified paths.
         """
 
-        segmentation.segment_leaf_binary(
-            self.lanes_roi_binary, self.lanes_roi_rgb, self.plate_id,
-            self.predicted_lanes, self.destination_path, self.experiment,
+        segmentation.score_leaves(
+            self.lanes, self.plate_id, self.destination_path, self.experiment,
             self.dai, self.file_results, self.store_leaf_path, self.setting_file
         )
+        # The leaf hulls are stored as polygons, the overlay images are rendered on demand
+        overlays.write_polygons(overlays.polygons_path(self.destination_path, self.plate_id),
+                                overlays.plate_polygons(self.plate_id, self.lanes, int(self.leaves_per_lane),
+                                                        self.lane_cache_file))
+
+    def store_lanes(self):
+        """
+        Store the segmented lanes in the lane cache so the plate can be re-analysed without the raw images.
+
+        The container is only rewritten if the raw images or the lane settings changed since the last run.
+        """
+        image_paths = [os.path.join(self.path, image) for image in self.image_list]
+        key = lane_cache.cache_key(image_paths, self.setting_file, self.NAME)
+        path = lane_cache.cache_path(self.lane_cache_dir, self.experiment, self.dai, self.plate_id)
+
+        if lane_cache.read_key(path) != key:
+            metadata = {
+                'plate_id': self.plate_id,
+                'experiment': self.experiment,
+                'dai': self.dai,
+                'image_list': self.image_list,
+                'procedure': self.NAME,
+                'settings': lane_cache.settings_digest(self.setting_file, self.NAME),
+                'numer_of_lanes': self.numer_of_lanes,
+            }
+            lane_cache.save_lanes(path, key, metadata, self.lanes_roi_rgb, self.lanes_roi_backlight,
+                                  self.lanes_roi_binary)
 
     def get_features(self):
-        """Placeholder for feature extraction. Should be overridden for pathogen-specific processing."""
-        pass
+        """
+        Placeholder for feature extraction. Should be overridden for pathogen-specific processing.
 
-    def get_prediction_per_lane(self):
-        """Placeholder for pathogen prediction. Should be overridden for pathogen-specific processing."""
+        The feature images are only computed in debug mode, the prediction derives the channels it needs
+        directly from the lanes.
+        """
         pass
 
+    def save_features(self):
+        """Save the feature image of each lane next to its prediction (debug mode)."""
+        for lane in self.lanes:
+            cv2.imwrite(os.path.join(self.destination_path, f'{self.plate_id}_{lane.position}_feature.png'),
+                        lane.feature)
+
+    def get_prediction_per_lane(self, plate_id, destination_path):
+        """
+        Predict the pathogen in each lane with the rule set of the pipeline. 255 = pathogen, 0 = background
+
+        The rule set is applied to the RGB and backlight lanes in one pass (see `rules.RuleSet.lookup`),
+        without intermediate feature images.
+
+        :param plate_id: Identifier of the plate, used for the names of the prediction images.
+        :param destination_path: Directory to save the prediction images.
+        :return: A list with the predictions per lane and it's position sorted left to right.
+        :rtype: list with tuple(position, prediction)
+        """
+        for lane in self.lanes:
+            lane.prediction = self.rule_set.lookup(lane.channels, out=self.buffer(lane.rgb.shape[:2], np.uint8))
+            cv2.imwrite(os.path.join(destination_path, f'{plate_id}_{lane.position}_disease_predict.png'),
+                        lane.prediction)
+        return self.predicted_lanes
+
+    def get_prediction_per_leaf(self):
+        """
+        Predict the pathogen only within the bounding boxes of the leaves which are scored.
+
+        The leaves are detected on the binary lanes first, pixels outside of the bounding boxes of
+        the first `leaves_per_lane` leaves of a lane are set to 0. The rules are evaluated per pixel,
+        so the `%_Inf` of the leaves is the same as with `get_prediction_per_lane`.
+
+        :return: A list with the predictions per lane and it's position sorted left to right.
+        :rtype: list with tuple(position, prediction)
+        """
+        segmentation.detect_lane_leaves(self.lanes, self.setting_file)
+
+        for lane in self.lanes:
+            lane.prediction = self.buffer(lane.rgb.shape[:2], np.uint8)
+            lane.prediction.fill(0)
+            for leaf in lane.leaves:
+                if leaf.leaf_id <= self.leaves_per_lane:
+                    leaf.crop(lane.prediction)[...] = self.rule_set.lookup(rules.LaneChannels(leaf.rgb, leaf.backlight))
+        return self.predicted_lanes
+
+    def extract_and_predict(self):
+        """Predict the pathogen in each lane, in debug mode the feature images are computed and saved as well."""
+        if self.debug:
+            self.get_features()
+            self.save_features()
+        if self.roi_prediction and not self.debug:
+            self.get_prediction_per_leaf()
+        else:
+            self.get_prediction_per_lane(self.plate_id, self.destination_path)
+
     def save_images_for_report(self):
         """
         Save key images (e.g., RGB and thresholded) for report generation.
@@ -171,7 +411,92 @@ class MacrobotPipeline(object):
         """
         Generate a summary report for the plate using the `orga` module.
         """
-        orga.create_report(self.plate_id, self.report_path)
+        orga.create_report(self.plate_id, self.report_path, [lane.position for lane in self.lanes])
+
+    def restore_stages(self):
+        """
+        Restore the plate from the deepest stage of which all stages are in the stage cache.
+
+        The keys of the stages are derived from the raw images, the settings and the rule set,
+        see `stage_cache.stage_keys`.
+
+        :return: The restored stages, empty if the plate has to be analysed from the raw images.
+        """
+        self.stage_keys = stage_cache.stage_keys(
+            [os.path.join(self.path, image) for image in self.image_list], self.setting_file, self.NAME,
+            extra={'prediction': f'{self.rule_set}\nroi_prediction={self.roi_prediction}'})
+        cached = []
+        for stage in stage_cache.STAGES:
+            if self.stage_keys[stage] not in self.stage_cache:
+                break
+            cached.append(stage)
+
+        for stage in cached:
+            entry = self.stage_cache.load(self.stage_keys[stage])
+            if entry is None:
+                # A damaged entry, the following stages are computed again
+                break
+            self.restore_stage(stage, *entry)
+            self.restored_stages += (stage,)
+        if self.restored_stages:
+            self.log('info', 'cache', f'Restored plate {self.plate_id} up to stage {self.restored_stages[-1]}',
+                     stages=len(self.restored_stages))
+        return self.restored_stages
+
+    def restore_stage(self, stage, metadata, arrays):
+        """Set the outputs of a stage read from the stage cache, see `stage_outputs`."""
+        if stage == 'channels':
+            for name, image in arrays.items():
+                setattr(self, 'image_' + name, image)
+        elif stage == 'rgb':
+            self.image_rgb = arrays['rgb']
+        elif stage == 'lanes':
+            self.image_tresholded = arrays['tresholded']
+            self.numer_of_lanes = metadata['numer_of_lanes']
+            self.lanes = [lanes.Lane(position, self.image_rgb[y:y + h, x:x + w], self.image_backlight[y:y + h, x:x + w],
+                                     bbox=(x, y, w, h))
+                          for position, (x, y, w, h) in zip(metadata['positions'], metadata['bboxes'])]
+        elif stage == 'binary':
+            for lane_id, lane in enumerate(self.lanes):
+                lane.binary = arrays[f'binary_{lane_id}']
+        elif stage == 'prediction':
+            for lane_id, lane in enumerate(self.lanes):
+                lane.prediction = arrays[f'prediction_{lane_id}']
+                # The images of the predictions of whole lanes are saved for the new destination
+                if not self.roi_prediction:
+                    cv2.imwrite(os.path.join(self.destination_path,
+                                             f'{self.plate_id}_{lane.position}_disease_predict.png'), lane.prediction)
+
+    def stage_outputs(self, stage):
+        """
+        Return the outputs of a stage for the stage cache.
+
+        :param stage: One of `stage_cache.STAGES`.
+        :return: A tuple (metadata, arrays) with the JSON serializable values and the arrays by name.
+        """
+        if stage == 'channels':
+            return {}, {name: getattr(self, 'image_' + name) for name in ('red', 'green', 'blue', 'backlight', 'uvs')}
+        if stage == 'rgb':
+            return {}, {'rgb': self.image_rgb}
+        if stage == 'lanes':
+            return {'numer_of_lanes': self.numer_of_lanes,
+                    'positions': [lane.position for lane in self.lanes],
+                    'bboxes': [[int(value) for value in lane.bbox] for lane in self.lanes]}, \
+                {'tresholded': self.image_tresholded}
+        return {}, {f'{stage}_{lane_id}': getattr(lane, stage) for lane_id, lane in enumerate(self.lanes)}
+
+    def run_stage(self, stage, method):
+        """
+        Run a stage of the pipeline, unless it was restored from the stage cache.
+
+        :param stage: One of `stage_cache.STAGES`.
+        :param method: The method computing the outputs of the stage.
+        """
+        if stage in self.restored_stages:
+            return
+        method()
+        if self.stage_keys:
+            self.stage_cache.save(self.stage_keys[stage], *self.stage_outputs(stage))
 
     def start_pipeline(self):
         """
@@ -180,7 +505,10 @@ class MacrobotPipeline(object):
         This method orchestrates the entire pipeline, including folder creation,
         image preprocessing, feature extraction, and pathogen prediction.
         """
-        print(f'...Analyzing plate {self.plate_id}')
+        start = time.perf_counter()
+        self.log('info', 'start', f'...Analyzing plate {self.plate_id}')
+        # Results of an earlier run of the plate are replaced, also if the plate has no leaves anymore
+        results.start_plate(self.file_results, self.experiment, self.dai, self.plate_id)
 
         # 1. Create folder structure
         self.create_folder_structure()
@@ -191,17 +519,37 @@ class MacrobotPipeline(object):
 
         self.image_list = self.preprocess_raw_images(self.image_list)
 
-        self.read_images()
-        self.merge_channels()
-        self.do_whitebalance()
+        # Later runs restart from the deepest stage of the plate in the stage cache
+        if self.stage_cache is not None:
+            self.restore_stages()
 
-        # 3. Segment and analyze lanes
-        self.get_lanes_rgb()
-        self.get_lanes_binary()
+        self.run_stage('channels', self.read_images)
+
+        # Unusable plates are only written to the QC report
+        if self.qc_report is not None:
+            statistics, reasons = self.check_quality()
+            qc.write_report(self.qc_report, self.plate_id, statistics, reasons)
+            if reasons:
+                self.log('warning', 'qc', f"Skip plate {self.plate_id}, quality check failed: {', '.join(reasons)}",
+                         lanes=statistics['lanes'])
+                self.release_buffers()
+                return self.plate_id, self.numer_of_lanes, [], self.file_results.name
 
-        # 4. Extract features and predict pathogen presence
-        self.get_features()
-        self.get_prediction_per_lane(self.plate_id, self.destination_path)
+        self.run_stage('rgb', self.merge_channels)
+
+        # 3. Segment and analyze lanes
+        self.run_stage('lanes', self.get_lanes_rgb)
+        if self.numer_of_lanes < 4:
+            self.log('warning', 'lanes', f'Warning, < 4 lanes! Found: {self.numer_of_lanes}',
+                     lanes=self.numer_of_lanes)
+        self.run_stage('binary', self.get_lanes_binary)
+        if self.lane_cache_dir:
+            self.store_lanes()
+
+        # 4. Predict pathogen presence (and extract features in debug mode)
+        self.run_stage('prediction', self.extract_and_predict)
+        if self.stage_keys:
+            self.stage_cache.use([self.stage_keys[stage] for stage in stage_cache.STAGES])
 
         # 5. Segment leaves and save results
         self.get_leaves_binary()
@@ -210,6 +558,11 @@ class MacrobotPipeline(object):
         # 6. Generate a report
         self.create_report()
 
+        self.release_buffers()
+        self.log('info', 'done', f'Plate {self.plate_id} done', lanes=self.numer_of_lanes,
+                 leaves=sum(len(lane.leaves or []) for lane in self.lanes),
+                 seconds=round(time.perf_counter() - start, 3))
+
         # Return summary data
         final_image_list = [
             self.image_tresholded, self.image_backlight, self.image_red, self.image_blue,
@@ -217,4 +570,30 @@ class MacrobotPipeline(object):
             self.lanes_roi_binary, self.lanes_feature, self.predicted_lanes
         ]
 
-        return self.plate_id, self.numer_of_lanes, final_image_list, self.file_results.name
\ No newline at end of file
+        return self.plate_id, self.numer_of_lanes, final_image_list, self.file_results.name
+
+    def start_reanalysis(self, cache_file):
+        """
+        Re-run feature extraction, prediction and leaf scoring from cached lanes.
+
+        The lanes are loaded from a container written by `store_lanes`, so the raw images
+        are not read again. Plate level images and the report of the original run are kept.
+
+        :param cache_file: Path of the lane container of the plate.
+        """
+        self.log('info', 'start', f'...Re-analysing plate {self.plate_id}')
+        results.start_plate(self.file_results, self.experiment, self.dai, self.plate_id)
+
+        self.create_folder_structure()
+
+        self.lane_cache_file = os.path.abspath(cache_file)
+        metadata, lanes_roi_rgb, lanes_roi_backlight, lanes_roi_binary = lane_cache.load_lanes(cache_file)
+        self.lanes = lanes.from_lists(lanes_roi_rgb, lanes_roi_backlight, lanes_roi_binary)
+        self.numer_of_lanes = metadata['numer_of_lanes']
+
+        self.extract_and_predict()
+        self.get_leaves_binary()
+
+        final_image_list = [self.lanes_roi_rgb, self.lanes_roi_binary, self.lanes_feature, self.predicted_lanes]
+
+        return self.plate_id, self.numer_of_lanes, final_image_list, self.file_results.name
@@ -3,8 +3,7 @@ import cv2
 import os
 from macrobot import segmentation
 from macrobot.mb_pipeline import MacrobotPipeline
-from macrobot.prediction import predict_green_image
-from macrobot.helpers import whitebalance
+from macrobot.helpers import merge_whitebalanced
 
 class NetBlotchSegmenter(MacrobotPipeline):
     """
@@ -45,6 +44,8 @@ class NetBlotchSegmenter(MacrobotPipeline):
     """
 
     NAME = 'NetBlotch'
+    PREDICTOR = 'green'
+    FRAME_CHANNEL = 'blue'
 
     def preprocess_raw_images(self, image_lst: list) -> list:
         """
@@ -70,14 +71,15 @@ class NetBlotchSegmenter(MacrobotPipeline):
         -------
         >>> processed_images = segmenter.preprocess_raw_images(['image1.tif', 'image2_bg.tif'])
         """
-        print ('ok4', image_lst)
+        if self.event_log.enabled('debug'):
+            self.log('debug', 'preprocess', f'Preprocessing images: {image_lst}', images=len(image_lst))
         for image_name in image_lst:
             if not image_name.startswith("processed_"):
                 # Load the original image
                 image_path = os.path.join(self.path, image_name)
                 image = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
                 if image is None:
-                    print(f"Warning: Unable to load image {image_path}. Skipping.")
+                    self.log('warning', 'preprocess', f"Warning: Unable to load image {image_path}. Skipping.")
                     continue
 
                 # Rotate the image 90 degrees clockwise
@@ -101,14 +103,15 @@ class NetBlotchSegmenter(MacrobotPipeline):
 
         return processed_images
 
-    def do_whitebalance(self) -> None:
+    def merge_channels(self) -> None:
         """
-        Apply white balance to the RGB image.
+        Combine the red, green, and blue images into a white-balanced RGB image.
 
-        This method utilizes the `whitebalance` function from the helpers module
+        This method utilizes the `merge_whitebalanced` function from the helpers module
         to perform white balancing on the RGB image with a specified percentile.
         """
-        self.image_rgb = whitebalance(self.image_rgb, perc=0.2)
+        self.image_rgb = merge_whitebalanced((self.image_blue, self.image_green, self.image_red), perc=0.2,
+                                             out=self.buffer(self.image_red.shape + (3,), np.uint8))
 
     def read_images(self) -> None:
         """
@@ -128,48 +131,21 @@ class NetBlotchSegmenter(MacrobotPipeline):
 
         for image in self.image_list:
             if image.startswith("processed_"):
-                image_path = os.path.join(self.path, image)
-                #print (image_path)
                 if image.endswith(('_backlight.tif', '_bg.tiff', '_backlight.tiff')):
                     # Load and resize backlight image
-                    self.image_backlight = cv2.resize(
-                        cv2.imread(image_path, cv2.IMREAD_UNCHANGED),
-                        (0, 0),
-                        fx=self.resize_scale,
-                        fy=self.resize_scale
-                    )
+                    self.image_backlight = self.read_image(image, cv2.IMREAD_UNCHANGED)
                 elif image.endswith(('_red.tif', '_red.tiff')):
                     # Load and resize red channel image in grayscale
-                    self.image_red = cv2.resize(
-                        cv2.imread(image_path, cv2.IMREAD_GRAYSCALE),
-                        (0, 0),
-                        fx=self.resize_scale,
-                        fy=self.resize_scale
-                    )
+                    self.image_red = self.read_image(image, cv2.IMREAD_GRAYSCALE)
                 elif image.endswith(('_blue.tif','_blue.tiff')):
                     # Load and resize blue channel image in grayscale
-                    self.image_blue = cv2.resize(
-                        cv2.imread(image_path, cv2.IMREAD_GRAYSCALE),
-                        (0, 0),
-                        fx=self.resize_scale,
-                        fy=self.resize_scale
-                    )
+                    self.image_blue = self.read_image(image, cv2.IMREAD_GRAYSCALE)
                 elif image.endswith(('_green.tif', '_green.tiff')):
                     # Load and resize green channel image in grayscale
-                    self.image_green = cv2.resize(
-                        cv2.imread(image_path, cv2.IMREAD_GRAYSCALE),
-                        (0, 0),
-                        fx=self.resize_scale,
-                        fy=self.resize_scale
-                    )
+                    self.image_green = self.read_image(image, cv2.IMREAD_GRAYSCALE)
                 elif image.endswith(('uvs.tif', 'uv.tif', 'uvs.tiff')):
                     # Load and resize UVS image in grayscale
-                    self.image_uvs = cv2.resize(
-                        cv2.imread(image_path, cv2.IMREAD_GRAYSCALE),
-                        (0, 0),
-                        fx=self.resize_scale,
-                        fy=self.resize_scale
-                    )
+                    self.image_uvs = self.read_image(image, cv2.IMREAD_GRAYSCALE)
 
         # Ensure all loaded images have the same dimensions
         assert self.image_backlight.shape == self.image_red.shape == self.image_blue.shape == \
@@ -177,7 +153,7 @@ class NetBlotchSegmenter(MacrobotPipeline):
             "Mismatch in image dimensions among backlight, red, blue, green, and UVS images."
 
 
-    def get_frames(self, image_source: np.ndarray) -> np.ndarray:
+    def get_frames(self, image_source: np.ndarray, scale: float = 1.0) -> np.ndarray:
         """
         Segment the white frame on a microtiter plate using Otsu's thresholding.
 
@@ -188,6 +164,8 @@ class NetBlotchSegmenter(MacrobotPipeline):
         ----------
         image_source : np.ndarray
             The UVS image (grayscale) used as the source for thresholding.
+        scale : float, optional
+            Size of the image relative to the images the settings were made for, e.g. for thumbnails.
 
         Returns
         -------
@@ -200,10 +178,12 @@ class NetBlotchSegmenter(MacrobotPipeline):
         """
 
         # Apply Otsu's thresholding to invert the image (white frames become white)
-        _, image_tresholded = cv2.threshold(image_source, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        _, image_tresholded = cv2.threshold(image_source, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU,
+                                            dst=self.buffer(image_source.shape, np.uint8))
         # Define a kernel for dilation to strengthen frame boundaries
-        kernel = np.ones((8,8), np.uint8)
-        image_tresholded = cv2.dilate(image_tresholded, kernel, iterations=3)
+        kernel = self.scaled_kernel(8, scale)
+        image_tresholded = cv2.dilate(image_tresholded, kernel, dst=self.buffer(image_source.shape, np.uint8),
+                                      iterations=3)
 
         return image_tresholded
 
@@ -231,9 +211,9 @@ class NetBlotchSegmenter(MacrobotPipeline):
         3. Sorts the lanes from left to right based on their x-coordinate positions.
         """
         # Segment white frames from the blue image
-        self.image_tresholded = self.get_frames(self.image_blue)
+        self.image_tresholded = self.get_frames(self.image_blue, scale=self.pixel_scale)
         # Extract RGB and backlight lanes within the white frames
-        self.lanes_roi_rgb, self.lanes_roi_backlight, self.numer_of_lanes = segmentation.segment_lanes_rgb(self.image_rgb,
+        self.lanes, self.numer_of_lanes = segmentation.segment_lanes(self.image_rgb,
                                                                                       self.image_backlight,
                                                                                       self.image_tresholded,
                                                                                     self.experiment,
@@ -258,53 +238,9 @@ class NetBlotchSegmenter(MacrobotPipeline):
         >>> features = segmenter.get_features()
         """
 
-        # We store the Max RGB images and the position for further analysis
-        self.lanes_feature = []
         # Iterate over each RGB lane ROI to extract green channel features
-        for lane in self.lanes_roi_rgb:
-            # Make a copy to avoid modifying the original lane image
-            copy_lane = np.copy(lane[1])
-            # Split the RGB channels
-            B, G, R = cv2.split(copy_lane)
-            # Store the green channel and its position
-            self.lanes_feature.append([lane[0], G])
+        for lane in self.lanes:
+            # Store the green channel of the lane
+            lane.feature = lane.channels['green']
 
         return self.lanes_feature
-
-    def get_prediction_per_lane(self, plate_id: str, destination_path: str) -> list:
-        """
-        Predict the presence of Net Blotch pathogen in each lane.
-
-        This method performs pathogen prediction for each lane based on the
-        extracted green channel features and backlight images. It saves the
-        prediction images and records the predictions for further analysis.
-
-        Parameters
-        ----------
-        plate_id : str
-            The identifier for the specific plate being processed.
-        destination_path : str
-            The directory path where the prediction result images will be stored.
-
-        Returns
-        -------
-        list
-            A list of lists, each containing the lane position and its corresponding
-            predicted binary image.
-
-        Example
-        -------
-        >>> predictions = segmenter.get_prediction_per_lane("PlateA1", "/path/to/destination")
-        """
-
-        self.predicted_lanes = []
-        # Iterate over each lane feature to perform prediction
-        for i in range(len(self.lanes_feature)):
-            # Perform pathogen prediction using the green channel and backlight image
-            predicted_image = predict_green_image(self.lanes_feature[i][1], self.lanes_roi_backlight[i][1],
-                                              self.lanes_roi_rgb[i][1])
-            cv2.imwrite(os.path.join(destination_path, plate_id + '_' + str(self.lanes_feature[i][0]) + '_disease_predict.png'), predicted_image)
-
-            # Store the prediction and its lane position
-            self.predicted_lanes.append([self.lanes_feature[i][0], predicted_image])
-        return self.predicted_lanes
@@ -1,8 +1,16 @@
+import functools
 import jinja2
 import os
 import urllib.request
 import zipfile
 import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from macrobot import overlays
+from macrobot import results
 
 def download_test_images(DATA_PATH):
     """Download and unzip test image set from DOI 10.5447/ipk/2020/7"""
@@ -34,30 +42,161 @@ def download_test_images(DATA_PATH):
         os.remove(my_zip)
 
 
-def create_report(plate_id, report_path):
-    """Create a report for each plate with the results."""
+# Size of the longer side of the thumbnails in the experiment report
+THUMBNAIL_SIZE = 160
+THUMBNAIL_FORMATS = ('jpg', 'webp')
+_ENCODE_PARAMETERS = {'jpg': [cv2.IMWRITE_JPEG_QUALITY, 85], 'webp': [cv2.IMWRITE_WEBP_QUALITY, 80]}
+
 
+@functools.lru_cache(maxsize=None)
+def template_environment():
+    """Return the jinja environment of the report templates, which is created once per process."""
     path = os.path.join(os.path.dirname(__file__), '.')
+    return jinja2.Environment(loader=jinja2.FileSystemLoader(searchpath=path))
 
-    templateLoader = jinja2.FileSystemLoader(searchpath=path)
-    templateEnv = jinja2.Environment(loader=templateLoader)
-    TEMPLATE_FILE = "report.html"
-
-    image_first_lane_1 = "../" + str(plate_id) + "_1_disease_predict.png"
-    image_first_lane_2 = "../" + str(plate_id) + "_1_leaf_predict.png"
-    image_sec_lane_1 = "../" + str(plate_id) + "_2_disease_predict.png"
-    image_sec_lane_2 = "../" + str(plate_id) + "_2_leaf_predict.png"
-    image_third_lane_1 = "../" + str(plate_id) + "_3_disease_predict.png"
-    image_third_lane_2 = "../" + str(plate_id) + "_3_leaf_predict.png"
-    image_fourth_lane_1 = "../" + str(plate_id) + "_4_disease_predict.png"
-    image_fourth_lane_2 = "../" + str(plate_id) + "_4_leaf_predict.png"
-
-    template = templateEnv.get_template(TEMPLATE_FILE)
-    outputText = template.render(plate_id=plate_id, img_id1=image_first_lane_1, img_id2=image_first_lane_2,
-                                 img_id3=image_sec_lane_1, img_id4=image_sec_lane_2, img_id5=image_third_lane_1,
-                                 img_id6=image_third_lane_2, img_id7=image_fourth_lane_1 ,img_id8=image_fourth_lane_2)
+
+def create_report(plate_id, report_path, lane_positions=(1, 2, 3, 4)):
+    """
+    Create a report for each plate with the results.
+
+    :param plate_id: Identifier of the plate.
+    :param report_path: Report directory of the plate, the lane images are in its parent directory.
+    :param lane_positions: Positions of the lanes of the plate.
+    """
+    template = template_environment().get_template("report.html")
+    lanes = [{'position': position,
+              'disease': f"../{plate_id}_{position}_disease_predict.png",
+              'leaf': f"../{plate_id}_{position}_leaf_predict.png"} for position in lane_positions]
+    outputText = template.render(plate_id=plate_id, lanes=lanes)
     # to save the results
     with open(os.path.join(report_path, plate_id + ".html"), "w") as fh:
         fh.write(outputText)
 
 
+def write_thumbnail(image_path, thumbnail_path, size=THUMBNAIL_SIZE):
+    """
+    Write a downscaled copy of an image, unless it is newer than the image.
+
+    :param image_path: Path of the image.
+    :param thumbnail_path: Path of the thumbnail, its extension selects the format (see `THUMBNAIL_FORMATS`).
+    :param size: Size of the longer side of the thumbnail in pixels.
+    :return: The path of the thumbnail, None if the image does not exist.
+    """
+    if not os.path.exists(image_path):
+        return None
+    if os.path.exists(thumbnail_path) and os.path.getmtime(thumbnail_path) >= os.path.getmtime(image_path):
+        return thumbnail_path
+    image = cv2.imread(image_path, cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+    scale = min(1.0, size / max(image.shape[:2]))
+    thumbnail = cv2.resize(image, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else image
+    cv2.imwrite(thumbnail_path, thumbnail, _ENCODE_PARAMETERS[thumbnail_path.rsplit('.', 1)[-1]])
+    return thumbnail_path
+
+
+def plate_statistics(leaf_results):
+    """
+    Infection statistics per plate and lane.
+
+    :param leaf_results: The results per leaf as arrays, see `results.read_results`.
+    :return: Dictionary mapping the plate ID to a dictionary with the number of ``leaves``, the
+             ``mean``, ``min`` and ``max`` ``%_Inf`` and the ``lanes``, the mean ``%_Inf`` by lane position.
+    """
+    statistics = {}
+    plate_ids, plate_index = np.unique(leaf_results['Plate_ID'], return_inverse=True)
+    infection = leaf_results['%_Inf'].astype(np.float64)
+    for index, plate_id in enumerate(plate_ids):
+        selected = plate_index == index
+        values = infection[selected]
+        lane_ids = leaf_results['Lane_ID'][selected]
+        lanes = {}
+        for lane_id in np.unique(lane_ids):
+            lanes[None if lane_id == results.NO_POSITION else int(lane_id)] = float(values[lane_ids == lane_id].mean())
+        statistics[str(plate_id)] = {'leaves': int(values.size), 'mean': float(values.mean()),
+                                     'min': float(values.min()), 'max': float(values.max()), 'lanes': lanes}
+    return statistics
+
+
+def _lane_position(file_name, plate_id, suffix):
+    position = file_name[len(plate_id) + 1:-len(suffix)]
+    return None if position == 'None' else int(position)
+
+
+def create_experiment_report(destination_path, experiment, dai, results_path=None, thumbnail_format='jpg',
+                             thumbnail_size=THUMBNAIL_SIZE, workers=4):
+    """
+    Create a summary report of all plates of an experiment and dai.
+
+    The report has one row per plate with the infection statistics and thumbnails of the plate
+    and its lanes, linking to the report of the plate and the full images. The overlay images
+    of the leaves are rendered first (see `overlays.render_plates`). The thumbnails are
+    generated on worker threads and only for new or changed images.
+
+    :param destination_path: Results directory of the pipeline.
+    :param experiment: Experiment identifier.
+    :param dai: Days after inoculation.
+    :param results_path: The results per leaf, see `results.read_results` (optional).
+    :param thumbnail_format: One of `THUMBNAIL_FORMATS`.
+    :param thumbnail_size: Size of the longer side of the thumbnails in pixels.
+    :param workers: Number of threads generating thumbnails.
+    :return: Path of the report, ``<experiment>_report.html`` in the directory of the dai.
+    """
+    if thumbnail_format not in THUMBNAIL_FORMATS:
+        raise ValueError(f"Unknown thumbnail format '{thumbnail_format}', available: {', '.join(THUMBNAIL_FORMATS)}")
+    dai_path = os.path.join(destination_path, experiment, dai)
+    thumbnail_path = os.path.join(dai_path, 'thumbnails')
+    os.makedirs(thumbnail_path, exist_ok=True)
+    statistics = plate_statistics(results.read_results(results_path)) if results_path else {}
+    overlays.render_plates(overlays.find_plates(destination_path, experiment, dai), workers=workers)
+
+    # Plate directories have a report directory, plates skipped by the quality check have no images
+    plate_ids = sorted({entry.name for entry in os.scandir(dai_path)
+                        if entry.is_dir() and os.path.isdir(os.path.join(entry.path, 'report'))} | set(statistics))
+
+    plates, thumbnails = [], []
+
+    def thumbnail(image, name):
+        """Return the relative paths of an image and its thumbnail and schedule the thumbnail."""
+        name = f'{name}.{thumbnail_format}'
+        thumbnails.append((os.path.join(dai_path, image), os.path.join(thumbnail_path, name)))
+        return {'image': image.replace(os.sep, '/'), 'thumbnail': f'thumbnails/{name}'}
+
+    for plate_id in plate_ids:
+        plate_path = os.path.join(dai_path, plate_id)
+        plate = {'plate_id': plate_id, 'page': f'{plate_id}/report/{plate_id}.html',
+                 'statistics': statistics.get(plate_id), 'overview': None, 'lanes': []}
+        if os.path.isdir(plate_path):
+            for image in ('rgb_leaves', 'rgb_image'):
+                if os.path.exists(os.path.join(plate_path, 'report', image + '.png')):
+                    plate['overview'] = thumbnail(os.path.join(plate_id, 'report', image + '.png'),
+                                                  f'{plate_id}_{image}')
+                    break
+            suffix = '_leaf_predict.png'
+            positions = [_lane_position(name, plate_id, suffix) for name in os.listdir(plate_path)
+                         if name.startswith(plate_id + '_') and name.endswith(suffix)]
+            for position in sorted(positions, key=lambda position: (position is None, position)):
+                leaf, disease = f'{plate_id}_{position}_leaf_predict', f'{plate_id}_{position}_disease_predict'
+                plate['lanes'].append({
+                    'position': position,
+                    'leaf': thumbnail(os.path.join(plate_id, leaf + '.png'), leaf),
+                    'disease': (thumbnail(os.path.join(plate_id, disease + '.png'), disease)
+                                if os.path.exists(os.path.join(plate_path, disease + '.png')) else None),
+                    'mean': (plate['statistics'] or {'lanes': {}})['lanes'].get(position),
+                })
+        plates.append(plate)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda paths: write_thumbnail(*paths, size=thumbnail_size), thumbnails))
+
+    infection = [plate['statistics'] for plate in plates if plate['statistics']]
+    leaves = sum(value['leaves'] for value in infection)
+    summary = {'plates': len(plates), 'leaves': leaves,
+               'mean': sum(value['mean'] * value['leaves'] for value in infection) / leaves if leaves else None}
+
+    template = template_environment().get_template("experiment_report.html")
+    report = os.path.join(dai_path, f'{experiment}_report.html')
+    with open(report, 'w') as fh:
+        fh.write(template.render(experiment=experiment, dai=dai, plates=plates, summary=summary,
+                                 max_lanes=max([len(plate['lanes']) for plate in plates], default=0)))
+    return report
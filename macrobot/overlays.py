@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Leaf polygons of a plate and the overlay images rendered from them.
+
+The leaf scoring does not draw. The convex hulls of the leaves are stored as polygons in
+``<plate_id>_leaves.json`` next to the results of the plate, and the images with the hulls
+drawn onto the lanes (``<plate_id>_<lane>_leaf_predict.png`` and ``report/rgb_leaves.png``)
+are rendered when they are needed, by the experiment report or by ``mb render``.
+
+The lanes are cut from the RGB image of the plate (``report/rgb_image.png``) by their bounding
+box. Re-analysed plates have no plate image, their lanes are read from the lane container.
+"""
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from macrobot import lane_cache
+
+# Color (BGR) and line width of the leaf hulls
+HULL_COLOR = (0, 0, 255)
+HULL_THICKNESS = 2
+
+
+def polygons_path(plate_path: str, plate_id: str) -> str:
+    """Return the path of the leaf polygons of a plate in its results directory."""
+    return os.path.join(plate_path, f'{plate_id}_leaves.json')
+
+
+def plate_polygons(plate_id: str, lanes: list, leaves_per_lane: int, cache_file: str = None) -> dict:
+    """
+    Collect the leaf hulls of a plate.
+
+    :param plate_id: Identifier of the plate.
+    :param lanes: The `lanes.Lane` records with detected leaves.
+    :param leaves_per_lane: Number of leaves per lane which are scored.
+    :param cache_file: Lane container the lanes were loaded from, for re-analysed plates without bounding boxes.
+    :return: JSON serializable dictionary with the lanes, their bounding box on the plate and their
+             leaves with the bounding box and the hull (flat list of x, y coordinates) in lane coordinates.
+    """
+    return {
+        'plate_id': plate_id,
+        'cache_file': cache_file,
+        'lanes': [{
+            'position': lane.position,
+            'bbox': None if lane.bbox is None else [int(value) for value in lane.bbox],
+            'leaves': [{'leaf_id': leaf.leaf_id, 'bbox': [int(value) for value in leaf.bbox],
+                        'scored': leaf.leaf_id <= leaves_per_lane, 'hull': leaf.hull.reshape(-1).tolist()}
+                       for leaf in lane.leaves or []],
+        } for lane in lanes],
+    }
+
+
+def write_polygons(path: str, polygons: dict) -> None:
+    """Write the leaf polygons of a plate, see `plate_polygons`."""
+    with open(path, 'w') as file:
+        json.dump(polygons, file, separators=(',', ':'))
+
+
+def read_polygons(path: str) -> dict:
+    """Read the leaf polygons of a plate written by `write_polygons`."""
+    with open(path) as file:
+        return json.load(file)
+
+
+def draw_hulls(lane_image: np.ndarray, lane: dict, scored_only: bool = True) -> np.ndarray:
+    """
+    Draw the leaf hulls of a lane onto a lane image.
+
+    :param lane_image: The RGB lane image (BGR channel order), it is modified.
+    :param lane: The lane of the leaf polygons, see `plate_polygons`.
+    :param scored_only: Only draw the leaves which are scored.
+    :return: The lane image.
+    """
+    for leaf in lane['leaves']:
+        if leaf['scored'] or not scored_only:
+            hull = np.array(leaf['hull'], dtype=np.int32).reshape(-1, 1, 2)
+            cv2.drawContours(lane_image, [hull], -1, HULL_COLOR, HULL_THICKNESS)
+    return lane_image
+
+
+def render_plate(plate_path: str, plate_id: str, force: bool = False) -> list:
+    """
+    Render the overlay images of a plate from its leaf polygons.
+
+    Images which are newer than the polygons are kept, unless `force` is set.
+
+    :param plate_path: Results directory of the plate.
+    :param plate_id: Identifier of the plate.
+    :param force: Render the images even if they are up to date.
+    :return: The paths of the rendered images.
+    """
+    path = polygons_path(plate_path, plate_id)
+    polygons = read_polygons(path)
+    lanes = polygons['lanes']
+    targets = [os.path.join(plate_path, f"{plate_id}_{lane['position']}_leaf_predict.png") for lane in lanes]
+    plate_image = os.path.join(plate_path, 'report', 'rgb_image.png')
+    if polygons['cache_file'] is None:
+        targets.append(os.path.join(plate_path, 'report', 'rgb_leaves.png'))
+    modified = os.path.getmtime(path)
+    if not force and all(os.path.exists(target) and os.path.getmtime(target) >= modified for target in targets):
+        return []
+
+    if polygons['cache_file'] is None:
+        # The hulls are drawn onto views of the lanes, so they are clipped at the lane borders
+        plate = cv2.imread(plate_image, cv2.IMREAD_COLOR)
+        lane_images = [plate[y:y + h, x:x + w] for x, y, w, h in (lane['bbox'] for lane in lanes)]
+    else:
+        _, lanes_roi_rgb, _, _ = lane_cache.load_lanes(polygons['cache_file'])
+        lane_images = [rgb for _, rgb in lanes_roi_rgb]
+
+    for lane, lane_image, target in zip(lanes, lane_images, targets):
+        cv2.imwrite(target, draw_hulls(lane_image, lane))
+    if polygons['cache_file'] is None:
+        cv2.imwrite(targets[-1], plate)
+    return targets
+
+
+def find_plates(destination_path: str, experiment: str = None, dai: str = None) -> list:
+    """
+    Find the plates with leaf polygons in a results directory.
+
+    :param destination_path: Results directory of the pipeline.
+    :param experiment: Only plates of this experiment (optional).
+    :param dai: Only plates of this dai (optional).
+    :return: List of (plate_path, plate_id) tuples.
+    """
+    plates = []
+    for experiment_entry in os.scandir(destination_path):
+        if not experiment_entry.is_dir() or experiment not in (None, experiment_entry.name):
+            continue
+        for dai_entry in os.scandir(experiment_entry.path):
+            if not dai_entry.is_dir() or dai not in (None, dai_entry.name):
+                continue
+            for plate_entry in os.scandir(dai_entry.path):
+                if plate_entry.is_dir() and os.path.exists(polygons_path(plate_entry.path, plate_entry.name)):
+                    plates.append((plate_entry.path, plate_entry.name))
+    return sorted(plates)
+
+
+def render_plates(plates: list, force: bool = False, workers: int = 4) -> int:
+    """
+    Render the overlay images of several plates on worker threads, see `render_plate`.
+
+    :param plates: List of (plate_path, plate_id) tuples, see `find_plates`.
+    :param force: Render the images even if they are up to date.
+    :param workers: Number of plates rendered at the same time.
+    :return: The number of rendered images.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return sum(len(rendered) for rendered in executor.map(lambda plate: render_plate(*plate, force=force), plates))
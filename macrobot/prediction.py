@@ -1,12 +1,15 @@
 import numpy as np
 
+from macrobot.rules import RULES, LaneChannels
+
 
 def predict_min_rgb(minrgb_image: np.ndarray, backlight_image: np.ndarray, rgb_image: np.ndarray) -> np.ndarray:
     """
     Predict the presence of the pathogen by thresholding the minRGB image. Used for BGT (Botrytis Gray Mold).
 
     This function analyzes the minimum RGB channel image to identify areas likely affected by the BGT pathogen.
-    It applies dynamic thresholding based on the backlight image to account for variations in lighting conditions.
+    Pixels where green is the minimum channel are classified by the backlight image, which excludes yellow
+    leaves without pathogen. All other pixels are refined based on color channel differences.
 
     Parameters
     ----------
@@ -29,53 +32,17 @@ def predict_min_rgb(minrgb_image: np.ndarray, backlight_image: np.ndarray, rgb_i
     -------
     >>> predicted = predict_min_rgb(min_rgb, backlight, rgb)
     """
-
-    # Initialize the predicted image with all pixels set to 255 (pathogen)
-    predicted_image = np.ones(minrgb_image.shape[:2], dtype="uint8") * 255
-
-    # Because of the IFF backlight bug, calculate the mean intensity of the backlight image to determine dynamic thresholding
-    if backlight_image.mean() > 3000:
-        backlight_threshold = int(backlight_image.mean() / 1.5)
-    else:
-        backlight_threshold = int(backlight_image.mean() / 2.0)
-
-    # Iterate over each pixel in the minRGB image
-    for i in range(minrgb_image.shape[0]):
-        for j in range(minrgb_image.shape[1]):
-            # Check if the red and blue channels are zero, focusing on the green channel
-            if minrgb_image[i, j][0] == 0 and minrgb_image[i, j][2] == 0:
-                # Note: 40 without white balance, 60 with
-                # Threshold the green channel to identify pathogen presence
-                if minrgb_image[i, j][1] < 60 or minrgb_image[i, j][1] > 130:
-                    predicted_image[i, j] = 0
-                else:
-                    predicted_image[i, j] = 255
-
-                # Use backlight threshold to exclude yellow leaves without pathogen
-                # 250 for new images, 700 for old
-                backlight_threshold = 150
-                if backlight_image[i, j] < backlight_threshold:
-                    predicted_image[i, j] = 255
-                else:
-                    predicted_image[i, j] = 0
-            else:
-                # Further refine prediction based on RGB channel differences
-                if abs(int(rgb_image[i, j][2]) - int(rgb_image[i, j][1])) < 3:
-                    if minrgb_image[i, j][2] < 40:
-                        predicted_image[i, j] = 0
-                    else:
-                        predicted_image[i, j] = 255
-                else:
-                    predicted_image[i, j] = 0
-    return predicted_image
+    # The thresholds are the 'min_rgb' rule set. The original loop computed dynamic backlight and
+    # green thresholds which were always overwritten by the fixed backlight threshold of 150.
+    return RULES['min_rgb'].lookup(LaneChannels(rgb_image, backlight_image, minrgb=minrgb_image))
 
 
 def predict_max_rgb(maxrgb_image: np.ndarray, backlight_image: np.ndarray, rgb_image: np.ndarray) -> np.ndarray:
     """
     Predict the presence of the pathogen by thresholding the maxRGB image.
 
-    This function analyzes the maximum RGB channel image to identify areas likely affected by the pathogen.
-    It applies dynamic thresholding based on the backlight image to account for variations in lighting conditions.
+    This function analyzes the maximum RGB channel image to identify areas likely affected by the pathogen
+    by thresholding the red channel and excluding pixels where both green and red are bright.
 
     Parameters
     ----------
@@ -98,53 +65,16 @@ def predict_max_rgb(maxrgb_image: np.ndarray, backlight_image: np.ndarray, rgb_i
     -------
     >>> predicted = predict_max_rgb(max_rgb, backlight, rgb)
     """
-    # Initialize the predicted image with all pixels set to 255 (pathogen)
-    predicted_image = np.ones(maxrgb_image.shape[:2], dtype="uint8") * 255
-
-    # Calculate the mean intensity of the backlight image to determine dynamic thresholding
-    if backlight_image.mean() > 3000:
-        backlight_threshold = int(backlight_image.mean() / 1.5)
-    else:
-        backlight_threshold = int(backlight_image.mean() / 2.0)
-    # Iterate over each pixel in the maxRGB image
-    for i in range(maxrgb_image.shape[0]):
-        for j in range(maxrgb_image.shape[1]):
-            # Threshold the red channel to identify pathogen presence
-            if maxrgb_image[i, j][2] > 40 and maxrgb_image[i, j][2] < 110:
-                predicted_image[i, j] = 255
-            else:
-                predicted_image[i, j] = 0
-            # Further thresholding based on green and red channels to exclude certain areas
-            if maxrgb_image[i, j][1] > 50 and maxrgb_image[i, j][2] > 50:
-                predicted_image[i, j] = 0
-
-            #This is a feature for excluding yellow leaves without pathogen, the backlight images gives bright
-            #signal which we use as threshold
-            #250 for new images, 700 for old
-            # backlight_threshold = 150
-            # if backlight_image[i, j] < backlight_threshold:
-            #     predicted_image[i, j] = 0
-            # else:
-            #     predicted_image[i, j] = 255
-            # else:
-            #
-            #     if abs(int(rgb_image[i, j][2]) - int(rgb_image[i, j][1])) < 3:
-            #         if maxrgb_image[i, j][2] < 60:
-            #             predicted_image[i, j] = 255
-            #         else:
-            #             predicted_image[i, j] = 0
-            #     else:
-            #         predicted_image[i, j] = 0
-
-    return predicted_image
+    # The thresholds are the 'max_rgb' rule set, the backlight image is not used
+    return RULES['max_rgb'].lookup(LaneChannels(rgb_image, backlight_image, maxrgb=maxrgb_image))
 
 
 def predict_green_image(green_image: np.ndarray, backlight_image: np.ndarray, rgb_image: np.ndarray) -> np.ndarray:
     """
     Predict the presence of the pathogen by thresholding the green channel image. Used for Net Blotch.
 
-    This function analyzes the green channel image to identify areas likely affected by the Net Blotch pathogen.
-    It applies thresholding based on the backlight image to account for variations in lighting conditions.
+    This function analyzes the green channel image to identify areas likely affected by the Net Blotch pathogen
+    by thresholding the green channel.
 
     Parameters
     ----------
@@ -166,27 +96,8 @@ def predict_green_image(green_image: np.ndarray, backlight_image: np.ndarray, rg
     -------
     >>> predicted = predict_green_image(green_img, backlight, rgb)
     """
-
-    # Initialize the predicted image with all pixels set to 255 (pathogen)
-    predicted_image = np.ones(green_image.shape[:2], dtype="uint8") * 255
-
-    # Calculate the mean intensity of the backlight image to determine dynamic thresholding
-    if backlight_image.mean() > 3000:
-        backlight_threshold = int(backlight_image.mean() / 1.5)
-    else:
-        backlight_threshold = int(backlight_image.mean() / 2.0)
-
-    # Iterate over each pixel in the green channel image
-    for i in range(green_image.shape[0]):
-        for j in range(green_image.shape[1]):
-            # Threshold the green channel to identify pathogen presence
-            if green_image[i, j] < 28:
-                predicted_image[i, j] = 255
-            else:
-                predicted_image[i, j] = 0
-
-
-    return predicted_image
+    # The thresholds are the 'green' rule set
+    return RULES['green'].lookup(LaneChannels(rgb_image, backlight_image, green=green_image))
 
 
 def predict_saturation(image_saturation: np.ndarray, image_backlight: np.ndarray) -> np.ndarray:
@@ -214,18 +125,8 @@ def predict_saturation(image_saturation: np.ndarray, image_backlight: np.ndarray
     -------
     >>> predicted = predict_saturation(saturation_img, backlight)
     """
-    # Initialize the predicted image with all pixels set to 255 (pathogen)
-    predicted_image = np.ones(image_saturation.shape[:2], dtype="uint8") * 255
-
-    # Iterate over each pixel in the saturation image
-
-    for i in range(image_saturation.shape[0]):
-            for j in range(image_saturation.shape[1]):
-                if image_saturation[i, j] > 130 and image_backlight[i, j] < 1000:
-                    predicted_image[i, j] = 255
-                else:
-                    predicted_image[i, j] = 0
-    return predicted_image
+    # The thresholds are the 'saturation' rule set
+    return RULES['saturation'].lookup(LaneChannels(None, image_backlight, saturation=image_saturation))
 
 
 def predict_leaf(predicted_image: np.ndarray, leaf_binary_image: np.ndarray) -> float:
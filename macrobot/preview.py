@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Low resolution preview runs for a fast first look at the infection levels.
+
+A preview runs the whole pipeline with a reduced ``scaling_factor``, e.g. 0.125 instead of
+0.5, with the pixel based segmentation settings rescaled accordingly (see
+`resolution.preview_settings`). The ``%_Inf`` per leaf is approximate. To judge how far the
+preview can be trusted, a sample of the plates is also analysed at full resolution and the
+results per leaf are compared in an agreement report.
+"""
+
+import os
+
+import numpy as np
+
+from macrobot import resolution
+
+AGREEMENT_HEADER = 'Plate_ID;Lane_ID;Leaf_ID;%_Inf_preview;%_Inf_full;difference\n'
+
+
+def write_preview_settings(setting_file: str, scaling_factor: float, destination_path: str) -> str:
+    """
+    Write the setting file of a preview run to the destination directory.
+
+    :param setting_file: Path of the setting file of a full resolution run.
+    :param scaling_factor: The scaling factor of the preview.
+    :param destination_path: Directory of the results.
+    :return: Path of the preview setting file.
+    """
+    os.makedirs(destination_path, exist_ok=True)
+    path = os.path.join(destination_path, 'preview_settings.ini')
+    with open(path, 'w') as file:
+        resolution.preview_settings(setting_file, scaling_factor).write(file)
+    return path
+
+
+def sample_plates(plates: list, size: int) -> list:
+    """Return `size` plates evenly spaced over the list of plates."""
+    if size <= 0 or not plates:
+        return []
+    step = max(1, len(plates) // size)
+    return plates[::step][:size]
+
+
+def read_leaf_results(path: str) -> dict:
+    """
+    Read the ``%_Inf`` per leaf from a results file of the pipeline.
+
+    :param path: Path of the ``<experiment>_leaf.csv`` file.
+    :return: Dictionary mapping (Plate_ID, Lane_ID, Leaf_ID) to the ``%_Inf``.
+    """
+    results = {}
+    with open(path) as file:
+        next(file)
+        for line in file:
+            _, _, _, plate_id, lane_id, leaf_id, percent_infection = line.rstrip('\n').split(';')
+            results[(plate_id, lane_id, leaf_id)] = float(percent_infection)
+    return results
+
+
+def agreement(preview: dict, full: dict) -> dict:
+    """
+    Compare the ``%_Inf`` of the leaves found in a preview and a full resolution run.
+
+    :param preview: The results of the preview, see `read_leaf_results`.
+    :param full: The results at full resolution.
+    :return: Dictionary with the number of compared ``leaves``, the leaves found ``only_preview``
+             or ``only_full``, the ``mean_difference`` and ``max_difference`` of the absolute
+             differences and the Pearson ``correlation`` (None if not defined).
+    """
+    leaves = sorted(set(preview) & set(full))
+    values_preview = np.array([preview[leaf] for leaf in leaves])
+    values_full = np.array([full[leaf] for leaf in leaves])
+    differences = np.abs(values_preview - values_full)
+
+    correlation = None
+    if len(leaves) > 1 and values_preview.std() > 0 and values_full.std() > 0:
+        correlation = float(np.corrcoef(values_preview, values_full)[0, 1])
+
+    return {
+        'leaves': len(leaves),
+        'only_preview': len(set(preview) - set(full)),
+        'only_full': len(set(full) - set(preview)),
+        'mean_difference': float(differences.mean()) if leaves else None,
+        'max_difference': float(differences.max()) if leaves else None,
+        'correlation': correlation,
+    }
+
+
+def write_agreement_report(path: str, preview: dict, full: dict) -> dict:
+    """
+    Write the ``%_Inf`` of the preview and full resolution run for every sampled leaf.
+
+    :param path: Path of the report.
+    :param preview: The results of the preview, see `read_leaf_results`.
+    :param full: The results at full resolution, only the sampled plates.
+    :return: The summary of the agreement, see `agreement`.
+    """
+    plates = {plate_id for plate_id, _, _ in full}
+    sampled = {leaf: value for leaf, value in preview.items() if leaf[0] in plates}
+    with open(path, 'w') as file:
+        file.write(AGREEMENT_HEADER)
+        for leaf in sorted(set(sampled) | set(full)):
+            value_preview, value_full = sampled.get(leaf), full.get(leaf)
+            difference = '' if value_preview is None or value_full is None else f'{value_preview - value_full:g}'
+            file.write(f"{';'.join(leaf)};{'' if value_preview is None else f'{value_preview:g}'};"
+                       f"{'' if value_full is None else f'{value_full:g}'};{difference}\n")
+    return agreement(sampled, full)
+
+
+def format_agreement(summary: dict) -> str:
+    """Return a one line description of the agreement of a preview with full resolution runs."""
+    if not summary['leaves']:
+        return 'Preview agreement: no common leaves'
+    correlation = 'n/a' if summary['correlation'] is None else f"{summary['correlation']:.3f}"
+    return (f"Preview agreement on {summary['leaves']} leaves: mean |difference| {summary['mean_difference']:.2f} "
+            f"%_Inf, max {summary['max_difference']:g}, correlation {correlation}, "
+            f"{summary['only_preview']} leaves only in the preview, {summary['only_full']} only at full resolution")
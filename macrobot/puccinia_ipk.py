@@ -1,10 +1,7 @@
 import numpy as np
 import cv2
-import os
-from macrobot.helpers import get_saturation
 from macrobot import segmentation
 from macrobot.mb_pipeline import MacrobotPipeline
-from macrobot.prediction import predict_saturation
 
 
 class RustSegmenterIPK(MacrobotPipeline):
@@ -13,28 +10,32 @@ class RustSegmenterIPK(MacrobotPipeline):
     """
 
     NAME = 'RUST_IPK'
+    PREDICTOR = 'saturation'
 
 # IPK Hardware
-    def get_frames(self, image_source):
+    def get_frames(self, image_source, scale=1.0):
         """Segment the white frame on a microtiter plate.
            Algorithm is based on Otsu thresholding of the UVS image.
 
            :param image_source: The UVS-image (x, y, 1) which is used as source for thresholding.
            :type image_source: numpy array.
+           :param scale: Size of the image relative to the images the settings were made for.
            :return: The binary image after Otsu thresholding.
            :rtype: numpy array
         """
-        _, image_tresholded = cv2.threshold(image_source, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
-        kernel = np.ones((8, 8), np.uint8)
-        image_tresholded = cv2.dilate(image_tresholded, kernel, iterations=3)
+        _, image_tresholded = cv2.threshold(image_source, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU,
+                                            dst=self.buffer(image_source.shape, np.uint8))
+        kernel = self.scaled_kernel(8, scale)
+        image_tresholded = cv2.dilate(image_tresholded, kernel, dst=self.buffer(image_source.shape, np.uint8),
+                                      iterations=3)
         # cv2.imshow('', image_tresholded)
         # cv2.waitKey()
         return image_tresholded
 
     def get_lanes_rgb(self):
         """Calls segment_lanes_rgb to extract the RGB lanes within the white frames."""
-        self.image_tresholded = self.get_frames(self.image_uvs)
-        self.lanes_roi_rgb, self.lanes_roi_backlight, self.numer_of_lanes = segmentation.segment_lanes_rgb(self.image_rgb,
+        self.image_tresholded = self.get_frames(self.image_uvs, scale=self.pixel_scale)
+        self.lanes, self.numer_of_lanes = segmentation.segment_lanes(self.image_rgb,
                                                                                       self.image_backlight,
                                                                                       self.image_tresholded,
                                                                                       self.experiment, self.plate_id,
@@ -47,24 +48,7 @@ class RustSegmenterIPK(MacrobotPipeline):
            :return: A list with the features per lane and it's position sorted left to right.
            :rtype: list with tuple(feature, position)
         """
-        # We store the saturated images and the position for further analysis
-        self.lanes_feature = []
-        # For each RGB lane we extract the features
-        for lane in self.lanes_roi_rgb:
-            copy_lane = np.copy(lane[1])
-            saturation_feature = get_saturation(copy_lane)
-            self.lanes_feature.append([lane[0], saturation_feature])
+        # For each RGB lane we extract the features, the saturation channel is shared with the prediction
+        for lane in self.lanes:
+            lane.feature = lane.channels['saturation']
         return self.lanes_feature
-
-    def get_prediction_per_lane(self, plate_id, destination_path):
-        """Predict the Rust pathogen from the feature extraction method based on thresholding. 255 = pathogen, 0 = background
-
-           :return: A list with the predictions per lane and it's position sorted left to right.
-           :rtype: list with tuple(prediction, position)
-        """
-        self.predicted_lanes = []
-        for lane_id in range(len(self.lanes_feature)):
-            predicted_image = predict_saturation(self.lanes_feature[lane_id][1], self.lanes_roi_backlight[lane_id][1])
-            cv2.imwrite(os.path.join(destination_path, plate_id + '_' + str(self.lanes_feature[lane_id][0]) + '_disease_predict.png'), predicted_image)
-            self.predicted_lanes.append([self.lanes_feature[lane_id][0], predicted_image])
-        return self.predicted_lanes
\ No newline at end of file
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Quality check of a plate on thumbnails before the full analysis.
+
+Plates with missing leaves, a wrong exposure or a misaligned holder give no usable results.
+The quality check runs frame, lane and leaf detection on heavily downscaled frame and
+backlight images together with exposure statistics of the backlight image, see
+`MacrobotPipeline.check_quality`. Plates which fail are written to a QC report instead of
+running feature extraction, prediction and image output.
+
+The thresholds are read from the ``QC`` section of the setting file::
+
+    [QC]
+    scaling_factor = 0.25
+    min_lanes = 4
+    min_leaves_per_lane = 1
+    min_backlight_mean = 50
+    max_backlight_mean = 60000
+    max_saturated_fraction = 0.05
+"""
+
+import os
+from configparser import ConfigParser
+
+import cv2
+import numpy as np
+
+# Thresholds used for settings which are not in the QC section
+DEFAULTS = {
+    'scaling_factor': 0.25,
+    'min_lanes': 4,
+    'min_leaves_per_lane': 1,
+    'min_backlight_mean': 50.0,
+    'max_backlight_mean': 60000.0,
+    'max_saturated_fraction': 0.05,
+}
+
+REPORT_HEADER = 'Plate_ID;lanes;leaves;backlight_mean;saturated_fraction;status;reason\n'
+
+
+def load_thresholds(setting_file: str) -> dict:
+    """
+    Read the quality check thresholds from the ``QC`` section of a setting file.
+
+    :param setting_file: Path of the setting file.
+    :return: Dictionary with the thresholds, missing settings have their `DEFAULTS` value.
+    """
+    config = ConfigParser()
+    config.read(setting_file)
+    return {name: type(default)(config.get('QC', name, fallback=default)) for name, default in DEFAULTS.items()}
+
+
+def thumbnail(image: np.ndarray, scale: float) -> np.ndarray:
+    """Downscale an image by `scale`, averaging the pixels of each thumbnail pixel."""
+    return cv2.resize(image, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+
+def exposure_statistics(backlight: np.ndarray) -> dict:
+    """
+    Exposure statistics of a backlight image.
+
+    :param backlight: The backlight image (thumbnail).
+    :return: Dictionary with the ``backlight_mean`` and the ``saturated_fraction`` of pixels
+             at the maximum value of the data type.
+    """
+    saturated = np.count_nonzero(backlight == np.iinfo(backlight.dtype).max)
+    return {'backlight_mean': float(backlight.mean()), 'saturated_fraction': saturated / backlight.size}
+
+
+def evaluate(statistics: dict, thresholds: dict) -> list:
+    """
+    Compare the statistics of a plate with the thresholds.
+
+    :param statistics: Dictionary with the number of ``lanes``, the ``leaves`` per lane and the
+                       exposure statistics, see `exposure_statistics`.
+    :param thresholds: The thresholds, see `load_thresholds`.
+    :return: The reasons why the plate failed, empty if it passed.
+    """
+    reasons = []
+    if statistics['lanes'] < thresholds['min_lanes']:
+        reasons.append(f"{statistics['lanes']} lanes found, {thresholds['min_lanes']} required")
+    for position, leaves in statistics['leaves']:
+        if leaves < thresholds['min_leaves_per_lane']:
+            reasons.append(f'{leaves} leaves in lane {position}')
+    if not thresholds['min_backlight_mean'] <= statistics['backlight_mean'] <= thresholds['max_backlight_mean']:
+        reasons.append(f"backlight mean {statistics['backlight_mean']:.1f} out of range")
+    if statistics['saturated_fraction'] > thresholds['max_saturated_fraction']:
+        reasons.append(f"{statistics['saturated_fraction']:.1%} of backlight saturated")
+    return reasons
+
+
+def open_report(destination_path: str, experiment: str, dai: str):
+    """Open the QC report of an experiment and dai and write its header."""
+    os.makedirs(os.path.join(destination_path, experiment, dai), exist_ok=True)
+    file_report = open(os.path.join(destination_path, experiment, dai, f'{experiment}_qc.csv'), 'w')
+    file_report.write(REPORT_HEADER)
+    return file_report
+
+
+def write_report(file_report, plate_id: str, statistics: dict, reasons: list) -> None:
+    """Write the quality check result of a plate to the QC report."""
+    leaves = ','.join(str(count) for _, count in statistics['leaves'])
+    file_report.write(f"{plate_id};{statistics['lanes']};{leaves};{statistics['backlight_mean']:.1f};"
+                      f"{statistics['saturated_fraction']:.4f};{'fail' if reasons else 'pass'};"
+                      f"{', '.join(reasons)}\n")
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Pixel based segmentation settings for other image resolutions.
+
+Frame, lane and leaf sizes in the ``SEGMENTATION`` section are given in pixels of the
+images resized by the ``scaling_factor`` of the hardware. To segment images at another
+resolution, e.g. thumbnails for the quality check, the lengths are scaled linearly and the
+areas quadratically. The scaled settings are written to a setting file, so they can be
+passed to the segmentation functions like the original one. The factor is recorded as
+``pixel_scale`` in the ``SEGMENTATION`` section.
+"""
+
+import os
+import tempfile
+from configparser import ConfigParser
+
+from macrobot.lane_cache import file_digest
+
+# Settings in pixels of the resized images
+LENGTH_SETTINGS = ('last_x', 'offset_width', 'offset_height', 'offset_x', 'offset_y', 'width_min', 'width_max',
+                   'max_x_distance', 'bordersize', 'y_position')
+LIST_SETTINGS = ('lane_positions',)
+AREA_SETTINGS = ('min_frame_area', 'max_frame_area', 'min_leaf_size')
+
+_SCALED_FILES = {}
+
+
+def scale_settings(setting_file: str, factor: float) -> ConfigParser:
+    """
+    Read a setting file and scale its pixel based segmentation settings.
+
+    :param setting_file: Path of the setting file.
+    :param factor: Size of the images relative to the images the settings were made for.
+    :return: The configuration with the scaled settings.
+    """
+    config = ConfigParser()
+    config.read(setting_file)
+    segmentation = config['SEGMENTATION']
+
+    for name in LENGTH_SETTINGS:
+        segmentation[name] = str(round(config.getfloat('SEGMENTATION', name) * factor))
+    for name in LIST_SETTINGS:
+        segmentation[name] = ','.join(str(round(int(value) * factor)) for value in segmentation[name].split(','))
+    for name in AREA_SETTINGS:
+        segmentation[name] = str(round(config.getfloat('SEGMENTATION', name) * factor ** 2))
+
+    # A border of at least one pixel is needed to close the frames at the image border
+    segmentation['bordersize'] = str(max(1, config.getint('SEGMENTATION', 'bordersize')))
+    # Kernel sizes in the code are scaled by the same factor, see `MacrobotPipeline.scaled_kernel`
+    segmentation['pixel_scale'] = str(config.getfloat('SEGMENTATION', 'pixel_scale', fallback=1.0) * factor)
+    return config
+
+
+def preview_settings(setting_file: str, scaling_factor: float) -> ConfigParser:
+    """
+    Read a setting file and change its scaling factor, rescaling the pixel based settings.
+
+    :param setting_file: Path of the setting file.
+    :param scaling_factor: The new scaling factor of the raw images, e.g. 0.125 for a preview.
+    :return: The configuration with the new scaling factor and the scaled settings.
+    """
+    config = ConfigParser()
+    config.read(setting_file)
+    config = scale_settings(setting_file, scaling_factor / config.getfloat('HARDWARE1', 'scaling_factor'))
+    config['HARDWARE1']['scaling_factor'] = str(scaling_factor)
+    return config
+
+
+def scaled_setting_file(setting_file: str, factor: float) -> str:
+    """
+    Return the path of a setting file with the pixel based settings scaled by `factor`.
+
+    The file is written once per process to the temporary directory, named after the content
+    of the original setting file, and reused for all plates.
+
+    :param setting_file: Path of the setting file.
+    :param factor: Size of the images relative to the images the settings were made for.
+    :return: Path of the scaled setting file.
+    """
+    key = (os.path.abspath(setting_file), factor)
+    if key not in _SCALED_FILES:
+        path = os.path.join(tempfile.gettempdir(),
+                            f'macrobot_{file_digest(setting_file)[:16]}_{factor:g}.ini')
+        # Written under a temporary name, parallel workers may create the same file
+        partial = f'{path}.{os.getpid()}'
+        with open(partial, 'w') as file:
+            scale_settings(setting_file, factor).write(file)
+        os.replace(partial, path)
+        _SCALED_FILES[key] = path
+    return _SCALED_FILES[key]
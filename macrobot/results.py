@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Sinks for the results per leaf.
+
+The leaf scoring collects the results of a plate in a `LeafRecords` buffer, which keeps
+one list per column, and hands the whole plate to a `ResultsSink`. The sink buffers the
+records and writes them in batches to its backend:
+
+* `CsvSink`: the ``;`` separated ``<experiment>_leaf.csv`` file, byte-identical to the
+  lines written by earlier versions.
+* `ColumnarSink`: compressed numpy archives with one typed array per column, one archive
+  per batch, for downstream analytics (see `read_columnar`).
+* `SqliteSink`: a table of a SQLite database.
+
+Sinks are thread-safe and add the records of a plate at once, so plates analysed in
+parallel never interleave. Worker processes fill their own `LeafRecords`, which can be
+pickled, and the parent process adds them to the sink.
+"""
+
+import glob
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+# Column names of the results and the types of their arrays
+COLUMNS = (
+    ('index', str),
+    ('expNr', str),
+    ('dai', str),
+    ('Plate_ID', str),
+    ('Lane_ID', np.int16),
+    ('Leaf_ID', np.int16),
+    ('%_Inf', np.int16),
+)
+
+HEADER = ';'.join(name for name, _ in COLUMNS) + '\n'
+
+# Lane positions may be None, which is stored as -1 in the typed arrays
+NO_POSITION = -1
+
+FORMATS = ('csv', 'columnar', 'sqlite')
+
+
+class LeafRecords(object):
+    """
+    Columnar buffer of results per leaf.
+
+    Attributes:
+        columns (dict): One list of values per column name of `COLUMNS`.
+    """
+
+    def __init__(self):
+        self.columns = {name: [] for name, _ in COLUMNS}
+
+    def append(self, index, experiment, dai, plate_id, lane_id, leaf_id, percent_infection) -> None:
+        """Add the result of a leaf."""
+        for column, value in zip(self.columns.values(),
+                                 (index, experiment, dai, plate_id, lane_id, leaf_id, percent_infection)):
+            column.append(value)
+
+    def extend(self, records) -> None:
+        """Add all results of another buffer."""
+        for name, column in self.columns.items():
+            column.extend(records.columns[name])
+
+    def clear(self) -> None:
+        for column in self.columns.values():
+            column.clear()
+
+    def __len__(self):
+        return len(self.columns['index'])
+
+    def rows(self):
+        """Iterate over the results as tuples in column order."""
+        return zip(*self.columns.values())
+
+    def csv_lines(self) -> str:
+        """The results as lines of the ``;`` separated results file."""
+        return ''.join(f"{';'.join(str(value) for value in row)}\n" for row in self.rows())
+
+    def arrays(self) -> dict:
+        """The results as one typed numpy array per column, missing lane positions are `NO_POSITION`."""
+        arrays = {}
+        for name, dtype in COLUMNS:
+            values = self.columns[name]
+            if dtype is not str:
+                values = [NO_POSITION if value is None else value for value in values]
+            arrays[name] = np.array(values, dtype=dtype)
+        return arrays
+
+
+class ResultsSink(object):
+    """
+    Base class of the results sinks, which write buffered records in batches.
+
+    Attributes:
+        name (str): Path of the output.
+        batch_size (int): Number of buffered records which triggers a write.
+    """
+
+    def __init__(self, name, batch_size=1000):
+        self.name = name
+        self.batch_size = batch_size
+        self._records = LeafRecords()
+        self._lock = threading.Lock()
+
+    def add_records(self, records: LeafRecords) -> None:
+        """Add the results of a plate, they are written once the batch is full."""
+        with self._lock:
+            self._records.extend(records)
+            if len(self._records) >= self.batch_size:
+                self._flush()
+
+    def start_plate(self, experiment: str, dai: str, plate_id: str) -> None:
+        """Called when the analysis of a plate starts, before its records are added."""
+
+    def flush(self) -> None:
+        """Write all buffered records."""
+        with self._lock:
+            self._flush()
+
+    def close(self) -> None:
+        """Write all buffered records and close the output."""
+        with self._lock:
+            self._flush()
+            self._close()
+
+    def _flush(self):
+        if len(self._records):
+            self._write(self._records)
+            self._records = LeafRecords()
+
+    def _write(self, records):
+        raise NotImplementedError
+
+    def _close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class CsvSink(ResultsSink):
+    """Results sink writing the ``;`` separated results file."""
+
+    def __init__(self, path, batch_size=1000):
+        super().__init__(path, batch_size)
+        self._file = open(path, 'w')
+        self._file.write(HEADER)
+
+    def _write(self, records):
+        self._file.write(records.csv_lines())
+
+    def _close(self):
+        self._file.close()
+
+
+class ColumnarSink(ResultsSink):
+    """
+    Results sink writing one compressed numpy archive per batch into a directory.
+
+    Like the results file, the archives of an earlier run are removed, unless ``append`` is set.
+    """
+
+    def __init__(self, path, batch_size=10000, append=False):
+        super().__init__(path, batch_size)
+        os.makedirs(path, exist_ok=True)
+        parts = glob.glob(os.path.join(glob.escape(path), 'part-*.npz'))
+        if append:
+            # Continue after the highest part, the numbering may have gaps
+            self._part = max((_part_index(part) for part in parts), default=-1) + 1
+        else:
+            for part in parts:
+                os.remove(part)
+            self._part = 0
+
+    def _write(self, records):
+        path = os.path.join(self.name, f'part-{self._part:05d}.npz')
+        # Written under a temporary name, so readers never see an incomplete archive
+        partial = os.path.join(self.name, f'.part-{self._part:05d}.npz')
+        np.savez_compressed(partial, **records.arrays())
+        os.replace(partial, path)
+        self._part += 1
+
+
+def _part_index(path):
+    # Number of an archive named part-<number>.npz
+    return int(os.path.basename(path)[len('part-'):-len('.npz')])
+
+
+def read_columnar(path: str) -> dict:
+    """
+    Read the results written by a `ColumnarSink`.
+
+    :param path: Directory of the archives.
+    :return: One typed numpy array per column, see `COLUMNS`.
+    """
+    parts = sorted(glob.glob(os.path.join(path, 'part-*.npz')))
+    arrays = {name: [] for name, _ in COLUMNS}
+    for part in parts:
+        with np.load(part) as archive:
+            for name in arrays:
+                arrays[name].append(archive[name])
+    return {name: np.concatenate(values) if values else np.array([], dtype=dtype)
+            for (name, dtype), values in zip(COLUMNS, arrays.values())}
+
+
+def read_results(path: str) -> dict:
+    """
+    Read the results written by any sink, see `open_sink`.
+
+    :param path: Path of the ``.csv`` file, ``.columnar`` directory or ``.sqlite`` database.
+    :return: One typed numpy array per column, see `COLUMNS`.
+    """
+    if path.endswith('.columnar'):
+        return read_columnar(path)
+    records = LeafRecords()
+    if path.endswith('.sqlite'):
+        connection = sqlite3.connect(path)
+        try:
+            for row in connection.execute(f"SELECT {', '.join(SqliteSink.FIELDS)} FROM leaf_results"):
+                records.append(*row)
+        finally:
+            connection.close()
+    else:
+        with open(path) as file:
+            next(file)
+            for line in file:
+                index, experiment, dai, plate_id, lane_id, leaf_id, percent_infection = line.rstrip('\n').split(';')
+                records.append(index, experiment, dai, plate_id, None if lane_id == 'None' else int(lane_id),
+                               int(leaf_id), int(percent_infection))
+    return records.arrays()
+
+
+class SqliteSink(ResultsSink):
+    """
+    Results sink inserting the records into a table of a SQLite database.
+
+    Like the results file, the rows of an earlier run are deleted, unless ``append`` is set.
+    """
+
+    # Column names in the database
+    FIELDS = ('leaf_index', 'experiment', 'dai', 'plate_id', 'lane_id', 'leaf_id', 'infection')
+
+    def __init__(self, path, table='leaf_results', batch_size=1000, append=False):
+        super().__init__(path, batch_size)
+        self.table = table
+        # Access is serialized by the lock of the sink
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(f'CREATE TABLE IF NOT EXISTS {table} ('
+                                     'leaf_index TEXT, experiment TEXT, dai TEXT, plate_id TEXT, '
+                                     'lane_id INTEGER, leaf_id INTEGER, infection INTEGER)')
+            if not append:
+                self._connection.execute(f'DELETE FROM {table}')
+        self._insert = f"INSERT INTO {table} ({', '.join(self.FIELDS)}) VALUES ({', '.join('?' * len(self.FIELDS))})"
+
+    def _write(self, records):
+        with self._connection:
+            self._connection.executemany(self._insert, records.rows())
+
+    def _close(self):
+        self._connection.close()
+
+
+class TeeSink(ResultsSink):
+    """
+    Results sink adding the records to several sinks, e.g. the results file and the results store.
+
+    Closing the sink closes the first sink and flushes the others, which may be shared.
+    """
+
+    def __init__(self, sink, *others):
+        super().__init__(sink.name)
+        self.sinks = (sink,) + others
+
+    def add_records(self, records):
+        for sink in self.sinks:
+            sink.add_records(records)
+
+    def start_plate(self, experiment, dai, plate_id):
+        for sink in self.sinks:
+            sink.start_plate(experiment, dai, plate_id)
+
+    def flush(self):
+        for sink in self.sinks:
+            sink.flush()
+
+    def close(self):
+        self.sinks[0].close()
+        for sink in self.sinks[1:]:
+            sink.flush()
+
+
+def open_sink(results_format: str, path: str) -> ResultsSink:
+    """
+    Open a results sink.
+
+    :param results_format: One of `FORMATS`.
+    :param path: Path of the results without extension, e.g. ``<dai>/<experiment>_leaf``.
+    :return: The sink, its `name` is the path of the output.
+    """
+    if results_format == 'csv':
+        return CsvSink(path + '.csv')
+    if results_format == 'columnar':
+        return ColumnarSink(path + '.columnar')
+    if results_format == 'sqlite':
+        return SqliteSink(path + '.sqlite')
+    raise ValueError(f"Unknown results format '{results_format}', available: {', '.join(FORMATS)}")
+
+
+def start_plate(file_results, experiment: str, dai: str, plate_id: str) -> None:
+    """
+    Tell a sink that the analysis of a plate starts, see `ResultsSink.start_plate`.
+
+    :param file_results: A `ResultsSink` or a text file, for which nothing is done.
+    :param experiment: Name of the experiment.
+    :param dai: Days after inoculation.
+    :param plate_id: Identifier of the plate.
+    """
+    if isinstance(file_results, ResultsSink):
+        file_results.start_plate(experiment, dai, plate_id)
+
+
+def write_records(file_results, records: LeafRecords) -> None:
+    """
+    Add the results of a plate to a sink or write them to an open results file.
+
+    :param file_results: A `ResultsSink` or a text file (with the header already written).
+    :param records: The results of the plate.
+    """
+    if isinstance(file_results, ResultsSink):
+        file_results.add_records(records)
+    else:
+        file_results.write(records.csv_lines())
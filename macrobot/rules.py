@@ -0,0 +1,407 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Declarative threshold rules for the pathogen predictors.
+
+A predictor is an ordered list of rules over named feature channels of a lane, for example::
+
+    saturation > 130 and backlight < 1000 -> 255
+
+The first rule whose conditions all hold decides the value of a pixel (255 = pathogen,
+0 = background); pixels matching no rule get the default value. Rule sets are compiled once
+into a vectorized kernel, so new pathogens can be added as configuration in the settings file::
+
+    [RULES my_pathogen]
+    default = 0
+    rule1 = minrgb_g < 50 and backlight < 2000 -> 255
+
+Available channels are the colour channels ``blue``, ``green`` and ``red``, the ``backlight``
+image, the HSV ``saturation``, the minimum and maximum intensity projections ``minrgb_b``,
+``minrgb_g``, ``minrgb_r``, ``maxrgb_b``, ``maxrgb_g``, ``maxrgb_r`` (see `helpers.rgb_features`)
+and ``rg_diff``, the absolute difference of the red and green channel.
+
+Rule sets which depend on a single uint8 channel or only on the colour of a pixel (plus optional
+backlight thresholds) can additionally be compiled into lookup tables, see `LookupTable`.
+"""
+
+import re
+from collections.abc import Mapping
+from configparser import ConfigParser
+
+import cv2
+import numpy as np
+
+_OPERATORS = {
+    '<': np.less,
+    '<=': np.less_equal,
+    '>': np.greater,
+    '>=': np.greater_equal,
+    '==': np.equal,
+    '!=': np.not_equal,
+}
+
+_CONDITION = re.compile(r'^\s*(\w+)\s*(<=|>=|==|!=|<|>)\s*(-?\d+)\s*$')
+
+
+def _projection(rgb, index, reduce):
+    """Channel `index` of the minimum or maximum intensity projection (see `helpers.rgb_features`)."""
+    channel = rgb[:, :, index]
+    projection = reduce(reduce(rgb[:, :, 0], rgb[:, :, 1]), rgb[:, :, 2])
+    return np.where(channel == projection, channel, 0).astype(rgb.dtype)
+
+
+def _saturation(rgb):
+    # The saturation does not depend on the channel order, so the BGR lane can be converted as is
+    return cv2.cvtColor(np.ascontiguousarray(rgb), cv2.COLOR_RGB2HSV)[:, :, 1]
+
+
+#: Functions deriving a named channel from the lane RGB (BGR channel order) and backlight images.
+CHANNELS = {
+    'blue': lambda rgb, backlight: rgb[:, :, 0],
+    'green': lambda rgb, backlight: rgb[:, :, 1],
+    'red': lambda rgb, backlight: rgb[:, :, 2],
+    'backlight': lambda rgb, backlight: backlight,
+    'saturation': lambda rgb, backlight: _saturation(rgb),
+    'minrgb_b': lambda rgb, backlight: _projection(rgb, 0, np.minimum),
+    'minrgb_g': lambda rgb, backlight: _projection(rgb, 1, np.minimum),
+    'minrgb_r': lambda rgb, backlight: _projection(rgb, 2, np.minimum),
+    'maxrgb_b': lambda rgb, backlight: _projection(rgb, 0, np.maximum),
+    'maxrgb_g': lambda rgb, backlight: _projection(rgb, 1, np.maximum),
+    'maxrgb_r': lambda rgb, backlight: _projection(rgb, 2, np.maximum),
+    'rg_diff': lambda rgb, backlight: np.abs(rgb[:, :, 2].astype(np.int16) - rgb[:, :, 1]),
+}
+
+
+class LaneChannels(Mapping):
+    """
+    Lazily computed feature channels of a lane.
+
+    Channels are derived from the lane images on first access and cached. Feature images which
+    were already computed can be passed as keyword arguments, e.g. ``minrgb=min_rgb_image``
+    provides ``minrgb_b``, ``minrgb_g`` and ``minrgb_r``, and single channels such as
+    ``green=green_image`` are used as they are.
+
+    Parameters
+    ----------
+    rgb : np.ndarray or None
+        The RGB lane image (BGR channel order), None if all channels are given as features.
+    backlight : np.ndarray or None
+        The backlight lane image.
+    """
+
+    def __init__(self, rgb, backlight, **features):
+        self.rgb = rgb
+        self.backlight = backlight
+        self._channels = {}
+        for name, image in features.items():
+            if name in ('minrgb', 'maxrgb'):
+                for index, suffix in enumerate('bgr'):
+                    self._channels[f'{name}_{suffix}'] = image[:, :, index]
+            else:
+                self._channels[name] = image
+
+    def __getitem__(self, name):
+        if name not in self._channels:
+            self._channels[name] = CHANNELS[name](self.rgb, self.backlight)
+        return self._channels[name]
+
+    def __iter__(self):
+        return iter(CHANNELS)
+
+    def __len__(self):
+        return len(CHANNELS)
+
+
+class Rule(object):
+    """
+    A conjunction of channel comparisons and the value assigned when all of them hold.
+
+    Attributes:
+        conditions (list): List of (channel, operator, threshold) tuples.
+        value (int): Prediction value of the matching pixels.
+    """
+
+    def __init__(self, conditions, value):
+        for channel, operator, threshold in conditions:
+            if channel not in CHANNELS:
+                raise ValueError(f"Unknown channel '{channel}', available: {', '.join(CHANNELS)}")
+            if operator not in _OPERATORS:
+                raise ValueError(f"Unknown operator '{operator}'")
+        self.conditions = list(conditions)
+        self.value = value
+
+    @classmethod
+    def parse(cls, text):
+        """
+        Parse a rule of the form ``channel op threshold [and ...] -> value``.
+
+        :param text: The rule, e.g. ``"saturation > 130 and backlight < 1000 -> 255"``.
+        :return: The parsed rule.
+        :raises ValueError: If the rule is malformed.
+        """
+        conditions_text, arrow, value = text.rpartition('->')
+        if not arrow or not value.strip().isdigit():
+            raise ValueError(f"Invalid rule '{text}', expected 'conditions -> value'")
+
+        conditions = []
+        for condition in conditions_text.split(' and '):
+            match = _CONDITION.match(condition)
+            if not match:
+                raise ValueError(f"Invalid condition '{condition.strip()}' in rule '{text}'")
+            channel, operator, threshold = match.groups()
+            conditions.append((channel, operator, int(threshold)))
+        return cls(conditions, int(value))
+
+    def __str__(self):
+        conditions = ' and '.join(f'{channel} {operator} {threshold}'
+                                  for channel, operator, threshold in self.conditions)
+        return f'{conditions} -> {self.value}'
+
+
+class RuleSet(object):
+    """
+    An ordered list of rules compiled into a vectorized prediction kernel.
+
+    Calling the rule set with the channels of a lane returns the predicted image
+    (dtype uint8). The first matching rule decides the value of a pixel.
+
+    Attributes:
+        rules (list): The rules in order of precedence.
+        default (int): Value of the pixels matching no rule.
+    """
+
+    def __init__(self, rules, default=0):
+        self.rules = [Rule.parse(rule) if isinstance(rule, str) else rule for rule in rules]
+        self.default = default
+        self.channels = sorted({channel for rule in self.rules for channel, _, _ in rule.conditions})
+        # Compile the rules once: resolve the operators and evaluate the last rule first,
+        # so earlier rules overwrite later ones and no "undecided" mask has to be tracked
+        self._compiled = [(rule.value, [(channel, _OPERATORS[operator], threshold)
+                                        for channel, operator, threshold in rule.conditions])
+                          for rule in reversed(self.rules)]
+
+    @classmethod
+    def from_config(cls, config, section):
+        """
+        Read a rule set from a settings section with a ``default`` option and one option per rule.
+
+        Rules are applied in the order they appear in the section.
+
+        :param config: The ConfigParser holding the section.
+        :param section: The section name, e.g. ``"RULES my_pathogen"``.
+        :return: The rule set.
+        """
+        default = config.getint(section, 'default', fallback=0)
+        rules = [value for option, value in config.items(section) if option != 'default']
+        return cls(rules, default)
+
+    def __call__(self, channels, out=None):
+        """
+        Predict a lane.
+
+        :param channels: Mapping from channel name to image, usually a `LaneChannels`.
+        :param out: A uint8 array to store the prediction in (optional).
+        :return: The predicted binary image (255 = pathogen, 0 = background).
+        """
+        shape = channels[self.channels[0]].shape[:2] if self.channels else channels['backlight'].shape[:2]
+        predicted_image = np.empty(shape, dtype=np.uint8) if out is None else out
+        predicted_image.fill(self.default)
+
+        mask = np.empty(shape, dtype=bool)
+        condition = np.empty(shape, dtype=bool)
+        for value, conditions in self._compiled:
+            mask.fill(True)
+            for channel, operator, threshold in conditions:
+                operator(channels[channel], threshold, out=condition)
+                mask &= condition
+            predicted_image[mask] = value
+
+        return predicted_image
+
+    def predict(self, rgb, backlight, **features):
+        """Predict a lane from its RGB and backlight images, see `LaneChannels` for `features`."""
+        return self(LaneChannels(rgb, backlight, **features))
+
+    def lookup(self, channels, out=None):
+        """
+        Predict a lane with the lookup table of the rule set, see `LookupTable`.
+
+        Falls back to the vectorized kernel if the rule set cannot be compiled into a table or
+        the channels needed by the table are not available. Both give identical predictions.
+
+        :param channels: Mapping from channel name to image, usually a `LaneChannels`.
+        :param out: A uint8 array to store the prediction in (optional).
+        :return: The predicted binary image (255 = pathogen, 0 = background).
+        """
+        table = lookup_table(self)
+        if table is None or (table.channel is None and getattr(channels, 'rgb', None) is None):
+            return self(channels, out=out)
+        return table(channels, out=out)
+
+    def __str__(self):
+        return '\n'.join([str(rule) for rule in self.rules] + [f'default -> {self.default}'])
+
+
+class LookupTable(object):
+    """
+    A rule set precompiled into a lookup table.
+
+    Rule sets over a single uint8 channel (e.g. ``green`` or ``saturation``) are compiled into
+    256-entry tables and applied with `cv2.LUT`. Rule sets over colour channels only (e.g. the
+    ``minrgb_*`` projections) are compiled into a packed bitmap with one bit for each of the 2^24
+    RGB triples, which requires that the rules produce at most two distinct values. Backlight
+    conditions split the backlight range into cells in which all of them are constant, every cell
+    gets a table of its own.
+
+    Tables are expensive to build (the bitmap evaluates the rules for every RGB triple), use
+    `lookup_table` to get the table of a rule set once per process.
+
+    Attributes:
+        channel (str or None): The input channel of a 256-entry table, None for an RGB bitmap.
+        boundaries (np.ndarray): Backlight values at which a new cell starts.
+        table (np.ndarray): Read-only table of shape (cells, 256) or packed bitmap of shape (cells, 2^21).
+        values (np.ndarray): Values of the unset and set bits of a bitmap.
+    """
+
+    def __init__(self, rule_set):
+        if not self.supports(rule_set):
+            raise ValueError(f'Rule set cannot be compiled into a lookup table:\n{rule_set}')
+        channels = [channel for channel in rule_set.channels if channel != 'backlight']
+        self.channel = channels[0] if len(channels) == 1 and channels[0] in _UINT8_CHANNELS else None
+
+        boundaries = set()
+        for rule in rule_set.rules:
+            for channel, operator, threshold in rule.conditions:
+                if channel == 'backlight':
+                    if operator in ('<', '>=', '==', '!='):
+                        boundaries.add(threshold)
+                    if operator in ('<=', '>', '==', '!='):
+                        boundaries.add(threshold + 1)
+        self.boundaries = np.array(sorted(boundaries), dtype=np.int64)
+        # Any backlight value of a cell decides the backlight conditions of the whole cell
+        representatives = np.concatenate(([self.boundaries[0] - 1 if len(self.boundaries) else 0], self.boundaries))
+
+        if self.channel is not None:
+            values = np.arange(256, dtype=np.uint8).reshape(1, 256)
+            self.table = np.stack([rule_set({self.channel: values, 'backlight': np.broadcast_to(backlight, values.shape)})[0]
+                                   for backlight in representatives])
+            self.values = None
+        else:
+            outcomes = sorted({rule.value for rule in rule_set.rules} | {rule_set.default})
+            self.values = np.zeros(256, dtype=np.uint8)
+            self.values[:2] = outcomes[0], outcomes[-1]
+            # All triples in the byte order of a little-endian BGRA pixel: blue is the lowest byte
+            index = np.arange(1 << 24, dtype=np.uint32).reshape(4096, 4096)
+            rgb = np.dstack((index & 255, (index >> 8) & 255, index >> 16)).astype(np.uint8)
+            del index
+            bitmaps = []
+            for backlight in representatives:
+                predicted_image = rule_set(LaneChannels(rgb, np.broadcast_to(backlight, rgb.shape[:2])))
+                bitmaps.append(np.packbits(predicted_image.ravel() == self.values[1], bitorder='little'))
+            self.table = np.stack(bitmaps)
+        self.table.flags.writeable = False
+
+    @staticmethod
+    def supports(rule_set):
+        """Return True if the rule set can be compiled into a lookup table."""
+        channels = [channel for channel in rule_set.channels if channel != 'backlight']
+        if len(channels) == 1 and channels[0] in _UINT8_CHANNELS:
+            return True
+        return bool(channels) and len({rule.value for rule in rule_set.rules} | {rule_set.default}) <= 2
+
+    def __call__(self, channels, out=None):
+        """
+        Predict a lane.
+
+        :param channels: Mapping from channel name to image, usually a `LaneChannels`.
+        :param out: A contiguous uint8 array to store the prediction in (optional).
+        :return: The predicted binary image (255 = pathogen, 0 = background).
+        """
+        if self.channel is not None:
+            channel = channels[self.channel]
+            predicted_image = cv2.LUT(channel, self.table[0], dst=out)
+            for cell, boundary in enumerate(self.boundaries, 1):
+                np.copyto(predicted_image, cv2.LUT(channel, self.table[cell]),
+                          where=channels['backlight'] >= boundary)
+            return predicted_image
+
+        rgb = np.ascontiguousarray(channels.rgb)
+        index = cv2.cvtColor(rgb, cv2.COLOR_BGR2BGRA).view('<u4')[:, :, 0]
+        # The alpha byte holds the backlight cell, so one lookup covers all cells
+        index &= 0xFFFFFF
+        for boundary in self.boundaries:
+            np.add(index, 1 << 24, out=index, where=channels['backlight'] >= boundary)
+        bits = self.table.ravel()[index >> 3]
+        bits >>= (index & 7).astype(np.uint8)
+        bits &= 1
+        return cv2.LUT(bits, self.values, dst=out)
+
+
+# Channels with uint8 values which can be the input of a 256-entry table
+_UINT8_CHANNELS = set(CHANNELS) - {'backlight', 'rg_diff'}
+
+_TABLES = {}
+
+
+def lookup_table(rule_set):
+    """
+    Return the lookup table of a rule set, building it on first use.
+
+    Tables are cached per process by the text of the rule set. The cli builds the table of the
+    selected rule set with `build_tables` when a run starts, before the first plate.
+
+    :param rule_set: The `RuleSet`.
+    :return: The `LookupTable`, or None if the rule set cannot be compiled into a table.
+    """
+    key = str(rule_set)
+    if key not in _TABLES:
+        _TABLES[key] = LookupTable(rule_set) if LookupTable.supports(rule_set) else None
+    return _TABLES[key]
+
+
+def build_tables(rule_sets):
+    """Build the lookup tables of the given rule sets, e.g. ``build_tables(RULES.values())``."""
+    for rule_set in rule_sets:
+        lookup_table(rule_set)
+
+
+#: Rule sets of the built-in predictors, reproducing the thresholds of the original pixel loops.
+RULES = {
+    # Bgt: the green thresholds of the original implementation were always overwritten by the backlight check
+    'min_rgb': RuleSet([
+        'minrgb_b == 0 and minrgb_r == 0 and backlight < 150 -> 255',
+        'minrgb_b == 0 and minrgb_r == 0 -> 0',
+        'rg_diff < 3 and minrgb_r < 40 -> 0',
+        'rg_diff < 3 -> 255',
+    ], default=0),
+    # Bipolaris: red intensity between 40 and 110 unless both green and red are bright
+    'max_rgb': RuleSet([
+        'maxrgb_g > 50 and maxrgb_r > 50 -> 0',
+        'maxrgb_r > 40 and maxrgb_r < 110 -> 255',
+    ], default=0),
+    # Net blotch: dark necrotic lesions in the green channel
+    'green': RuleSet([
+        'green < 28 -> 255',
+    ], default=0),
+    # Rust: saturated pustules on translucent leaf tissue
+    'saturation': RuleSet([
+        'saturation > 130 and backlight < 1000 -> 255',
+    ], default=0),
+}
+
+
+def load_rules(setting_file: str) -> dict:
+    """
+    Return the built-in rule sets updated with the ``[RULES <name>]`` sections of a settings file.
+
+    :param setting_file: Path to the configuration file.
+    :return: Dictionary from predictor name to `RuleSet`.
+    """
+    config = ConfigParser()
+    config.read(setting_file)
+
+    rule_sets = dict(RULES)
+    for section in config.sections():
+        if section.startswith('RULES '):
+            rule_sets[section[len('RULES '):].strip()] = RuleSet.from_config(config, section)
+    return rule_sets
@@ -1,15 +1,41 @@
 import cv2
 import numpy as np
 import os
-from operator import itemgetter
-from skimage.filters import threshold_otsu
-from skimage import img_as_uint
 from configparser import ConfigParser
 from macrobot.prediction import predict_leaf
+from macrobot import thresholding
+from macrobot.lanes import Lane, Leaf, to_list
+from macrobot.results import LeafRecords, write_records
+from macrobot.training_data import ShardWriter
 
 def segment_lanes_rgb(rgb_image: np.ndarray, image_backlight: np.ndarray, image_thresholded: np.ndarray,
                      experiment: str, plate_id: str, setting_file: str) -> tuple:
     """
+    Extract lanes between white frames from an RGB image as lists of [position, image] pairs.
+
+    See `segment_lanes`, which returns the lanes as `lanes.Lane` records.
+
+    Returns
+    -------
+    tuple
+        A tuple containing:
+            - lanes_roi_rgb (list): List of tuples with lane position and RGB ROI.
+            - lanes_roi_backlight (list): List of tuples with lane position and backlight ROI.
+            - lane_count (int): Total number of lanes extracted.
+
+    Example
+    -------
+    >>> lanes_rgb, lanes_backlight, count = segment_lanes_rgb(rgb_img, backlight_img, thresh_img,
+                                                              "Experiment1", "PlateA1", "settings.ini")
+    """
+    lanes, lane_count = segment_lanes(rgb_image, image_backlight, image_thresholded, experiment, plate_id,
+                                      setting_file)
+    return to_list(lanes, 'rgb'), to_list(lanes, 'backlight'), lane_count
+
+
+def segment_lanes(rgb_image: np.ndarray, image_backlight: np.ndarray, image_thresholded: np.ndarray,
+                  experiment: str, plate_id: str, setting_file: str) -> tuple:
+    """
     Extract lanes between white frames from an RGB image.
 
     This function identifies and extracts lanes from the provided RGB image by:
@@ -38,8 +64,7 @@ def segment_lanes_rgb(rgb_image: np.ndarray, image_backlight: np.ndarray, image_
     -------
     tuple
         A tuple containing:
-            - lanes_roi_rgb (list): List of tuples with lane position and RGB ROI.
-            - lanes_roi_backlight (list): List of tuples with lane position and backlight ROI.
+            - lanes (list): `Lane` records sorted left to right, holding views into the plate images.
             - lane_count (int): Total number of lanes extracted.
 
     Raises
@@ -49,8 +74,7 @@ def segment_lanes_rgb(rgb_image: np.ndarray, image_backlight: np.ndarray, image_
 
     Example
     -------
-    >>> lanes_rgb, lanes_backlight, count = segment_lanes_rgb(rgb_img, backlight_img, thresh_img,
-                                                              "Experiment1", "PlateA1", "settings.ini")
+    >>> lanes, count = segment_lanes(rgb_img, backlight_img, thresh_img, "Experiment1", "PlateA1", "settings.ini")
     """
     # Initialize ConfigParser and load settings
     config = ConfigParser()
@@ -117,27 +141,17 @@ def segment_lanes_rgb(rgb_image: np.ndarray, image_backlight: np.ndarray, image_
 
                         # Validate lane dimensions
                         if width_min < width < width_max:
-                            # Extract ROI for both RGB and backlight images
+                            # Extract ROI views for both RGB and backlight images
                             lane_roi = rgb_image[y:y + height, x:x + width]
                             lane_roi_backlight = image_backlight[y:y + height, x:x + width]
-                            lanes.append((lane_roi, int(x), lane_roi_backlight))
+                            lanes.append(Lane(None, lane_roi, lane_roi_backlight, bbox=(x, y, width, height)))
 
     # Sort lanes based on their x-coordinate positions (left to right)
-    lanes = sorted(lanes, key=itemgetter(1))
-
-    # Warn if fewer than expected lanes are found
-    if len(lanes) < 4:
-        print(f'Warning, < 4 lanes! Found: {len(lanes)}')
-        with open('log.txt', 'a') as log_file:
-            log_file.write(f"{experiment}\t{plate_id}\tWarning, < 4 lanes! Found: {len(lanes)}\n")
-
-    # Initialize lists to store sorted ROI information
-    lanes_roi_rgb = []
-    lanes_roi_backlight = []
+    lanes = sorted(lanes, key=lambda lane: lane.bbox[0])
 
     # Assign lane positions based on predefined lane_positions
     for lane in lanes:
-        x_position = lane[1]
+        x_position = lane.bbox[0]
         if x_position < lane_positions[0]:
             lane_position = 1
         elif lane_positions[1] < x_position <= lane_positions[2]:
@@ -149,11 +163,9 @@ def segment_lanes_rgb(rgb_image: np.ndarray, image_backlight: np.ndarray, image_
         else:
             lane_position = None  # Handle unexpected positions if necessary
 
-        # Append the ROI and its position to the respective lists
-        lanes_roi_rgb.append([lane_position, lane[0]])
-        lanes_roi_backlight.append([lane_position, lane[2]])
+        lane.position = lane_position
 
-    return lanes_roi_rgb, lanes_roi_backlight, len(lanes)
+    return lanes, len(lanes)
 
 
 def segment_lanes_binary(lanes_roi_backlight: list, setting_file: str) -> list:
@@ -164,6 +176,10 @@ def segment_lanes_binary(lanes_roi_backlight: list, setting_file: str) -> list:
     to generate a binary image suitable for leaf segmentation. It also attempts to
     separate touching leaves by analyzing row-wise pixel intensities.
 
+    Rows with (almost) no leaf pixels are noise rows. For compatibility with earlier results
+    the row *above* each noise row is cleared; set ``fix_noise_row_offset = true`` in the
+    ``SEGMENTATION`` section to clear the noise rows themselves.
+
     Parameters
     ----------
     lanes_roi_backlight : list
@@ -190,37 +206,124 @@ def segment_lanes_binary(lanes_roi_backlight: list, setting_file: str) -> list:
     config = ConfigParser()
     config.read(setting_file)
     noise_thresh = config.getint('SEGMENTATION', 'noise_thresh')
+    fix_noise_row_offset = config.getboolean('SEGMENTATION', 'fix_noise_row_offset', fallback=False)
+
+    return [[lane_position, _binary_lane(lane_image_backlight, noise_thresh, fix_noise_row_offset)]
+            for lane_position, lane_image_backlight in lanes_roi_backlight]
+
+
+def binarize_lanes(lanes: list, setting_file: str) -> None:
+    """
+    Compute the binary image of each lane record from its backlight image, see `segment_lanes_binary`.
+
+    :param lanes: The `Lane` records, their `binary` attribute is set.
+    :param setting_file: Path to the configuration file containing segmentation parameters.
+    """
+    config = ConfigParser()
+    config.read(setting_file)
+    noise_thresh = config.getint('SEGMENTATION', 'noise_thresh')
+    fix_noise_row_offset = config.getboolean('SEGMENTATION', 'fix_noise_row_offset', fallback=False)
+
+    for lane in lanes:
+        lane.binary = _binary_lane(lane.backlight, noise_thresh, fix_noise_row_offset)
+
+
+def _binary_lane(lane_image_backlight: np.ndarray, noise_thresh: int, fix_noise_row_offset: bool) -> np.ndarray:
+    """Otsu thresholded backlight lane (255 = leaf) with the noise rows cleared."""
+    # Apply Otsu's thresholding to obtain a binary image (255 = leaf)
+    image_binary_lane = thresholding.mask_below(lane_image_backlight,
+                                                thresholding.threshold_otsu(lane_image_backlight))
+
+    # Analyze row-wise mean to identify noise rows. The mean is taken over the 16-bit
+    # image (leaf = 65535) as before, so the noise threshold keeps its meaning
+    mean_rows = np.count_nonzero(image_binary_lane, axis=1) * 65535.0 / image_binary_lane.shape[1]
+    noise_rows = mean_rows < noise_thresh
+    if not fix_noise_row_offset:
+        # Compatibility: the original implementation cleared the row above each noise row
+        noise_rows = np.append(noise_rows[1:], False)
+
+    # Segment the binary image by zeroing out noise rows
+    image_binary_lane[noise_rows] = 0
+    return image_binary_lane
+
+
+def detect_leaves(image_binary_lane: np.ndarray, y_position: int, min_leaf_size: int) -> tuple:
+    """
+    Find the leaves of a binary lane image.
+
+    The binary lane is eroded to remove small artifacts. Leaves are the external contours
+    larger than `min_leaf_size` whose bounding box starts above `y_position`, numbered from 1
+    in the order they are scored.
+
+    Parameters
+    ----------
+    image_binary_lane : np.ndarray
+        The binary lane image (255 = leaf, 0 = background).
+    y_position : int
+        Leaves starting below this y-coordinate are ignored to avoid false positives.
+    min_leaf_size : int
+        Minimum contour area of a leaf in pixels.
+
+    Returns
+    -------
+    tuple
+        A tuple containing:
+            - image_binary_lane (np.ndarray): The eroded binary lane image.
+            - leaves (list): List of (leaf_id, contour, (x, y, w, h)) tuples.
+
+    Example
+    -------
+    >>> eroded_lane, leaves = detect_leaves(binary_lane, 800, 3000)
+    """
+    # Erode the binary image to remove small noise
+    kernel = np.ones((3, 3), np.uint8)
+    image_binary_lane = cv2.erode(image_binary_lane, kernel, iterations=1)
 
-    # Initialize a list to store binary lane images
-    lanes_roi_binary = []
+    return image_binary_lane, _find_leaves(image_binary_lane, y_position, min_leaf_size)
 
-    # Iterate over each backlight lane ROI
-    for lane in lanes_roi_backlight:
-        lane_position, lane_image_backlight = lane
 
-        # Apply Otsu's thresholding to obtain a binary image
-        otsu_threshold = threshold_otsu(lane_image_backlight)
-        thresholded_lane = lane_image_backlight < otsu_threshold
-        thresholded_lane = img_as_uint(thresholded_lane)
+def _find_leaves(image_binary_lane: np.ndarray, y_position: int, min_leaf_size: int) -> list:
+    """The (leaf_id, contour, (x, y, w, h)) tuples of the leaves of an eroded binary lane, see `detect_leaves`."""
+    # Find contours in the binary lane image
+    contours, hierarchy = cv2.findContours(image_binary_lane, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
-        # Initialize a white binary image
-        image_binary_lane = np.ones(lane_image_backlight.shape[:2], dtype="uint8") * 255
+    leaves = []
+    leaf_id = 1
+    # Process contours in reverse order (top to bottom)
+    for cnt in reversed(contours):
+        if cv2.contourArea(cnt) > min_leaf_size:
+            x, y, w, h = cv2.boundingRect(cnt)
+            # Exclude leaves located below a certain y-position to avoid false positives
+            if y < y_position:
+                leaves.append((leaf_id, cnt, (x, y, w, h)))
+                leaf_id += 1
 
-        # Analyze row-wise mean to identify noise rows
-        mean_rows = thresholded_lane.mean(axis=1)
-        noise_row_nr = [idx - 1 for idx, row in enumerate(mean_rows) if row < noise_thresh]
+    return leaves
 
-        # Segment the binary image by zeroing out noise rows
-        for i in range(lane_image_backlight.shape[0]):
-            if i in noise_row_nr:
-                image_binary_lane[i, :] = 0
-            else:
-                image_binary_lane[i, :] = thresholded_lane[i, :]
 
-        # Append the binary lane image and its position to the list
-        lanes_roi_binary.append([lane_position, image_binary_lane])
+def detect_lane_leaves(lanes: list, setting_file: str) -> None:
+    """
+    Find the leaves of each lane record with the leaf settings of the configuration file.
+
+    Parameters
+    ----------
+    lanes : list
+        The `Lane` records with binary images, their `leaves` attribute is set to a list of `Leaf` records.
+    setting_file : str
+        Path to the configuration file containing segmentation parameters.
+
+    Example
+    -------
+    >>> detect_lane_leaves(lanes, "settings.ini")
+    """
+    config = ConfigParser()
+    config.read(setting_file)
+    y_position = config.getint('SEGMENTATION', 'y_position')
+    min_leaf_size = config.getint('SEGMENTATION', 'min_leaf_size')
 
-    return lanes_roi_binary
+    for lane in lanes:
+        lane.leaves = [Leaf(leaf_id, cnt, bbox, lane)
+                       for leaf_id, cnt, bbox in _find_leaves(lane.eroded, y_position, min_leaf_size)]
 
 
 def segment_leaf_binary(lanes_roi_binary: list, lanes_roi_rgb: list, plate_id: str, predicted_lanes: list,
@@ -229,12 +332,7 @@ def segment_leaf_binary(lanes_roi_binary: list, lanes_roi_rgb: list, plate_id: s
     """
     Segment individual leaves from binary lane images and perform infection prediction.
 
-    This function processes each binary lane to identify and segment individual leaves by:
-    1. Loading segmentation parameters from a configuration file.
-    2. Eroding the binary image to remove small artifacts.
-    3. Finding contours corresponding to leaves and filtering based on size.
-    4. Extracting bounding boxes for each leaf and performing infection prediction.
-    5. Saving segmented leaf images and recording prediction results.
+    Version of `score_leaves` for lanes given as lists of [position, image] pairs.
 
     Parameters
     ----------
@@ -252,10 +350,11 @@ def segment_leaf_binary(lanes_roi_binary: list, lanes_roi_rgb: list, plate_id: s
         The name or identifier of the current experiment.
     dai : str
         Days after inoculation (experimental time point).
-    file_results : file object
-        The CSV file object where prediction results per leaf will be recorded.
-    store_leaf_path : str
-        The directory path where individual leaf images will be saved.
+    file_results : file object or results.ResultsSink
+        The CSV file object or results sink where prediction results per leaf will be recorded.
+    store_leaf_path : str or training_data.ShardWriter
+        The directory path where individual leaf images will be saved, or the writer of the
+        training data shards, see `score_leaves`.
     setting_file : str
         Path to the configuration file containing segmentation parameters.
 
@@ -275,93 +374,99 @@ def segment_leaf_binary(lanes_roi_binary: list, lanes_roi_rgb: list, plate_id: s
     >>> segment_leaf_binary(binary_lanes, rgb_lanes, "PlateA1", predicted_lanes, "/results",
                            "Experiment1", "5", csv_file, "/leaves", "settings.ini")
     """
-    # Initialize ConfigParser and load settings
-    config = ConfigParser()
-    config.read(setting_file)
-    y_position = config.getint('SEGMENTATION', 'y_position')
-    min_leaf_size = config.getint('SEGMENTATION', 'min_leaf_size')
-    leaves_per_lane = config.getint('SEGMENTATION', 'leaves_per_lane')
-
-    # Iterate over each lane by index
-    for lane_id in range(len(lanes_roi_binary)):
-        binary_lane_position, image_binary_lane = lanes_roi_binary[lane_id]
-        rgb_lane_position, image_RGB_lane = lanes_roi_rgb[lane_id]
-        predicted_lane_position, image_prediction_lane = predicted_lanes[lane_id]
-
+    lanes = []
+    for (binary_lane_position, image_binary_lane), (rgb_lane_position, image_RGB_lane), \
+            (predicted_lane_position, image_prediction_lane) in zip(lanes_roi_binary, lanes_roi_rgb, predicted_lanes):
         # Ensure lane positions match across different lane representations
         assert binary_lane_position == rgb_lane_position == predicted_lane_position, \
             "Lane positions do not match across binary, RGB, and predicted lanes."
 
-        # Erode the binary image to remove small noise
-        kernel = np.ones((3, 3), np.uint8)
-        image_binary_lane = cv2.erode(image_binary_lane, kernel, iterations=1)
-
-        # Initialize leaf ID counter
-        leaf_id = 1
-
-        # Find contours in the binary lane image
-        contours, hierarchy = cv2.findContours(image_binary_lane, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        contours.reverse()  # Optional: Process contours in reverse order if needed
-
-        # Iterate over each contour to identify valid leaves
-        for cnt in contours:
-            contour_area = cv2.contourArea(cnt)
-            if contour_area > min_leaf_size:
+        lane = Lane(rgb_lane_position, image_RGB_lane, None, binary=image_binary_lane)
+        lane.prediction = image_prediction_lane
+        lanes.append(lane)
 
-                x, y, w, h = cv2.boundingRect(cnt)
+    score_leaves(lanes, plate_id, destination_path, experiment, dai, file_results, store_leaf_path, setting_file)
 
-                # Extract bounding boxes for prediction and binary images
-                bb_leaf_prediction = image_prediction_lane[y:y + h, x:x + w]
-                bb_leaf_binary = image_binary_lane[y:y + h, x:x + w]
 
-                # Exclude leaves located below a certain y-position to avoid false positives
-                if y < y_position:
-                    hull = cv2.convexHull(cnt)
-                    bb_leaf_rgb = image_RGB_lane[y:y + h, x:x + w]
-
-                    # Save RGB leaf image if path is provided
-                    if store_leaf_path:
-                        leaf_rgb_path = os.path.join(store_leaf_path,
-                                                     f"{experiment}_{plate_id}_{leaf_id}_rgb.png")
-                        cv2.imwrite(leaf_rgb_path, bb_leaf_rgb)
-
-                    # Create a mask for the convex hull of the leaf
-                    mask = np.ones(image_binary_lane.shape[:2], dtype="uint8") * 255
-                    cv2.drawContours(mask, [hull], -1, 0, -1)
-
-                    # Process only a limited number of leaves per lane
-                    if leaf_id <= leaves_per_lane:
-                        x2, y2, w2, h2 = cv2.boundingRect(hull)
-
-                        # Draw convex hull on the RGB lane image for visualization
-                        cv2.drawContours(image_RGB_lane, [hull], -1, (0, 0, 255), 2)
-
-                        # Convert prediction lane to RGB for visualization
-                        image_prediction_lane_rgb = cv2.cvtColor(image_prediction_lane, cv2.COLOR_GRAY2RGB)
-                        bb_leaf_prediction2 = image_prediction_lane_rgb[y2:y2 + h2, x2:x2 + w2]
+def score_leaves(lanes: list, plate_id: str, destination_path: str, experiment: str, dai: str, file_results,
+                 store_leaf_path: str, setting_file: str) -> None:
+    """
+    Segment individual leaves from binary lane images and perform infection prediction.
 
-                        # Save binary prediction image if path is provided
-                        if store_leaf_path:
-                            leaf_binary_path = os.path.join(store_leaf_path,
-                                                            f"{experiment}_{plate_id}_{leaf_id}_binary.png")
-                            cv2.imwrite(leaf_binary_path, bb_leaf_prediction2)
+    This function processes each lane to identify and segment individual leaves by:
+    1. Loading segmentation parameters from a configuration file.
+    2. Eroding the binary image and finding the leaves, unless `detect_lane_leaves` was already called.
+    3. Extracting bounding boxes for each leaf and performing infection prediction.
+    4. Saving segmented leaf images and recording prediction results.
 
-                        # Draw convex hull on the prediction lane image for visualization
-                        cv2.drawContours(image_prediction_lane_rgb, [hull], -1, (0, 0, 255), 2)
+    The lane images are not modified. The images with the leaf hulls are rendered from the
+    leaf polygons, see `overlays.render_plate`.
 
-                        # Perform infection prediction on the leaf
-                        percent_infection = predict_leaf(bb_leaf_prediction, bb_leaf_binary)
+    Parameters
+    ----------
+    lanes : list
+        The `Lane` records with binary and predicted images.
+    plate_id : str
+        The identifier for the specific plate being processed.
+    destination_path : str
+        The directory path where the final result images and CSV files will be stored.
+    experiment : str
+        The name or identifier of the current experiment.
+    dai : str
+        Days after inoculation (experimental time point).
+    file_results : file object or results.ResultsSink
+        The CSV file object or results sink where prediction results per leaf will be recorded.
+    store_leaf_path : str or training_data.ShardWriter
+        The directory path where individual leaf images will be saved, or the writer of the
+        training data shards which receives every leaf with its crops and results.
+    setting_file : str
+        Path to the configuration file containing segmentation parameters.
 
-                        # Generate a unique identifier for the leaf
-                        unique_ID = f"{experiment}_{plate_id.split('_')[-1]}_{rgb_lane_position}"
+    Example
+    -------
+    >>> score_leaves(lanes, "PlateA1", "/results", "Experiment1", "5", csv_file, "/leaves", "settings.ini")
+    """
+    # Initialize ConfigParser and load settings
+    config = ConfigParser()
+    config.read(setting_file)
+    leaves_per_lane = config.getint('SEGMENTATION', 'leaves_per_lane')
 
-                        # Record prediction results in the CSV file
-                        file_results.write(f"{unique_ID};{experiment};{dai};{plate_id};"
-                                           f"{rgb_lane_position};{leaf_id};{percent_infection}\n")
+    # Erode the binary images and find the leaves above the y-position cut-off
+    if any(lane.leaves is None for lane in lanes):
+        detect_lane_leaves(lanes, setting_file)
 
-                    leaf_id += 1
+    # The results of the plate are added to the results at once
+    records = LeafRecords()
 
-        # Save the annotated RGB lane image with predictions
-        prediction_image_path = os.path.join(destination_path,
-                                             f"{plate_id}_{rgb_lane_position}_leaf_predict.png")
-        cv2.imwrite(prediction_image_path, image_RGB_lane)
+    for lane in lanes:
+        # Generate a unique identifier for the leaves of the lane
+        unique_ID = f"{experiment}_{plate_id.split('_')[-1]}_{lane.position}"
+
+        # Iterate over each detected leaf
+        for leaf in lane.leaves:
+            # Save RGB leaf image if path is provided
+            if store_leaf_path and not isinstance(store_leaf_path, ShardWriter):
+                leaf_rgb_path = os.path.join(store_leaf_path,
+                                             f"{experiment}_{plate_id}_{leaf.leaf_id}_rgb.png")
+                cv2.imwrite(leaf_rgb_path, leaf.rgb)
+
+            percent_infection = None
+            # Process only a limited number of leaves per lane
+            if leaf.leaf_id <= leaves_per_lane:
+                # Save binary prediction image if path is provided, the hull has the bounding box of the leaf
+                if store_leaf_path and not isinstance(store_leaf_path, ShardWriter):
+                    leaf_binary_path = os.path.join(store_leaf_path,
+                                                    f"{experiment}_{plate_id}_{leaf.leaf_id}_binary.png")
+                    cv2.imwrite(leaf_binary_path, cv2.cvtColor(leaf.prediction, cv2.COLOR_GRAY2RGB))
+
+                # Perform infection prediction on the leaf
+                percent_infection = predict_leaf(leaf.prediction, leaf.binary)
+
+                # Record prediction results
+                records.append(unique_ID, experiment, dai, plate_id, lane.position, leaf.leaf_id, percent_infection)
+
+            # Queue the leaf with its crops and results for the training data shards
+            if isinstance(store_leaf_path, ShardWriter):
+                store_leaf_path.add_leaf(unique_ID, experiment, dai, plate_id, leaf, percent_infection)
+
+    write_records(file_results, records)
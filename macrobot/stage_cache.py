@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Content addressed cache of the pipeline stages of a plate.
+
+The outputs of every stage of `mb_pipeline.MacrobotPipeline.start_pipeline` are stored under a
+key which only depends on what they are computed from:
+
+* ``channels``: the decoded and resized images, keyed by the content of the raw images, the
+  procedure, the scaling factor and the code version.
+* ``rgb``: the white-balanced RGB image, additionally keyed by the white balance.
+* ``lanes``: the frame image and the lane boxes, additionally keyed by the lane settings.
+* ``binary``: the binary lanes, additionally keyed by the noise row settings.
+* ``prediction``: the predicted lanes, additionally keyed by the rule set and the prediction mode.
+
+The key of a stage includes the key of the stage before, so a changed setting invalidates its
+stage and all later stages. A later run with the same images restarts from the deepest stage
+of which all stages are cached, e.g. when only the destination or the report template changed.
+The leaves are scored on every run, as the scoring writes the results, the leaf polygons and the
+training data.
+
+Each entry is one uncompressed ``.npz`` file, the cache is bounded in size by removing the least
+recently used entries.
+"""
+
+import functools
+import glob
+import hashlib
+import json
+import os
+import time
+from configparser import ConfigParser
+
+import numpy as np
+
+from macrobot import lane_cache
+
+# The cached stages, in pipeline order
+STAGES = ('channels', 'rgb', 'lanes', 'binary', 'prediction')
+
+# Settings each stage depends on, as (section, option) pairs, see `lane_cache.LANE_SETTINGS`
+_NOISE_SETTINGS = (('SEGMENTATION', 'noise_thresh'), ('SEGMENTATION', 'fix_noise_row_offset'))
+STAGE_SETTINGS = {
+    'channels': (('HARDWARE1', 'scaling_factor'),),
+    'rgb': (('SEGMENTATION', 'whitebalance'),),
+    'lanes': tuple(setting for setting in lane_cache.LANE_SETTINGS
+                   if setting not in (('HARDWARE1', 'scaling_factor'), ('SEGMENTATION', 'whitebalance'))
+                   and setting not in _NOISE_SETTINGS) + (('SEGMENTATION', 'pixel_scale'),),
+    'binary': _NOISE_SETTINGS,
+    # The leaf settings select the predicted pixels of a prediction per leaf
+    'prediction': (('SEGMENTATION', 'y_position'), ('SEGMENTATION', 'min_leaf_size'),
+                   ('SEGMENTATION', 'leaves_per_lane')),
+}
+
+# Upper bound of the size of the cache in bytes
+CACHE_SIZE = 10 * 2 ** 30
+
+
+@functools.lru_cache(maxsize=None)
+def code_version() -> str:
+    """Return a digest of the source files of the macrobot package, so changed code invalidates the cache."""
+    digest = hashlib.sha1()
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.py'))):
+        with open(path, 'rb') as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+def stage_keys(image_paths: list, setting_file: str, procedure: str, extra: dict = None) -> dict:
+    """
+    Build the keys of the stages of a plate.
+
+    :param image_paths: Paths of the raw images of the plate.
+    :param setting_file: Path to the configuration file.
+    :param procedure: Name of the segmentation pipeline, e.g. ``BgtSegmenter.NAME``.
+    :param extra: Further values a stage depends on by stage name, e.g. the rule set for ``prediction``.
+    :return: The hexadecimal key of every stage of `STAGES`.
+    """
+    config = ConfigParser()
+    config.read(setting_file)
+    extra = extra or {}
+
+    digest = hashlib.sha1(f'{procedure}\n{code_version()}\n'.encode())
+    for path in sorted(image_paths):
+        digest.update(f'{os.path.basename(path)}:{lane_cache.file_digest(path)}\n'.encode())
+
+    keys = {}
+    for stage in STAGES:
+        digest.update(f'[{stage}]\n'.encode())
+        for section, option in STAGE_SETTINGS[stage]:
+            digest.update(f'{section}.{option}={config.get(section, option, fallback=None)}\n'.encode())
+        digest.update(str(extra.get(stage, '')).encode())
+        # Every key also covers the keys of the stages before
+        keys[stage] = digest.copy().hexdigest()
+    return keys
+
+
+class StageCache(object):
+    """
+    Size bounded store of the stage outputs of plates.
+
+    The modification time of an entry is its last use, the entries with the oldest modification
+    time are removed first when the cache grows beyond `max_bytes`. A restart from a stage needs
+    all stages before, so `use` marks the earlier stages of a plate as used more recently and the
+    deepest stages of a plate are removed first.
+
+    Attributes:
+        path (str): Directory of the cache.
+        max_bytes (int): Upper bound of the size of the cache.
+        hits (int): Number of entries read.
+        stored (int): Number of entries written.
+        evicted (int): Number of removed entries.
+    """
+
+    def __init__(self, path, max_bytes=CACHE_SIZE):
+        self.path = str(path)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.stored = 0
+        self.evicted = 0
+        self._size = None
+
+    def entry_path(self, key: str) -> str:
+        """Return the location of the entry of a key."""
+        return os.path.join(self.path, key[:2], f'{key}.npz')
+
+    def __contains__(self, key):
+        return os.path.exists(self.entry_path(key))
+
+    def load(self, key: str):
+        """
+        Read an entry.
+
+        :param key: Key of the entry, see `stage_keys`.
+        :return: A tuple (metadata, arrays) of the JSON metadata and the arrays by name, None if there is no valid entry.
+        """
+        path = self.entry_path(key)
+        try:
+            with np.load(path) as container:
+                arrays = {name: container[name] for name in container.files}
+        except (OSError, KeyError, ValueError):
+            return None
+        self.hits += 1
+        return json.loads(str(arrays.pop('metadata'))), arrays
+
+    def save(self, key: str, metadata: dict, arrays: dict) -> None:
+        """
+        Write an entry and remove the least recently used entries if the cache is too large.
+
+        :param key: Key of the entry, see `stage_keys`.
+        :param metadata: JSON serializable values of the entry.
+        :param arrays: The arrays of the entry by name.
+        """
+        path = self.entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first, so an interrupted run never leaves a truncated entry behind
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, metadata=np.array(json.dumps(metadata)), **arrays)
+        # An entry saved again replaces the earlier file of the key
+        try:
+            replaced_size = os.path.getsize(path)
+        except FileNotFoundError:
+            replaced_size = 0
+        os.replace(tmp_path, path)
+        self.stored += 1
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+        else:
+            self._size += os.path.getsize(path) - replaced_size
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def use(self, keys: list) -> None:
+        """
+        Mark the entries of the stages of a plate as used.
+
+        :param keys: The keys of the stages in pipeline order, entries which are not in the cache are skipped.
+        """
+        now = time.time_ns()
+        for stage_id, key in enumerate(keys):
+            # Earlier stages are used a microsecond later than the stage after them
+            timestamp = now - stage_id * 1000
+            try:
+                os.utime(self.entry_path(key), ns=(timestamp, timestamp))
+            except FileNotFoundError:
+                pass
+
+    def evict(self) -> None:
+        """Remove the least recently used entries until the cache is within `max_bytes`."""
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        self._size = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if self._size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._size -= size
+            self.evicted += 1
+
+    def stats(self) -> dict:
+        """Return the number of read, written and removed entries."""
+        return {'hits': self.hits, 'stored': self.stored, 'evicted': self.evicted}
+
+    def _entries(self):
+        # (path, size, last use) of the entries
+        for directory in os.scandir(self.path):
+            if directory.is_dir():
+                for entry in os.scandir(directory.path):
+                    if entry.name.endswith('.npz') and not entry.name.endswith('.tmp.npz'):
+                        stat = entry.stat()
+                        yield entry.path, stat.st_size, stat.st_mtime
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Local SQLite store of the results per leaf of all runs.
+
+Every ``mb`` run adds its results to the store (by default ``~/.macrobot/results.sqlite``,
+or the path in the ``MACROBOT_RESULTS_DB`` environment variable), so results of different
+experiments can be queried without collecting the ``*_leaf.csv`` files::
+
+    mb query --experiment MB0274 --dai 7dai
+
+The results of a plate replace the results of an earlier run of the same plate, also if the
+plate has no scored leaves anymore. The table
+is indexed on experiment, dai, plate, lane and leaf.
+"""
+
+import os
+import sqlite3
+
+from macrobot.results import SqliteSink
+
+DEFAULT_PATH = os.path.join('~', '.macrobot', 'results.sqlite')
+
+# Columns the statistics can be grouped by
+GROUPS = {
+    'experiment': ('experiment',),
+    'dai': ('experiment', 'dai'),
+    'plate': ('experiment', 'dai', 'plate_id'),
+    'lane': ('experiment', 'dai', 'plate_id', 'lane_id'),
+}
+
+STATISTICS = ('plates', 'leaves', 'mean', 'std', 'min', 'max')
+
+
+def default_path() -> str:
+    """Return the path of the results store, ``MACROBOT_RESULTS_DB`` or `DEFAULT_PATH`."""
+    return os.path.expanduser(os.environ.get('MACROBOT_RESULTS_DB', DEFAULT_PATH))
+
+
+class ResultsStore(SqliteSink):
+    """
+    Results sink adding the results to the indexed results store.
+
+    Rows of plates which are already in the store are replaced.
+    """
+
+    def __init__(self, path=None, batch_size=1000):
+        path = path or default_path()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # The store keeps the results of all runs, see `_write`
+        super().__init__(path, batch_size=batch_size, append=True)
+        # Plates whose earlier results are deleted with the next write
+        self._plates = set()
+        with self._connection:
+            self._connection.execute(f'CREATE INDEX IF NOT EXISTS {self.table}_leaf '
+                                     f'ON {self.table} (experiment, dai, plate_id, lane_id, leaf_id)')
+            self._connection.execute(f'CREATE INDEX IF NOT EXISTS {self.table}_dai ON {self.table} (dai)')
+            self._connection.execute(f'CREATE INDEX IF NOT EXISTS {self.table}_plate ON {self.table} (plate_id)')
+
+    def start_plate(self, experiment, dai, plate_id):
+        # A plate without leaves adds no records, its earlier results are deleted anyway
+        with self._lock:
+            self._plates.add((experiment, dai, plate_id))
+
+    def _flush(self):
+        if self._plates and not len(self._records):
+            self._write(self._records)
+        super()._flush()
+
+    def _write(self, records):
+        # The records of a plate are always written in the same batch
+        plates = self._plates | set(zip(records.columns['expNr'], records.columns['dai'], records.columns['Plate_ID']))
+        with self._connection:
+            self._connection.executemany(f'DELETE FROM {self.table} WHERE experiment = ? AND dai = ? AND plate_id = ?',
+                                         plates)
+            self._connection.executemany(self._insert, records.rows())
+        self._plates = set()
+
+
+def query(path: str = None, experiment: str = None, dai: str = None, plate_id: str = None,
+          group_by: str = 'dai') -> list:
+    """
+    Aggregate the infection of the leaves in the results store.
+
+    :param path: Path of the results store, see `default_path`.
+    :param experiment: Only leaves of this experiment (optional).
+    :param dai: Only leaves of this dai (optional).
+    :param plate_id: Only leaves of this plate (optional).
+    :param group_by: One of `GROUPS`, the statistics are computed per experiment, dai, plate or lane.
+    :return: One dictionary per group with the group columns and the `STATISTICS` of the ``%_Inf``.
+    """
+    path = path or default_path()
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No results store at '{path}'.")
+    groups = ', '.join(GROUPS[group_by])
+
+    conditions, parameters = [], []
+    for column, value in (('experiment', experiment), ('dai', dai), ('plate_id', plate_id)):
+        if value is not None:
+            conditions.append(f'{column} = ?')
+            parameters.append(value)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    connection = sqlite3.connect(path)
+    try:
+        rows = connection.execute(
+            f"SELECT {groups}, COUNT(DISTINCT experiment || '/' || dai || '/' || plate_id), COUNT(*), AVG(infection), "
+            f'AVG(infection * infection) - AVG(infection) * AVG(infection), MIN(infection), MAX(infection) '
+            f'FROM leaf_results {where} GROUP BY {groups} ORDER BY {groups}', parameters).fetchall()
+    finally:
+        connection.close()
+
+    statistics = []
+    for row in rows:
+        group = dict(zip(GROUPS[group_by], row))
+        plates, leaves, mean, variance, minimum, maximum = row[len(group):]
+        group.update(plates=plates, leaves=leaves, mean=mean, std=max(variance, 0.0) ** 0.5, min=minimum,
+                     max=maximum)
+        statistics.append(group)
+    return statistics
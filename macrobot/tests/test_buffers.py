@@ -0,0 +1,42 @@
+import os
+import numpy as np
+from macrobot import lanes
+from macrobot.bgt import BgtSegmenter
+from macrobot.buffers import BufferPool
+
+test_path = os.path.dirname(os.path.abspath(__file__))
+setting_file = os.path.join(os.path.dirname(test_path), 'settings_ipk.ini')
+
+
+def load_lanes(name):
+    return [list(lane) for lane in np.load(os.path.join(test_path, name), allow_pickle=True)]
+
+
+def test_released_buffers_are_reused():
+    pool = BufferPool()
+    first = pool.take((10, 20), np.uint8)
+    pool.take((10, 20), np.uint16)
+    assert pool.stats() == {'hits': 0, 'misses': 2, 'in_use': 2, 'free': 0, 'allocated_bytes': 600}
+
+    pool.release_all()
+    assert pool.take((10, 20), np.uint8) is first
+    assert pool.take((10, 20), np.uint8) is not first
+    assert pool.stats()['hits'] == 1 and pool.stats()['misses'] == 3
+
+
+def test_pooled_prediction_gives_same_results(tmp_path):
+    pool = BufferPool()
+    predictions = []
+    for buffer_pool in (None, pool, pool):
+        processor = BgtSegmenter(['P02-3_1_red.tif'], None, str(tmp_path), None, 'exp40', '6dai', None,
+                                 setting_file, buffer_pool=buffer_pool)
+        processor.lanes = lanes.from_lists(load_lanes('lanes_roi_rgb.npy'), load_lanes('lanes_roi_backlight.npy'))
+        processor.destination_path = str(tmp_path)
+        processor.extract_and_predict()
+        predictions.append([np.copy(lane[1]) for lane in processor.predicted_lanes])
+        if buffer_pool is not None:
+            buffer_pool.release_all()
+
+    assert all(np.array_equal(a, b) for a, b in zip(predictions[0], predictions[1]))
+    assert all(np.array_equal(a, b) for a, b in zip(predictions[0], predictions[2]))
+    assert pool.stats()['hits'] == 4
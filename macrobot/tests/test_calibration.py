@@ -0,0 +1,117 @@
+import io
+import os
+import numpy as np
+import pytest
+from macrobot import calibration, lane_cache, rules
+from macrobot.helpers import get_saturation, rgb_features
+from macrobot.prediction import predict_green_image, predict_leaf, predict_max_rgb, predict_min_rgb, \
+    predict_saturation
+
+test_path = os.path.dirname(os.path.abspath(__file__))
+setting_file = os.path.join(os.path.dirname(test_path), 'settings_ipk.ini')
+
+
+def load_lanes(name):
+    return [list(lane) for lane in np.load(os.path.join(test_path, name), allow_pickle=True)]
+
+
+leaves = list(calibration.plate_leaves(setting_file, load_lanes('lanes_roi_rgb.npy'),
+                                       load_lanes('lanes_roi_backlight.npy'), load_lanes('lanes_roi_binary.npy')))
+
+
+def reference_prediction(predictor, rgb, backlight):
+    if predictor == 'min_rgb':
+        return predict_min_rgb(rgb_features(np.copy(rgb), 'minimum'), backlight, rgb)
+    if predictor == 'max_rgb':
+        return predict_max_rgb(rgb_features(np.copy(rgb), 'maximum'), backlight, rgb)
+    if predictor == 'green':
+        return predict_green_image(rgb[:, :, 1], backlight, rgb)
+    return predict_saturation(get_saturation(np.copy(rgb)), backlight)
+
+
+def plate_histograms(rule_set, grid):
+    cuts = calibration._cut_points(rule_set, grid)
+    return [calibration.leaf_histogram(rule_set, rgb, backlight, mask, cuts) for _, _, rgb, backlight, mask in leaves]
+
+
+@pytest.mark.parametrize('predictor', sorted(rules.RULES))
+def test_default_thresholds_match_prediction(predictor):
+    rule_set = rules.RULES[predictor]
+    grid = calibration.parse_grid(rule_set, [])
+
+    (thresholds, percent_infection), = calibration.sweep_histograms(rule_set, plate_histograms(rule_set, grid), grid)
+
+    assert thresholds == {name: threshold['default'] for name, threshold
+                          in calibration.rule_thresholds(rule_set).items()}
+    expected = [predict_leaf(reference_prediction(predictor, rgb, backlight), mask.astype(np.uint8) * 255)
+                for _, _, rgb, backlight, mask in leaves]
+    assert percent_infection == expected
+
+
+@pytest.mark.parametrize('predictor, specs', [
+    ('saturation', ['saturation=20:140:30', 'backlight=300,1000,3000']),
+    ('min_rgb', ['rg_diff=2:4:1', 'minrgb_r_2=30,40', 'minrgb_b=0,1']),
+    ('max_rgb', ['maxrgb_r_2=30:50:10', 'maxrgb_r_3=100,110', 'maxrgb_g=40,60']),
+])
+def test_grid_is_exact(predictor, specs):
+    rule_set = rules.RULES[predictor]
+    grid = calibration.parse_grid(rule_set, specs)
+    results = list(calibration.sweep_histograms(rule_set, plate_histograms(rule_set, grid), grid))
+    assert len(results) == np.prod([len(values) for values in grid.values()])
+    for thresholds, percent_infection in results:
+        swept = calibration.apply_thresholds(rule_set, thresholds)
+        expected = []
+        for _, _, rgb, backlight, mask in leaves:
+            background = swept.predict(rgb, backlight)[mask] == 0
+            expected.append(round(100 - (background.sum() * 100 / mask.sum())))
+        assert percent_infection == expected
+
+
+def test_rule_thresholds():
+    thresholds = calibration.rule_thresholds(rules.RULES['min_rgb'])
+    assert list(thresholds) == ['minrgb_b', 'minrgb_r_1', 'backlight', 'rg_diff', 'minrgb_r_2']
+    # Identical conditions of several rules are swept together
+    assert thresholds['rg_diff'] == {'channel': 'rg_diff', 'operator': '<', 'default': 3,
+                                     'conditions': [(2, 0), (3, 0)]}
+    assert str(calibration.apply_thresholds(rules.RULES['min_rgb'], {'rg_diff': 5, 'minrgb_r_2': 30})) == (
+        'minrgb_b == 0 and minrgb_r == 0 and backlight < 150 -> 255\n'
+        'minrgb_b == 0 and minrgb_r == 0 -> 0\n'
+        'rg_diff < 5 and minrgb_r < 30 -> 0\n'
+        'rg_diff < 5 -> 255\n'
+        'default -> 0')
+    assert calibration.parse_grid(rules.RULES['green'], ['green=20:36:4']) == {'green': [20, 24, 28, 32, 36]}
+
+
+def test_rules_of_settings_file(tmp_path):
+    (tmp_path / 'settings.ini').write_text('[RULES saturation]\nrule1 = saturation > 90 and backlight < 1000 -> 255\n')
+    rule_set = rules.load_rules(str(tmp_path / 'settings.ini'))['saturation']
+    grid = calibration.parse_grid(rule_set, [])
+    assert grid == {'saturation': [90], 'backlight': [1000]}
+
+    built_in = rules.RULES['saturation']
+    (_, percent_infection), = calibration.sweep_histograms(rule_set, plate_histograms(rule_set, grid), grid)
+    (_, expected), = calibration.sweep_histograms(built_in, plate_histograms(built_in, grid), grid)
+    default_grid = calibration.parse_grid(built_in, [])
+    (_, default), = calibration.sweep_histograms(built_in, plate_histograms(built_in, default_grid), default_grid)
+    assert percent_infection == expected != default
+
+
+def test_parse_grid_rejects_unknown_threshold():
+    with pytest.raises(ValueError):
+        calibration.parse_grid(rules.RULES['green'], ['saturation=1,2'])
+
+
+def test_sweep_skips_lanes_of_other_settings(tmp_path):
+    lanes = load_lanes('lanes_roi_rgb.npy'), load_lanes('lanes_roi_backlight.npy'), load_lanes('lanes_roi_binary.npy')
+    for plate_id, settings in (('P01', lane_cache.settings_digest(setting_file, 'BGT')), ('P02', 'other')):
+        metadata = {'plate_id': f'20190709_102939_exp40_{plate_id}', 'procedure': 'BGT', 'settings': settings}
+        lane_cache.save_lanes(lane_cache.cache_path(str(tmp_path), 'exp40', '6dai', plate_id), plate_id, metadata, *lanes)
+
+    file_sweep = io.StringIO()
+    rule_set = rules.RULES['min_rgb']
+    leaf_count, skipped = calibration.sweep_lane_cache(str(tmp_path), setting_file, rule_set,
+                                                       calibration.parse_grid(rule_set, []), file_sweep,
+                                                       procedure='BGT')
+    assert leaf_count == len(leaves)
+    assert skipped == [lane_cache.cache_path(str(tmp_path), 'exp40', '6dai', 'P02')]
+    assert {line.split(';')[3] for line in file_sweep.getvalue().splitlines()[1:]} == {'20190709_102939_exp40_P01'}
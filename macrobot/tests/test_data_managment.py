@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import sqlite3
+import pandas as pd
+from macrobot import data_managment
+
+TABLE = ('CREATE TABLE MACROBOT_DB (EXPERIMENT TEXT, DAI TEXT, PLATE_ID TEXT, LANE_ID2 INTEGER, INFECTION REAL, '
+         'GENOTYPE TEXT, SAW_DATE TEXT, INOC_DATE TEXT)')
+
+
+def write_merged_file(path, rows=5):
+    pd.DataFrame({
+        'experiment': ['MB0274'] * rows,
+        'dai': ['7dai'] * rows,
+        'plate_id': [f'P{i:02d}' for i in range(rows)],
+        'LANE_ID2': range(1, rows + 1),
+        'INFECTION': [float(i) for i in range(rows - 1)] + [None],
+        'genotype': ['Morex'] * (rows - 1) + [None],
+        'saw_date': ['2024-03-01'] * (rows - 1) + ['unknown'],
+        'inoc_date': [None] * rows,
+        'url1': ['\\\\hsm\\AGR-BIM\\macrobot\\MB0274\\7dai'] * rows,
+    }).to_csv(path, sep=';', index=False)
+
+
+def test_prepare_export():
+    csv_data = pd.DataFrame({'infection': [1.5, None], 'genotype': ['Morex', None], 'saw_date': ['2024-3-1', 'x'],
+                             'inoc_date': [None, None], 'user': ['a', 'b']})
+    prepared = data_managment.prepare_export(csv_data, ['INFECTION', 'GENOTYPE', 'SAW_DATE', 'INOC_DATE'])
+    assert prepared.to_dict('records') == [
+        {'INFECTION': 1.5, 'GENOTYPE': 'Morex', 'SAW_DATE': '2024-03-01', 'INOC_DATE': '1900-01-01'},
+        {'INFECTION': None, 'GENOTYPE': 'NA', 'SAW_DATE': None, 'INOC_DATE': '1900-01-01'},
+    ]
+
+
+def test_export_db_sqlite(tmp_path):
+    csv_file = str(tmp_path / 'MB0274_db.csv')
+    write_merged_file(csv_file, rows=5)
+    database = str(tmp_path / 'macrobot.sqlite')
+    with sqlite3.connect(database) as connection:
+        connection.execute(TABLE)
+
+    inserted = data_managment.export_db(csv_file, connect=lambda: sqlite3.connect(database), batch_size=2,
+                                        date_expression=':{column}')
+    assert inserted == 5
+
+    connection = sqlite3.connect(database)
+    rows = connection.execute('SELECT PLATE_ID, LANE_ID2, INFECTION, GENOTYPE, SAW_DATE, INOC_DATE FROM MACROBOT_DB '
+                              'ORDER BY PLATE_ID').fetchall()
+    connection.close()
+    assert rows[0] == ('P00', 1, 0.0, 'Morex', '2024-03-01', '1900-01-01')
+    assert rows[-1] == ('P04', 5, None, 'NA', None, '1900-01-01')
+
+
+def test_export_db_reports_failing_rows(tmp_path, capsys):
+    csv_file = str(tmp_path / 'MB0274_db.csv')
+    write_merged_file(csv_file, rows=4)
+    database = str(tmp_path / 'macrobot.sqlite')
+    with sqlite3.connect(database) as connection:
+        connection.execute(TABLE.replace('INFECTION REAL', 'INFECTION REAL NOT NULL'))
+
+    inserted = data_managment.export_db(csv_file, connect=lambda: sqlite3.connect(database), batch_size=3,
+                                        date_expression=':{column}')
+    assert inserted == 3
+    assert 'Error inserting row' in capsys.readouterr().out
+
+
+def write_leaf_results(path, dai, plates=2):
+    pd.DataFrame([{'index': f'gb2_exp40_P{plate:02d}_{lane}', 'expNr': 'gb2_exp40', 'dai': dai,
+                   'Plate_ID': f'20190709_102939_exp40_P{plate:02d}-3', 'Lane_ID': lane, 'Leaf_ID': leaf,
+                   '%_Inf': leaf * 10}
+                  for plate in range(plates) for lane in (1, 2) for leaf in (1, 2)]).to_csv(path, sep=';', index=False)
+
+
+def write_metadata(path):
+    pd.DataFrame([{'experiment': 'gb2_exp40', 'plate-id': f'exp40-P{plate:02d}-3', 'lane-id': lane,
+                   'genotype': f'G{plate}{lane}', 'dai': 'x', 'barcode': 'B'}
+                  for plate in range(2) for lane in (1, 2)]).to_csv(path, sep='\t', index=False)
+
+
+def test_merge_files(tmp_path, monkeypatch):
+    metadata = str(tmp_path / 'gb2_meta.csv')
+    write_metadata(metadata)
+    (tmp_path / '6dai').mkdir()
+    (tmp_path / '7dai').mkdir()
+    csv_files = [str(tmp_path / dai / 'gb2_exp40_leaf.csv') for dai in ('6dai', '7dai')]
+    for dai, csv_file in zip(('6dai', '7dai'), csv_files):
+        write_leaf_results(csv_file, dai)
+
+    read_csv = pd.read_csv
+    reads = []
+    monkeypatch.setattr(pd, 'read_csv', lambda path, **kwargs: reads.append(path) or
+                        read_csv(path, **kwargs))
+    output_files = [str(tmp_path / f'gb2_exp40_{dai}_db.csv') for dai in ('6dai', '7dai')]
+    assert data_managment.merge_files(metadata, csv_files, 'plate_index', output_files) == output_files
+    assert reads.count(metadata) == 1
+
+    merged = read_csv(output_files[1], delimiter=';')
+    assert len(merged) == 8
+    assert list(merged.columns) == ['experiment', 'plate_id', 'lane_id', 'genotype', 'plate_index', 'index_', 'dai',
+                                    'PLATE_ID2', 'LANE_ID2', 'Leaf_ID', 'INFECTION', 'type', 'url1', 'url2']
+    row = merged.iloc[-1]
+    assert (row['experiment'], row['plate_index'], row['PLATE_ID2'], row['genotype']) == \
+        ('gb2_exp40', 'gb2_exp40_exp40_P01_3_2', '20190709_102939_exp40-P01-3', 'G12')
+    assert row['url1'] == '\\\\hsm\\AGR-BIM\\macrobot\\gb2_exp40\\7dai'
+    assert row['url2'] == '\\\\hsm\\AGR-BIM\\Results\\BluVisionMacro\\gb2_exp40\\7dai'
+
+
+def test_copy_and_verify_resumes(tmp_path):
+    source, destination = tmp_path / 'psg-09', tmp_path / 'hsm'
+    (source / 'MB0274' / '7dai').mkdir(parents=True)
+    for name in ('a.tif', 'b.tif', 'c.tif'):
+        (source / 'MB0274' / '7dai' / name).write_bytes(os.urandom(1000))
+
+    stats = data_managment.copy_and_verify(str(source), str(destination), workers=2)
+    assert (stats['copied'], stats['skipped'], stats['bytes']) == (3, 0, 3000)
+    manifest = data_managment.read_manifest(str(destination))
+    record = manifest[os.path.join('MB0274', '7dai', 'a.tif')]
+    assert record['sha256'] == hashlib.sha256((source / 'MB0274' / '7dai' / 'a.tif').read_bytes()).hexdigest()
+
+    # An interrupted run leaves an incomplete last line in the manifest
+    with open(destination / data_managment.MANIFEST_NAME, 'a') as file:
+        file.write(json.dumps(record)[:20])
+    (source / 'MB0274' / '7dai' / 'b.tif').write_bytes(os.urandom(2000))
+    os.remove(destination / 'MB0274' / '7dai' / 'c.tif')
+
+    stats = data_managment.copy_and_verify(str(source), str(destination), workers=2)
+    assert (stats['copied'], stats['skipped'], stats['bytes']) == (2, 1, 3000)
+    for name in ('a.tif', 'b.tif', 'c.tif'):
+        assert (destination / 'MB0274' / '7dai' / name).read_bytes() == (source / 'MB0274' / '7dai' / name).read_bytes()
+    assert len((destination / data_managment.MANIFEST_NAME).read_text().splitlines()) == 3
+
+
+def test_ingest(tmp_path, capsys):
+    metadata = str(tmp_path / 'gb2_meta.csv')
+    write_metadata(metadata)
+    source = tmp_path / 'BluVisionMacro'
+    for dai in ('6dai', '7dai'):
+        (source / 'gb2_exp40' / dai).mkdir(parents=True)
+        write_leaf_results(str(source / 'gb2_exp40' / dai / 'gb2_exp40_leaf.csv'), dai)
+    (source / 'gb2_exp40' / 'log.txt').write_text('')
+    (source / 'gb2_exp41' / '6dai').mkdir(parents=True)
+    (source / 'gb2_exp41' / '6dai' / 'gb2_exp41_leaf.csv').write_text('index;expNr\n')
+    database = str(tmp_path / 'macrobot.sqlite')
+    with sqlite3.connect(database) as connection:
+        connection.execute('CREATE TABLE MACROBOT_DB (EXPERIMENT TEXT, DAI TEXT, PLATE_ID2 TEXT, LANE_ID2 INTEGER, '
+                           'LEAF_ID INTEGER, INFECTION REAL, GENOTYPE TEXT)')
+
+    def ingest():
+        return data_managment.ingest(str(source), metadata, str(tmp_path / 'hsm_db'), workers=2,
+                                     connect=lambda: sqlite3.connect(database), date_expression=':{column}')
+
+    stats = ingest()
+    assert (stats['ingested'], stats['skipped'], stats['failed'], stats['rows']) == (2, 0, 1, 16)
+    assert list(stats['errors']) == [os.path.join('gb2_exp41', '6dai', 'gb2_exp41_leaf.csv')]
+    assert "Error ingesting" in capsys.readouterr().out
+    assert (tmp_path / 'hsm_db' / 'gb2_exp40_7dai_db.csv').exists()
+
+    # Only new or changed files are ingested again
+    write_leaf_results(str(source / 'gb2_exp40' / '7dai' / 'gb2_exp40_leaf.csv'), '7dai', plates=1)
+    stats = ingest()
+    assert (stats['ingested'], stats['skipped'], stats['failed'], stats['rows']) == (1, 1, 1, 4)
+
+    # The rows of the changed file replace its earlier rows
+    connection = sqlite3.connect(database)
+    assert connection.execute("SELECT COUNT(*) FROM MACROBOT_DB WHERE DAI = '6dai'").fetchone() == (8,)
+    assert connection.execute("SELECT COUNT(*) FROM MACROBOT_DB WHERE DAI = '7dai'").fetchone() == (4,)
+    connection.close()
+
+
+def test_ingest_retries_files_with_failing_rows(tmp_path, capsys):
+    metadata = str(tmp_path / 'gb2_meta.csv')
+    write_metadata(metadata)
+    source = tmp_path / 'BluVisionMacro'
+    (source / 'gb2_exp40' / '7dai').mkdir(parents=True)
+    leaf_file = str(source / 'gb2_exp40' / '7dai' / 'gb2_exp40_leaf.csv')
+    write_leaf_results(leaf_file, '7dai', plates=1)
+    database = str(tmp_path / 'macrobot.sqlite')
+    with sqlite3.connect(database) as connection:
+        connection.execute('CREATE TABLE MACROBOT_DB (EXPERIMENT TEXT, DAI TEXT, LEAF_ID INTEGER, '
+                           'INFECTION REAL CHECK (INFECTION < 20))')
+        connection.execute("INSERT INTO MACROBOT_DB VALUES ('gb2_exp40', '7dai', 1, 0)")
+
+    def ingest():
+        return data_managment.ingest(str(source), metadata, str(tmp_path / 'hsm_db'), workers=1,
+                                     connect=lambda: sqlite3.connect(database), date_expression=':{column}')
+
+    for _ in range(2):
+        stats = ingest()
+        assert (stats['ingested'], stats['skipped'], stats['failed']) == (0, 0, 1)
+        assert list(stats['errors']) == [os.path.join('gb2_exp40', '7dai', 'gb2_exp40_leaf.csv')]
+    assert 'Error inserting row' in capsys.readouterr().out
+
+    # The earlier rows are kept until the file can be inserted
+    connection = sqlite3.connect(database)
+    assert connection.execute('SELECT COUNT(*) FROM MACROBOT_DB').fetchone() == (1,)
+    connection.close()
@@ -0,0 +1,38 @@
+import pytest
+from macrobot import events
+
+
+def test_event_log_is_buffered(tmp_path):
+    path = str(tmp_path / 'results' / events.EVENTS_NAME)
+    event_log = events.EventLog(path, run_id='run1', verbosity='quiet', buffer_size=3)
+    event_log.info('start', 'Analyzing plate', experiment='MB0274', dai='7dai', plate='P01')
+    event_log.warning('lanes', 'Warning, < 4 lanes! Found: 3', plate='P01', lanes=3)
+    assert not (tmp_path / 'results').exists()
+
+    event_log.info('done', 'Plate done', plate='P01', lanes=3, leaves=24)
+    assert [event['stage'] for event in events.read_events(path)] == ['start', 'lanes', 'done']
+
+    event_log.error('read', 'Unable to load image', plate='P02')
+    (first, second, third, fourth) = events.read_events(path, run_id='run1')
+    assert (first['experiment'], first['dai'], first['plate'], first['severity']) == ('MB0274', '7dai', 'P01', 'info')
+    assert second['counters'] == {'lanes': 3}
+    assert fourth['severity'] == 'error'
+    assert events.read_events(path, run_id='run2') == []
+
+
+def test_verbosity(tmp_path, capsys):
+    path = str(tmp_path / events.EVENTS_NAME)
+    with events.EventLog(path, verbosity='warning') as event_log:
+        assert not event_log.enabled('debug')
+        event_log.debug('init', 'Images: [...]')
+        event_log.info('start', 'Analyzing plate')
+        event_log.warning('qc', 'Skip plate')
+    assert capsys.readouterr().out == 'Skip plate\n'
+    assert [event['stage'] for event in events.read_events(path)] == ['start', 'qc']
+
+    with events.EventLog(path, verbosity='debug') as event_log:
+        event_log.debug('init', 'Images: [...]')
+    assert events.read_events(path, run_id=event_log.run_id)[0]['stage'] == 'init'
+
+    with pytest.raises(ValueError):
+        events.EventLog(path, verbosity='loud')
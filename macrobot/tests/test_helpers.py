@@ -1,6 +1,6 @@
 import numpy as np
 
-from macrobot.helpers import rgb_features, whitebalance
+from macrobot.helpers import merge_whitebalanced, rgb_features, whitebalance
 
 array = np.array([[[1,2,3], [1,2,3], [1,2,3]],
                   [[4,5,6], [4,5,6], [4,5,6]],
@@ -27,3 +27,13 @@ def test_whitebalance():
     wb = whitebalance(image_array)
     np.testing.assert_array_equal(wb, whitebalance_test_data)
 
+
+
+def test_merge_whitebalanced_matches_whitebalance():
+    rng = np.random.default_rng(0)
+    channels = tuple(rng.normal(100, 20, (60, 80)).clip(0, 255).astype(np.uint8) for _ in range(3))
+    expected = whitebalance(np.dstack(channels).astype(np.int64), perc=0.2)
+    out = np.empty((60, 80, 3), dtype=np.uint8)
+    assert merge_whitebalanced(channels, 0.2, out=out) is out
+    np.testing.assert_array_equal(out, expected)
+    np.testing.assert_array_equal(whitebalance(np.dstack(channels), perc=0.2), expected)
@@ -0,0 +1,51 @@
+import os
+import numpy as np
+from macrobot import lane_cache
+
+test_path = os.path.dirname(os.path.abspath(__file__))
+setting_file = os.path.join(os.path.dirname(test_path), 'settings_ipk.ini')
+
+
+def load_lanes(name):
+    return [list(lane) for lane in np.load(os.path.join(test_path, name), allow_pickle=True)]
+
+
+def test_save_and_load_lanes(tmp_path):
+    lanes_roi_rgb = load_lanes('lanes_roi_rgb.npy')
+    lanes_roi_backlight = load_lanes('lanes_roi_backlight.npy')
+    lanes_roi_binary = load_lanes('lanes_roi_binary.npy')
+    lanes_roi_rgb[0][0] = None
+
+    path = lane_cache.cache_path(str(tmp_path), 'gb2_exp40', '6dai', 'P02-3')
+    lane_cache.save_lanes(path, 'abc', {'plate_id': 'P02-3'}, lanes_roi_rgb, lanes_roi_backlight, lanes_roi_binary)
+    assert lane_cache.read_key(path) == 'abc'
+
+    metadata, rgb, backlight, binary = lane_cache.load_lanes(path)
+    assert metadata['plate_id'] == 'P02-3'
+    for expected, loaded in ((lanes_roi_rgb, rgb), (lanes_roi_backlight, backlight), (lanes_roi_binary, binary)):
+        assert [lane[0] for lane in loaded] == [None, 2, 3, 4]
+        for i in range(len(expected)):
+            assert loaded[i][1].dtype == expected[i][1].dtype
+            assert np.array_equal(loaded[i][1], expected[i][1])
+
+    assert list(lane_cache.iter_cached_plates(str(tmp_path))) == [('gb2_exp40', '6dai', path)]
+
+
+def test_cache_key_depends_on_images_and_settings(tmp_path):
+    image = tmp_path / 'P02-3_red.tif'
+    image.write_bytes(b'red')
+    key = lane_cache.cache_key([str(image)], setting_file, 'BGT')
+
+    assert key == lane_cache.cache_key([str(image)], setting_file, 'BGT')
+    assert key != lane_cache.cache_key([str(image)], setting_file, 'RUST_IPK')
+
+    changed_settings = tmp_path / 'settings.ini'
+    changed_settings.write_text(open(setting_file).read().replace('noise_thresh = 50', 'noise_thresh = 60'))
+    assert key != lane_cache.cache_key([str(image)], str(changed_settings), 'BGT')
+
+    image.write_bytes(b'other red')
+    assert key != lane_cache.cache_key([str(image)], setting_file, 'BGT')
+
+
+def test_missing_container(tmp_path):
+    assert lane_cache.read_key(str(tmp_path / 'missing.npz')) is None
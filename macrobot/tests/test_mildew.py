@@ -4,6 +4,7 @@ import numpy as np
 from macrobot.bgt import BgtSegmenter
 
 test_path = os.path.dirname(os.path.abspath(__file__))
+setting_file = os.path.join(os.path.dirname(test_path), 'settings_ipk.ini')
 
 
 def mildew_pipeline():
@@ -34,7 +35,9 @@ def mildew_pipeline():
                 for plate in plates:
                     img_dir = os.path.join(source_path, experiment, dai, plate)
                     images = [f for f in os.listdir(img_dir) if f.endswith('.tif')]
-                    processor = BgtSegmenter(images, img_dir, destination_path, store_leaf_path, experiment, dai, file_results)
+                    # The feature images of the lanes are only kept in debug mode
+                    processor = BgtSegmenter(images, img_dir, destination_path, store_leaf_path, experiment, dai,
+                                             file_results, setting_file, debug=True)
                     plate_id, numer_of_lanes, final_image_list, file_name = processor.start_pipeline()
 
         except NotADirectoryError:
@@ -115,6 +118,7 @@ def test_lanes_roi_binary():
 
 def test_lanes_roi_minrgb():
     data = np.load(os.path.join(test_path, "lanes_roi_minrgb.npy"), allow_pickle=True)
+    assert len(final_image_list[9]) == len(data) == numer_of_lanes
     for i in range(len(final_image_list[9])):
         assert np.array_equal(final_image_list[9][i][1], data[i][1])
         assert np.array_equal(final_image_list[9][i][0], data[i][0])
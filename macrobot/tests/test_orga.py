@@ -0,0 +1,54 @@
+import os
+import cv2
+import numpy as np
+import pytest
+from macrobot import orga
+from macrobot import results
+
+
+def write_plate(dai_path, plate_id, positions):
+    report_path = os.path.join(dai_path, plate_id, 'report')
+    os.makedirs(report_path)
+    cv2.imwrite(os.path.join(report_path, 'rgb_image.png'), np.full((600, 800, 3), 128, np.uint8))
+    for position in positions:
+        for kind in ('leaf', 'disease'):
+            cv2.imwrite(os.path.join(dai_path, plate_id, f'{plate_id}_{position}_{kind}_predict.png'),
+                        np.full((1200, 150, 3), 255, np.uint8))
+    orga.create_report(plate_id, report_path, positions)
+
+
+def test_plate_report_any_lane_count(tmp_path):
+    orga.create_report('P01', str(tmp_path), [1, 2, 3, 4, 5, None])
+    html = (tmp_path / 'P01.html').read_text()
+    assert html.count('<h2>Lane') == 6
+    assert '../P01_5_disease_predict.png' in html and '../P01_None_leaf_predict.png' in html
+    assert orga.template_environment() is orga.template_environment()
+
+
+def test_experiment_report(tmp_path):
+    dai_path = str(tmp_path / 'MB0274' / '7dai')
+    write_plate(dai_path, 'P01', [1, 2, 3])
+    write_plate(dai_path, 'P02', [1, 2, 3, 4, 5])
+    records = results.LeafRecords()
+    for lane, infection in ((1, 10), (1, 20), (2, 60)):
+        records.append('MB0274_P01_1', 'MB0274', '7dai', 'P01', lane, 1, infection)
+    with results.open_sink('csv', os.path.join(dai_path, 'MB0274_leaf')) as sink:
+        sink.add_records(records)
+
+    report = orga.create_experiment_report(str(tmp_path), 'MB0274', '7dai', sink.name, workers=2)
+    html = open(report).read()
+    assert 'Lane 5' in html and 'Lane 1: 15.0 %' in html and '2 plates, 3 leaves' in html
+    assert html.count('no results') == 1
+
+    thumbnail = os.path.join(dai_path, 'thumbnails', 'P02_5_leaf_predict.jpg')
+    assert cv2.imread(thumbnail).shape == (orga.THUMBNAIL_SIZE, orga.THUMBNAIL_SIZE // 8, 3)
+    assert len(os.listdir(os.path.join(dai_path, 'thumbnails'))) == 2 + 2 * 8
+
+    # Thumbnails of unchanged images are not written again
+    modified = os.path.getmtime(thumbnail)
+    os.utime(thumbnail, (modified + 10, modified + 10))
+    orga.create_experiment_report(str(tmp_path), 'MB0274', '7dai', sink.name)
+    assert os.path.getmtime(thumbnail) == modified + 10
+
+    with pytest.raises(ValueError):
+        orga.create_experiment_report(str(tmp_path), 'MB0274', '7dai', thumbnail_format='gif')
@@ -0,0 +1,48 @@
+import os
+import cv2
+import numpy as np
+from macrobot import lanes, overlays
+
+
+def plate_with_leaves(tmp_path):
+    rng = np.random.default_rng(3)
+    plate = rng.integers(0, 255, (120, 200, 3), dtype=np.uint8)
+    plate_path = tmp_path / 'MB0274' / '7dai' / 'P01'
+    (plate_path / 'report').mkdir(parents=True)
+    cv2.imwrite(str(plate_path / 'report' / 'rgb_image.png'), plate)
+
+    plate_lanes = []
+    for position, x in ((1, 0), (2, 100)):
+        lane = lanes.Lane(position, plate[10:110, x:x + 100], None, bbox=(x, 10, 100, 100))
+        lane.leaves = [lanes.Leaf(leaf_id, np.array([[[5, top]], [[90, top + 5]], [[80, top + 20]], [[10, top + 15]]],
+                                                    dtype=np.int32), (5, top, 86, 21), lane)
+                       for leaf_id, top in ((1, 5), (2, 40), (3, 75))]
+        plate_lanes.append(lane)
+    return plate, str(plate_path), plate_lanes
+
+
+def test_render_plate(tmp_path):
+    plate, plate_path, plate_lanes = plate_with_leaves(tmp_path)
+    expected = plate.copy()
+    polygons = overlays.plate_polygons('P01', plate_lanes, 2)
+    overlays.write_polygons(overlays.polygons_path(plate_path, 'P01'), polygons)
+    assert overlays.read_polygons(overlays.polygons_path(plate_path, 'P01')) == polygons
+    assert [leaf['scored'] for leaf in polygons['lanes'][0]['leaves']] == [True, True, False]
+
+    assert overlays.find_plates(str(tmp_path)) == [(plate_path, 'P01')]
+    assert overlays.find_plates(str(tmp_path), dai='3dai') == []
+    assert overlays.render_plates(overlays.find_plates(str(tmp_path))) == 3
+    # The plate image of the report is not modified
+    assert np.array_equal(cv2.imread(os.path.join(plate_path, 'report', 'rgb_image.png')), expected)
+
+    for lane in plate_lanes:
+        x, y, w, h = lane.bbox
+        for leaf in lane.leaves[:2]:
+            cv2.drawContours(expected[y:y + h, x:x + w], [leaf.hull], -1, overlays.HULL_COLOR, overlays.HULL_THICKNESS)
+        rendered = cv2.imread(os.path.join(plate_path, f'P01_{lane.position}_leaf_predict.png'))
+        assert np.array_equal(rendered, expected[y:y + h, x:x + w])
+    assert np.array_equal(cv2.imread(os.path.join(plate_path, 'report', 'rgb_leaves.png')), expected)
+
+    # Up to date images are not rendered again
+    assert overlays.render_plate(plate_path, 'P01') == []
+    assert len(overlays.render_plate(plate_path, 'P01', force=True)) == 3
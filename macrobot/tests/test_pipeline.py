@@ -0,0 +1,91 @@
+import io
+import os
+import numpy as np
+import pytest
+from macrobot import lanes
+from macrobot.bgt import BgtSegmenter
+from macrobot.puccinia_ipk import RustSegmenterIPK
+from macrobot.helpers import get_saturation, rgb_features
+from macrobot.prediction import predict_min_rgb, predict_saturation
+
+test_path = os.path.dirname(os.path.abspath(__file__))
+setting_file = os.path.join(os.path.dirname(test_path), 'settings_ipk.ini')
+
+
+def load_lanes(name):
+    return [list(lane) for lane in np.load(os.path.join(test_path, name), allow_pickle=True)]
+
+
+def reference_min_rgb(rgb, backlight):
+    return predict_min_rgb(rgb_features(np.copy(rgb), 'minimum'), backlight, rgb)
+
+
+def reference_saturation(rgb, backlight):
+    return predict_saturation(get_saturation(np.copy(rgb)), backlight)
+
+
+@pytest.mark.parametrize('segmenter_class, reference', [(BgtSegmenter, reference_min_rgb),
+                                                        (RustSegmenterIPK, reference_saturation)])
+@pytest.mark.parametrize('debug', [False, True])
+def test_prediction_without_feature_images(tmp_path, segmenter_class, reference, debug):
+    processor = segmenter_class(['P02-3_1_red.tif'], None, str(tmp_path), None, 'exp40', '6dai', None,
+                                setting_file, debug=debug)
+    processor.lanes = lanes.from_lists(load_lanes('lanes_roi_rgb.npy'), load_lanes('lanes_roi_backlight.npy'))
+    processor.destination_path = str(tmp_path)
+    rgb_before = [np.copy(lane[1]) for lane in processor.lanes_roi_rgb]
+
+    processor.extract_and_predict()
+
+    for (position, predicted), (_, rgb), (_, backlight) in zip(processor.predicted_lanes, processor.lanes_roi_rgb,
+                                                               processor.lanes_roi_backlight):
+        assert np.array_equal(predicted, reference(rgb, backlight))
+        assert os.path.exists(os.path.join(str(tmp_path), f'P02-3_{position}_disease_predict.png'))
+        assert os.path.exists(os.path.join(str(tmp_path), f'P02-3_{position}_feature.png')) == debug
+    assert len(processor.lanes_feature) == (4 if debug else 0)
+    assert all(np.array_equal(before, lane[1]) for before, lane in zip(rgb_before, processor.lanes_roi_rgb))
+
+
+@pytest.mark.parametrize('segmenter_class', [BgtSegmenter, RustSegmenterIPK])
+def test_roi_prediction_gives_same_results(tmp_path, segmenter_class):
+    results = []
+    for roi_prediction in (False, True):
+        destination_path = tmp_path / str(roi_prediction)
+        destination_path.mkdir()
+        file_results = io.StringIO()
+        processor = segmenter_class(['P02-3_1_red.tif'], None, str(destination_path), None, 'exp40', '6dai',
+                                    file_results, setting_file, roi_prediction=roi_prediction)
+        processor.lanes = lanes.from_lists(load_lanes('lanes_roi_rgb.npy'), load_lanes('lanes_roi_backlight.npy'),
+                                           load_lanes('lanes_roi_binary.npy'))
+        processor.destination_path = str(destination_path)
+
+        processor.extract_and_predict()
+        processor.get_leaves_binary()
+        results.append(file_results.getvalue())
+
+        predict_images = [name for name in os.listdir(str(destination_path)) if name.endswith('_disease_predict.png')]
+        assert len(predict_images) == (0 if roi_prediction else 4)
+
+    assert results[0].count('\n') > 0
+    assert results[0] == results[1]
+
+
+def test_lane_records_share_plate_memory(tmp_path):
+    image_rgb = np.load(os.path.join(test_path, 'lanes_roi_rgb.npy'), allow_pickle=True)[0][1]
+    image_backlight = np.load(os.path.join(test_path, 'lanes_roi_backlight.npy'), allow_pickle=True)[0][1]
+    lane = lanes.Lane(1, image_rgb[10:400], image_backlight[10:400], bbox=(0, 10, image_rgb.shape[1], 390))
+    assert np.shares_memory(lane.rgb, image_rgb)
+    assert lane.nbytes == 0
+
+    processor = BgtSegmenter(['P02-3_1_red.tif'], None, str(tmp_path), None, 'exp40', '6dai', io.StringIO(),
+                             setting_file, roi_prediction=True)
+    processor.lanes = [lane]
+    processor.get_lanes_binary()
+    processor.extract_and_predict()
+
+    leaf = lane.leaves[0]
+    assert leaf.lane is lane and leaf.leaf_id == 1
+    assert np.shares_memory(leaf.rgb, image_rgb)
+    assert np.shares_memory(leaf.prediction, lane.prediction)
+    assert processor.nbytes == lane.binary.nbytes + lane.eroded.nbytes + lane.prediction.nbytes
+    with pytest.raises(AttributeError):
+        lane.extra = None
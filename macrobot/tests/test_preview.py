@@ -0,0 +1,45 @@
+import os
+import pytest
+from macrobot import preview
+from macrobot.bgt import BgtSegmenter
+
+test_path = os.path.dirname(os.path.abspath(__file__))
+setting_file = os.path.join(os.path.dirname(test_path), 'settings_ipk.ini')
+
+
+def test_preview_settings(tmp_path):
+    path = preview.write_preview_settings(setting_file, 0.125, str(tmp_path))
+    processor = BgtSegmenter(['P02-3_1_red.tif'], None, str(tmp_path), None, 'exp40', '6dai', None, path)
+    assert processor.resize_scale == 0.125
+    assert processor.pixel_scale == 0.25
+    assert processor.y_position == 200
+    assert processor.scaled_kernel(8, processor.pixel_scale).shape == (2, 2)
+
+
+def test_sample_plates():
+    plates = [f'P{index:02d}' for index in range(10)]
+    assert preview.sample_plates(plates, 3) == ['P00', 'P03', 'P06']
+    assert preview.sample_plates(plates, 0) == []
+    assert preview.sample_plates(plates[:2], 5) == ['P00', 'P01']
+
+
+def test_agreement_report(tmp_path):
+    preview_results = tmp_path / 'preview.csv'
+    full_results = tmp_path / 'full.csv'
+    header = 'index;expNr;dai;Plate_ID;Lane_ID;Leaf_ID;%_Inf\n'
+    preview_results.write_text(header + 'i;exp;6dai;P1;1;1;10\ni;exp;6dai;P1;1;2;30\ni;exp;6dai;P1;2;1;5\n'
+                                        'i;exp;6dai;P2;1;1;50\n')
+    full_results.write_text(header + 'i;exp;6dai;P1;1;1;12\ni;exp;6dai;P1;1;2;29\ni;exp;6dai;P1;1;3;40\n')
+
+    report = tmp_path / 'agreement.csv'
+    summary = preview.write_agreement_report(str(report), preview.read_leaf_results(str(preview_results)),
+                                             preview.read_leaf_results(str(full_results)))
+
+    assert summary['leaves'] == 2
+    assert summary['only_preview'] == 1 and summary['only_full'] == 1
+    assert summary['mean_difference'] == pytest.approx(1.5)
+    assert summary['max_difference'] == 2
+    assert summary['correlation'] == pytest.approx(1.0)
+    assert report.read_text().splitlines() == [preview.AGREEMENT_HEADER.strip(), 'P1;1;1;10;12;-2', 'P1;1;2;30;29;1',
+                                               'P1;1;3;;40;', 'P1;2;1;5;;']
+    assert 'on 2 leaves' in preview.format_agreement(summary)
@@ -0,0 +1,70 @@
+import io
+import os
+from configparser import ConfigParser
+import numpy as np
+from macrobot import qc, resolution
+from macrobot.bgt import BgtSegmenter
+
+test_path = os.path.dirname(os.path.abspath(__file__))
+setting_file = os.path.join(os.path.dirname(test_path), 'settings_ipk.ini')
+
+
+def plate_processor(tmp_path, qc_report=None):
+    file_results = open(str(tmp_path / 'exp40_leaf.csv'), 'w')
+    processor = BgtSegmenter(['P02-3_1_red.tif'], None, str(tmp_path), None, 'exp40', '6dai', file_results,
+                             setting_file, qc_report=qc_report)
+    processor.image_uvs = np.load(os.path.join(test_path, 'image_uvs.npy'))
+    processor.image_backlight = np.load(os.path.join(test_path, 'image_backlight.npy'))
+    return processor
+
+
+def test_scale_settings():
+    config = resolution.scale_settings(setting_file, 0.25)
+    original = ConfigParser()
+    original.read(setting_file)
+    assert config.getint('SEGMENTATION', 'width_min') == round(original.getint('SEGMENTATION', 'width_min') / 4)
+    assert config.getint('SEGMENTATION', 'min_frame_area') == round(original.getint('SEGMENTATION', 'min_frame_area') / 16)
+    assert config.get('SEGMENTATION', 'lane_positions') == '68,100,169,198,275'
+    assert config.getint('SEGMENTATION', 'noise_thresh') == original.getint('SEGMENTATION', 'noise_thresh')
+    assert resolution.scaled_setting_file(setting_file, 0.25) == resolution.scaled_setting_file(setting_file, 0.25)
+
+
+def test_thresholds_default_without_qc_section(tmp_path):
+    settings = tmp_path / 'settings.ini'
+    settings.write_text('[QC]\nmin_lanes = 3\n')
+    thresholds = qc.load_thresholds(str(settings))
+    assert thresholds['min_lanes'] == 3
+    assert thresholds['scaling_factor'] == qc.DEFAULTS['scaling_factor']
+
+
+def test_plate_passes_quality_check(tmp_path):
+    processor = plate_processor(tmp_path)
+    processor.file_results.close()
+    statistics, reasons = processor.check_quality()
+    assert reasons == []
+    assert statistics['lanes'] == 4
+    assert [position for position, _ in statistics['leaves']] == [1, 2, 3, 4]
+    assert all(leaves > 0 for _, leaves in statistics['leaves'])
+
+
+def test_failed_plate_is_only_reported(tmp_path):
+    qc_report = io.StringIO()
+    processor = plate_processor(tmp_path, qc_report)
+    # An overexposed backlight image without leaves
+    processor.image_backlight = np.full_like(processor.image_backlight, np.iinfo(np.uint16).max)
+    processor.read_images = lambda: None
+
+    plate_id, _, images, _ = processor.start_pipeline()
+    processor.file_results.close()
+
+    status = qc_report.getvalue().splitlines()[-1].split(';')
+    assert status[0] == plate_id and status[5] == 'fail'
+    assert 'backlight saturated' in status[6]
+    assert images == [] and (tmp_path / 'exp40_leaf.csv').read_text() == ''
+
+
+def test_evaluate_reasons():
+    thresholds = dict(qc.DEFAULTS)
+    statistics = {'lanes': 3, 'leaves': [(1, 8), (2, 0), (4, 7)], 'backlight_mean': 20.0, 'saturated_fraction': 0.0}
+    assert qc.evaluate(statistics, thresholds) == ['3 lanes found, 4 required', '0 leaves in lane 2',
+                                                   'backlight mean 20.0 out of range']
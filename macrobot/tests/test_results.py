@@ -0,0 +1,110 @@
+import io
+import os
+import sqlite3
+import threading
+import numpy as np
+import pytest
+from macrobot import results
+
+
+def plate_records(plate_id, lanes=(1, 2, None), leaves=3):
+    records = results.LeafRecords()
+    for lane in lanes:
+        for leaf in range(1, leaves + 1):
+            records.append(f'exp40_{plate_id}_{lane}', 'exp40', '6dai', plate_id, lane, leaf, (lane or 0) * 10 + leaf)
+    return records
+
+
+def test_csv_lines_match_previous_format():
+    records = plate_records('P02-3')
+    lines = records.csv_lines().splitlines(keepends=True)
+    assert lines[0] == 'exp40_P02-3_1;exp40;6dai;P02-3;1;1;11\n'
+    assert lines[-1] == 'exp40_P02-3_None;exp40;6dai;P02-3;None;3;3\n'
+
+    file_results = io.StringIO()
+    results.write_records(file_results, records)
+    assert file_results.getvalue() == records.csv_lines()
+
+
+def test_csv_sink(tmp_path):
+    with results.open_sink('csv', str(tmp_path / 'exp40_leaf')) as sink:
+        sink.batch_size = 4
+        sink.add_records(plate_records('P01'))
+        sink.add_records(plate_records('P02'))
+    assert sink.name == str(tmp_path / 'exp40_leaf.csv')
+    assert (tmp_path / 'exp40_leaf.csv').read_text() == (results.HEADER + plate_records('P01').csv_lines()
+                                                         + plate_records('P02').csv_lines())
+
+
+def test_columnar_sink(tmp_path):
+    path = str(tmp_path / 'exp40_leaf.columnar')
+    with results.ColumnarSink(path, batch_size=5) as sink:
+        for plate_id in ('P01', 'P02', 'P03'):
+            sink.add_records(plate_records(plate_id))
+
+    arrays = results.read_columnar(path)
+    assert len(arrays['index']) == 27
+    assert arrays['Plate_ID'][-1] == 'P03'
+    assert arrays['Lane_ID'].dtype == np.int16
+    assert arrays['Lane_ID'][:9].tolist() == [1, 1, 1, 2, 2, 2, -1, -1, -1]
+    assert arrays['%_Inf'][:3].tolist() == [11, 12, 13]
+
+
+def test_sqlite_sink(tmp_path):
+    path = str(tmp_path / 'exp40_leaf.sqlite')
+    with results.SqliteSink(path) as sink:
+        sink.add_records(plate_records('P01'))
+    rows = sqlite3.connect(path).execute('SELECT plate_id, lane_id, leaf_id, infection FROM leaf_results').fetchall()
+    assert rows[0] == ('P01', 1, 1, 11)
+    assert rows[-1] == ('P01', None, 3, 3)
+
+
+def test_parallel_plates_are_not_interleaved(tmp_path):
+    sink = results.CsvSink(str(tmp_path / 'leaf.csv'), batch_size=7)
+    threads = [threading.Thread(target=sink.add_records, args=(plate_records(f'P{index:02d}'),)) for index in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    sink.close()
+
+    plates = [line.split(';')[3] for line in (tmp_path / 'leaf.csv').read_text().splitlines()[1:]]
+    assert len(plates) == 20 * 9
+    assert all(len(set(plates[start:start + 9])) == 1 for start in range(0, len(plates), 9))
+
+
+def test_unknown_format(tmp_path):
+    with pytest.raises(ValueError):
+        results.open_sink('parquet', str(tmp_path / 'leaf'))
+
+
+@pytest.mark.parametrize('results_format', results.FORMATS)
+def test_read_results(tmp_path, results_format):
+    with results.open_sink(results_format, str(tmp_path / 'exp40_leaf')) as sink:
+        sink.add_records(plate_records('P01'))
+    arrays = results.read_results(sink.name)
+    expected = plate_records('P01').arrays()
+    for name, _ in results.COLUMNS:
+        np.testing.assert_array_equal(arrays[name], expected[name])
+
+
+def test_sinks_replace_earlier_runs(tmp_path):
+    for results_format in ('columnar', 'sqlite'):
+        for plate_ids in (('P01', 'P02'), ('P01',)):
+            with results.open_sink(results_format, str(tmp_path / 'exp40_leaf')) as sink:
+                for plate_id in plate_ids:
+                    sink.add_records(plate_records(plate_id))
+        arrays = results.read_results(sink.name)
+        assert arrays['Plate_ID'].tolist() == ['P01'] * 9
+
+
+def test_columnar_sink_append(tmp_path):
+    path = str(tmp_path / 'exp40_leaf.columnar')
+    with results.ColumnarSink(path) as sink:
+        sink.add_records(plate_records('P01'))
+    # A gap in the numbering does not overwrite the last part
+    os.replace(os.path.join(path, 'part-00000.npz'), os.path.join(path, 'part-00003.npz'))
+    with results.ColumnarSink(path, append=True) as sink:
+        sink.add_records(plate_records('P02'))
+    assert sorted(os.listdir(path)) == ['part-00003.npz', 'part-00004.npz']
+    assert results.read_columnar(path)['Plate_ID'].tolist() == ['P01'] * 9 + ['P02'] * 9
@@ -0,0 +1,111 @@
+import os
+import numpy as np
+import pytest
+from macrobot import cli, rules
+from macrobot.helpers import get_saturation, rgb_features
+
+test_path = os.path.dirname(os.path.abspath(__file__))
+
+rgb_lane = np.load(os.path.join(test_path, 'lanes_roi_rgb.npy'), allow_pickle=True)[0][1]
+backlight_lane = np.load(os.path.join(test_path, 'lanes_roi_backlight.npy'), allow_pickle=True)[0][1]
+
+
+def test_first_matching_rule_wins():
+    rule_set = rules.RuleSet(['green < 10 -> 0', 'green < 100 -> 255'], default=7)
+    green = np.array([[5, 50, 150]], dtype=np.uint8)
+    rgb = np.dstack((green, green, green))
+    assert rule_set.predict(rgb, None).tolist() == [[0, 255, 7]]
+
+
+def test_parse_and_format():
+    rule = rules.Rule.parse('saturation > 130 and backlight < 1000 -> 255')
+    assert rule.conditions == [('saturation', '>', 130), ('backlight', '<', 1000)]
+    assert rule.value == 255
+    assert str(rule) == 'saturation > 130 and backlight < 1000 -> 255'
+
+
+@pytest.mark.parametrize('text', ['green < 28', 'leaf < 28 -> 255', 'green << 28 -> 255'])
+def test_invalid_rules(text):
+    with pytest.raises(ValueError):
+        rules.Rule.parse(text)
+
+
+def test_derived_channels_match_features():
+    channels = rules.LaneChannels(rgb_lane, backlight_lane)
+    min_rgb = rgb_features(np.copy(rgb_lane), 'minimum')
+    max_rgb = rgb_features(np.copy(rgb_lane), 'maximum')
+    for index, suffix in enumerate('bgr'):
+        assert np.array_equal(channels[f'minrgb_{suffix}'], min_rgb[:, :, index])
+        assert np.array_equal(channels[f'maxrgb_{suffix}'], max_rgb[:, :, index])
+    assert np.array_equal(channels['saturation'], get_saturation(np.copy(rgb_lane)))
+
+
+@pytest.mark.parametrize('name', sorted(rules.RULES))
+def test_precomputed_features_give_same_prediction(name):
+    features = {
+        'min_rgb': {'minrgb': rgb_features(np.copy(rgb_lane), 'minimum')},
+        'max_rgb': {'maxrgb': rgb_features(np.copy(rgb_lane), 'maximum')},
+        'green': {'green': rgb_lane[:, :, 1]},
+        'saturation': {'saturation': get_saturation(np.copy(rgb_lane))},
+    }[name]
+    rule_set = rules.RULES[name]
+    assert np.array_equal(rule_set.predict(rgb_lane, backlight_lane),
+                          rule_set.predict(rgb_lane, backlight_lane, **features))
+
+
+def test_load_rules_from_settings(tmp_path):
+    setting_file = tmp_path / 'settings.ini'
+    setting_file.write_text('[RULES dark]\ndefault = 255\nrule1 = red < 20 and backlight >= 100 -> 0\n')
+    rule_sets = rules.load_rules(str(setting_file))
+
+    assert set(rules.RULES) < set(rule_sets)
+    red = np.array([[10, 10, 30]], dtype=np.uint8)
+    rgb = np.dstack((red, red, red))
+    backlight = np.array([[50, 150, 150]], dtype=np.uint16)
+    assert rule_sets['dark'].predict(rgb, backlight).tolist() == [[255, 0, 255]]
+
+
+@pytest.mark.parametrize('name', sorted(rules.RULES))
+def test_lookup_table_matches_kernel(name):
+    rule_set = rules.RULES[name]
+    assert rules.lookup_table(rule_set) is not None
+    rng = np.random.default_rng(0)
+    rgb = rng.integers(0, 256, (200, 300, 3), dtype=np.uint8)
+    backlight = rng.integers(0, 4000, (200, 300)).astype(np.uint16)
+    for lane_rgb, lane_backlight in ((rgb_lane, backlight_lane), (rgb, backlight)):
+        channels = rules.LaneChannels(lane_rgb, lane_backlight)
+        assert np.array_equal(rule_set.lookup(channels), rule_set(channels))
+
+
+def test_lookup_table_backlight_cells():
+    rule_set = rules.RuleSet(['red <= 20 and backlight > 100 -> 0', 'backlight == 50 -> 9'], default=255)
+    table = rules.lookup_table(rule_set)
+    assert table.channel == 'red'
+    assert table.boundaries.tolist() == [50, 51, 101]
+    assert not table.table.flags.writeable
+
+    red = np.array([[10, 10, 10, 30, 10]], dtype=np.uint8)
+    rgb = np.dstack((red, red, red))
+    backlight = np.array([[50, 100, 101, 101, 0]], dtype=np.uint16)
+    assert rule_set.lookup(rules.LaneChannels(rgb, backlight)).tolist() == [[9, 255, 0, 255, 255]]
+
+
+def test_rule_sets_without_table_use_kernel():
+    rule_set = rules.RuleSet(['rg_diff < 3 and red < 40 -> 0', 'rg_diff < 3 -> 255'], default=7)
+    assert rules.lookup_table(rule_set) is None
+    rgb = np.array([[[0, 10, 12], [0, 50, 50], [0, 0, 90]]], dtype=np.uint8)
+    assert rule_set.lookup(rules.LaneChannels(rgb, None)).tolist() == [[0, 255, 7]]
+
+
+def test_tables_are_built_when_a_run_starts(tmp_path, monkeypatch):
+    setting_file = os.path.join(os.path.dirname(test_path), 'settings_ipk.ini')
+    monkeypatch.setattr(rules, '_TABLES', {})
+    monkeypatch.setattr(cli, 'hardware_settings', lambda hardware, source_path: (setting_file, None))
+    (tmp_path / 'cache').mkdir()
+    cli.main(['reanalyse', '-c', str(tmp_path / 'cache'), '-d', str(tmp_path / 'out'), '-p', 'netblotch',
+              '-hw', 'ipk', '--no-results-db'])
+    assert list(rules._TABLES) == [str(rules.RULES['green'])]
+
+    with pytest.raises(SystemExit):
+        cli.main(['reanalyse', '-c', str(tmp_path / 'cache'), '-d', str(tmp_path / 'out'), '-p', 'netblotch',
+                  '-hw', 'ipk', '--no-results-db', '--rules', 'unknown'])
@@ -0,0 +1,50 @@
+import os
+import numpy as np
+import pytest
+from macrobot import segmentation, thresholding
+
+test_path = os.path.dirname(os.path.abspath(__file__))
+setting_file = os.path.join(os.path.dirname(test_path), 'settings.ini')
+
+
+def load_lanes(name):
+    return [list(lane) for lane in np.load(os.path.join(test_path, name), allow_pickle=True)]
+
+
+def reference_binary_lane(lane_image_backlight, threshold, noise_thresh, offset=1):
+    # Row by row version of the noise row suppression
+    thresholded_lane = (lane_image_backlight < threshold).astype(np.uint16) * 65535
+    noise_row_nr = [idx - offset for idx, row in enumerate(thresholded_lane.mean(axis=1)) if row < noise_thresh]
+    image_binary_lane = np.empty(lane_image_backlight.shape, dtype=np.uint8)
+    for i in range(lane_image_backlight.shape[0]):
+        image_binary_lane[i, :] = 0 if i in noise_row_nr else thresholded_lane[i, :]
+    return image_binary_lane
+
+
+def test_binary_lanes_match_fixture():
+    lanes_roi_binary = segmentation.segment_lanes_binary(load_lanes('lanes_roi_backlight.npy'), setting_file)
+    expected = load_lanes('lanes_roi_binary.npy')
+    assert [lane[0] for lane in lanes_roi_binary] == [lane[0] for lane in expected]
+    for (_, image), (_, expected_image) in zip(lanes_roi_binary, expected):
+        assert image.dtype == np.uint8
+        assert np.array_equal(image, expected_image)
+
+
+@pytest.mark.parametrize('fix_offset', [False, True])
+def test_noise_rows(tmp_path, fix_offset):
+    rng = np.random.default_rng(1)
+    lane = rng.integers(2000, 4000, (60, 1500)).astype(np.uint16)
+    lane[5:10, :] = 100
+    lane[20, :3] = 100
+    lane[[0, 30, 59], :] = 4000
+    settings = tmp_path / 'settings.ini'
+    settings.write_text(f'[SEGMENTATION]\nnoise_thresh = 50\nfix_noise_row_offset = {fix_offset}\n')
+
+    (position, image), = segmentation.segment_lanes_binary([[3, lane]], str(settings))
+
+    threshold = thresholding.threshold_otsu(lane)
+    assert position == 3
+    assert np.array_equal(image, reference_binary_lane(lane, threshold, 50, offset=0 if fix_offset else 1))
+    # Row 20 has leaf pixels but too few to pass the noise threshold
+    assert image[20 if fix_offset else 19].max() == 0
+
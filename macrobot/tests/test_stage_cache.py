@@ -0,0 +1,99 @@
+import os
+import cv2
+import numpy as np
+from macrobot import results, stage_cache
+from macrobot.bgt import BgtSegmenter
+
+test_path = os.path.dirname(os.path.abspath(__file__))
+setting_file = os.path.join(os.path.dirname(test_path), 'settings_ipk.ini')
+
+
+def write_plate(tmp_path, noise_thresh=50):
+    # The fixture images are already resized, so they are read at full scale
+    source = tmp_path / 'source'
+    source.mkdir(exist_ok=True)
+    for name in ('red', 'green', 'blue', 'backlight', 'uvs'):
+        cv2.imwrite(str(source / f'20190709_102939_exp40_{name}.tif'), np.load(os.path.join(test_path, f'image_{name}.npy')))
+    with open(setting_file) as file:
+        settings = file.read().replace('scaling_factor = 0.5', 'scaling_factor = 1.0', 1)
+    settings = settings.replace('noise_thresh = 50', f'noise_thresh = {noise_thresh}')
+    (tmp_path / 'settings.ini').write_text(settings)
+    return str(source), sorted(os.listdir(source)), str(tmp_path / 'settings.ini')
+
+
+def run_plate(tmp_path, cache, destination, noise_thresh=50):
+    source, images, settings = write_plate(tmp_path, noise_thresh)
+    file_results = results.CsvSink(str(tmp_path / f'{destination}.csv'))
+    processor = BgtSegmenter(images, source, str(tmp_path / destination), None, 'exp40', '6dai', file_results,
+                             settings, stage_cache=cache)
+    processor.start_pipeline()
+    file_results.close()
+    return processor, (tmp_path / f'{destination}.csv').read_text()
+
+
+def test_restart_from_deepest_stage(tmp_path):
+    cache = stage_cache.StageCache(tmp_path / 'cache')
+    first, leaf_results = run_plate(tmp_path, cache, 'first')
+    assert first.restored_stages == ()
+    assert cache.stats() == {'hits': 0, 'stored': 5, 'evicted': 0}
+    assert leaf_results.count('\n') > 0
+
+    second, second_results = run_plate(tmp_path, cache, 'second')
+    assert second.restored_stages == stage_cache.STAGES
+    assert second_results == leaf_results
+    assert np.array_equal(second.image_rgb, first.image_rgb)
+    assert [lane.bbox for lane in second.lanes] == [lane.bbox for lane in first.lanes]
+    plate_path = second.destination_path
+    assert len([name for name in os.listdir(plate_path) if name.endswith('_disease_predict.png')]) == first.numer_of_lanes
+    assert os.path.exists(os.path.join(plate_path, 'report', 'rgb_image.png'))
+
+    # A changed noise threshold invalidates the binary lanes and the predictions
+    third, _ = run_plate(tmp_path, cache, 'third', noise_thresh=40)
+    assert third.restored_stages == ('channels', 'rgb', 'lanes')
+
+
+def test_stage_keys(tmp_path):
+    source, images, settings = write_plate(tmp_path)
+    paths = [os.path.join(source, image) for image in images]
+    keys = stage_cache.stage_keys(paths, settings, 'BGT')
+    assert list(keys) == list(stage_cache.STAGES)
+    assert stage_cache.stage_keys(paths, settings, 'BGT') == keys
+
+    changed = stage_cache.stage_keys(paths, settings, 'BGT', extra={'prediction': 'roi_prediction=True'})
+    assert [stage for stage in keys if keys[stage] != changed[stage]] == ['prediction']
+    assert stage_cache.stage_keys(paths, settings, 'RUST_IPK')['channels'] != keys['channels']
+
+
+def test_eviction_removes_deepest_stages_first(tmp_path):
+    cache = stage_cache.StageCache(tmp_path / 'cache', max_bytes=10 ** 6)
+    array = np.zeros(100000, dtype=np.uint8)
+    plates = [[f'{plate}{stage}' + '0' * 38 for stage in range(3)] for plate in 'ab']
+    for keys in plates:
+        for key in keys:
+            cache.save(key, {'plate': keys[0]}, {'array': array})
+        cache.use(keys)
+    assert all(key in cache for keys in plates for key in keys)
+    metadata, arrays = cache.load(plates[0][1])
+    assert metadata == {'plate': plates[0][0]} and np.array_equal(arrays['array'], array)
+
+    cache.max_bytes = 4 * os.path.getsize(cache.entry_path(plates[0][0]))
+    cache.evict()
+    assert cache.evicted == 2
+    # The last stages of the least recently used plate are removed
+    assert [key in cache for key in plates[0]] == [True, False, False]
+    assert all(key in cache for key in plates[1])
+    assert cache.load('c' * 40) is None
+
+
+def test_saving_a_key_again_replaces_its_size(tmp_path):
+    cache = stage_cache.StageCache(tmp_path / 'cache')
+    key = 'a' * 40
+    for _ in range(3):
+        cache.save(key, {}, {'array': np.zeros(100000, dtype=np.uint8)})
+        cache.save('b' * 40, {}, {'array': np.zeros(1000, dtype=np.uint8)})
+    assert cache._size == os.path.getsize(cache.entry_path(key)) + os.path.getsize(cache.entry_path('b' * 40))
+
+    # The cache holds both entries, so nothing is evicted
+    cache.max_bytes = cache._size
+    cache.save(key, {}, {'array': np.zeros(100000, dtype=np.uint8)})
+    assert cache.evicted == 0 and key in cache and 'b' * 40 in cache
@@ -0,0 +1,76 @@
+import sqlite3
+import pytest
+from macrobot import cli
+from macrobot import results
+from macrobot import store
+
+
+def plate_records(plate_id, infections, dai='7dai'):
+    records = results.LeafRecords()
+    for leaf, infection in enumerate(infections, start=1):
+        records.append(f'MB0274_{plate_id}_1', 'MB0274', dai, plate_id, 1, leaf, infection)
+    return records
+
+
+def test_store_replaces_plates_of_earlier_runs(tmp_path):
+    path = str(tmp_path / 'results.sqlite')
+    with store.ResultsStore(path) as results_store:
+        results_store.add_records(plate_records('P01', [10, 20]))
+        results_store.add_records(plate_records('P02', [30]))
+    with store.ResultsStore(path) as results_store:
+        results_store.add_records(plate_records('P01', [40, 50, 60]))
+
+    connection = sqlite3.connect(path)
+    rows = connection.execute('SELECT plate_id, leaf_id, infection FROM leaf_results ORDER BY plate_id, leaf_id').fetchall()
+    indexes = {name for name, in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    connection.close()
+    assert rows == [('P01', 1, 40), ('P01', 2, 50), ('P01', 3, 60), ('P02', 1, 30)]
+    assert {'leaf_results_leaf', 'leaf_results_dai', 'leaf_results_plate'} <= indexes
+
+
+def test_plate_without_leaves_replaces_earlier_run(tmp_path):
+    path = str(tmp_path / 'results.sqlite')
+    with store.ResultsStore(path) as results_store:
+        results_store.add_records(plate_records('P01', [10, 20]))
+        results_store.add_records(plate_records('P02', [30]))
+    # The re-analysed plate P01 has no leaves anymore, the records of a results file are passed on
+    sink = results.TeeSink(results.CsvSink(str(tmp_path / 'leaf.csv')), store.ResultsStore(path))
+    for plate_id, infections in (('P01', []), ('P02', [40])):
+        results.start_plate(sink, 'MB0274', '7dai', plate_id)
+        results.write_records(sink, plate_records(plate_id, infections))
+    sink.close()
+    sink.sinks[1].close()
+
+    assert [(row['plate_id'], row['leaves'], row['mean']) for row in store.query(path, group_by='plate')] == \
+        [('P02', 1, 40.0)]
+
+
+def test_query(tmp_path):
+    path = str(tmp_path / 'results.sqlite')
+    with store.ResultsStore(path) as results_store:
+        results_store.add_records(plate_records('P01', [10, 20]))
+        results_store.add_records(plate_records('P02', [30]))
+        results_store.add_records(plate_records('P01', [0, 0], dai='3dai'))
+
+    (row,) = store.query(path, experiment='MB0274', dai='7dai')
+    assert row['experiment'] == 'MB0274' and row['dai'] == '7dai'
+    assert (row['plates'], row['leaves'], row['mean'], row['min'], row['max']) == (2, 3, 20.0, 10, 30)
+    assert row['std'] == pytest.approx((200 / 3) ** 0.5)
+
+    assert [row['dai'] for row in store.query(path)] == ['3dai', '7dai']
+    assert [(row['plate_id'], row['leaves']) for row in store.query(path, dai='7dai', group_by='plate')] == \
+        [('P01', 2), ('P02', 1)]
+    assert store.query(path, experiment='MB0000') == []
+
+    with pytest.raises(FileNotFoundError):
+        store.query(str(tmp_path / 'missing.sqlite'))
+
+
+def test_query_command(tmp_path, capsys):
+    path = str(tmp_path / 'results.sqlite')
+    with store.ResultsStore(path) as results_store:
+        results_store.add_records(plate_records('P01', [10, 20]))
+
+    cli.main(['query', '--db', path, '--experiment', 'MB0274', '--dai', '7dai'])
+    assert capsys.readouterr().out.splitlines() == ['experiment;dai;plates;leaves;mean;std;min;max',
+                                                    'MB0274;7dai;1;2;15.00;5.00;10;20']
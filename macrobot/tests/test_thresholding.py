@@ -0,0 +1,43 @@
+import os
+import numpy as np
+import pytest
+from macrobot import thresholding
+
+test_path = os.path.dirname(os.path.abspath(__file__))
+
+image_green = np.load(os.path.join(test_path, 'image_green.npy'))
+image_backlight = np.load(os.path.join(test_path, 'image_backlight.npy'))
+
+
+def random_images():
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        yield rng.normal(2000, 600, (40, 50)).clip(0, 65535).astype(np.uint16)
+        yield rng.gamma(2, 20, (40, 50)).clip(0, 255).astype(np.uint8)
+
+
+def test_thresholds():
+    image = np.array([[10, 10, 11, 200, 201, 202]], dtype=np.uint16)
+    assert thresholding.threshold_otsu(image) == 11
+    image = np.array([[5, 5, 5, 5, 6, 6, 7, 9, 12]], dtype=np.uint8)
+    assert thresholding.threshold_triangle(image) == 8
+
+
+@pytest.mark.parametrize('threshold', [thresholding.threshold_otsu, thresholding.threshold_triangle])
+def test_single_value_image(threshold):
+    with pytest.raises(ValueError):
+        threshold(np.full((3, 3), 7, dtype=np.uint8))
+
+
+def test_same_thresholds_as_scikit_image():
+    filters = pytest.importorskip('skimage.filters')
+    for image in [image_green, image_backlight] + list(random_images()):
+        assert thresholding.threshold_otsu(image) == filters.threshold_otsu(image)
+        assert thresholding.threshold_triangle(image) == filters.threshold_triangle(image)
+
+
+def test_mask_below():
+    image = np.array([[0, 99, 100, 65535]], dtype=np.uint16)
+    mask = thresholding.mask_below(image, 100)
+    assert mask.dtype == np.uint8
+    assert mask.tolist() == [[255, 255, 0, 0]]
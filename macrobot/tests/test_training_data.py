@@ -0,0 +1,56 @@
+import os
+import numpy as np
+import pytest
+from macrobot import lanes, training_data
+
+
+def lane_with_leaves(position, rng):
+    lane = lanes.Lane(position, rng.integers(0, 255, (80, 120, 3), dtype=np.uint8), None)
+    lane.prediction = (rng.random((80, 120)) > 0.9).astype(np.uint8) * 255
+    lane.leaves = [lanes.Leaf(leaf_id, None, (0, 20 * (leaf_id - 1), 120, 20), lane) for leaf_id in (1, 2, 3)]
+    return lane
+
+
+def test_shards_round_trip(tmp_path):
+    rng = np.random.default_rng(5)
+    plate_lanes = [lane_with_leaves(position, rng) for position in (1, 2)]
+    path = tmp_path / 'Training_data_hsm' / 'MB0274' / '7dai'
+    with training_data.ShardWriter(path, prefix='MB0274_7dai', max_bytes=40000, queue_size=2) as writer:
+        for lane in plate_lanes:
+            for leaf in lane.leaves:
+                writer.add_leaf(f'MB0274_P01_{lane.position}', 'MB0274', '7dai', 'P01', leaf,
+                                10 * leaf.leaf_id if leaf.leaf_id <= 2 else None)
+    assert writer.samples == 6
+    assert len(writer.shards) > 1
+    assert training_data.list_shards(path) == writer.shards
+    assert not [name for name in os.listdir(path) if name.endswith('.partial')]
+
+    samples = list(training_data.read_samples(path))
+    assert [sample['key'] for sample in samples] == [f'MB0274_P01_{lane}_{leaf}' for lane in (1, 2) for leaf in (1, 2, 3)]
+    first, third = samples[0], samples[2]
+    assert first['metadata'] == {'index': 'MB0274_P01_1', 'expNr': 'MB0274', 'dai': '7dai', 'Plate_ID': 'P01',
+                                 'Lane_ID': 1, 'Leaf_ID': 1, '%_Inf': 10}
+    assert np.array_equal(first['rgb'], plate_lanes[0].leaves[0].rgb)
+    assert np.array_equal(first['binary'], plate_lanes[0].leaves[0].prediction)
+    assert third['binary'] is None and third['metadata']['%_Inf'] is None
+
+    encoded = next(training_data.read_samples(writer.shards[0], decode=False))
+    assert isinstance(encoded['rgb'], bytes) and encoded['metadata'].startswith(b'{')
+
+    # A second writer continues the numbering of the shards
+    shards = writer.shards
+    with training_data.ShardWriter(path, prefix='MB0274_7dai') as writer:
+        writer.add_leaf('MB0274_P02_1', 'MB0274', '7dai', 'P02', plate_lanes[0].leaves[0], 0)
+    assert training_data.list_shards(path, prefix='MB0274_7dai') == shards + writer.shards
+    assert writer.shards[0].endswith(f'MB0274_7dai-{len(shards):05d}.tar')
+
+
+def test_unwritable_share(tmp_path):
+    (tmp_path / 'share').write_text('')
+    rng = np.random.default_rng(5)
+    writer = training_data.ShardWriter(tmp_path / 'share' / 'MB0274')
+    for leaf in lane_with_leaves(1, rng).leaves:
+        writer.add_leaf('MB0274_P01_1', 'MB0274', '7dai', 'P01', leaf, 0)
+    with pytest.raises(OSError):
+        writer.close()
+    assert writer.samples == 0
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Histogram based thresholding of uint8 and uint16 images.
+
+The thresholds are computed on integer histograms with one bin per value between the minimum
+and maximum of the image and are identical to the thresholds of `skimage.filters.threshold_otsu`
+and `skimage.filters.threshold_triangle`, without importing scikit-image.
+"""
+
+import numpy as np
+
+
+def histogram(image: np.ndarray) -> tuple:
+    """
+    Histogram of an integer image with one bin per value between its minimum and maximum.
+
+    Parameters
+    ----------
+    image : np.ndarray
+        The uint8 or uint16 image.
+
+    Returns
+    -------
+    tuple
+        The counts per bin (int64) and the value of each bin.
+    """
+    image_min, image_max = int(image.min()), int(image.max())
+    hist = np.bincount(image.ravel(), minlength=image_max + 1)[image_min:]
+    return hist, np.arange(image_min, image_max + 1)
+
+
+def threshold_otsu(image: np.ndarray) -> int:
+    """
+    Otsu threshold of an integer image.
+
+    Parameters
+    ----------
+    image : np.ndarray
+        The uint8 or uint16 image.
+
+    Returns
+    -------
+    int
+        The threshold maximizing the between class variance, pixels above it are foreground.
+
+    Raises
+    ------
+    ValueError
+        If the image has only one value.
+
+    Example
+    -------
+    >>> mask = mask_below(image_backlight, threshold_otsu(image_backlight))
+    """
+    if image.min() == image.max():
+        raise ValueError(f'Otsu thresholding needs more than one value, the image only contains {image.min()}.')
+
+    hist, bin_centers = histogram(image)
+    hist = hist.astype(float)
+
+    # Class probabilities and means for all possible thresholds
+    weight1 = np.cumsum(hist)
+    weight2 = np.cumsum(hist[::-1])[::-1]
+    mean1 = np.cumsum(hist * bin_centers) / weight1
+    mean2 = (np.cumsum((hist * bin_centers)[::-1]) / weight2[::-1])[::-1]
+
+    # Between class variance, the last value of class 1 has no counterpart in class 2
+    variance12 = weight1[:-1] * weight2[1:] * (mean1[:-1] - mean2[1:]) ** 2
+    return int(bin_centers[:-1][np.argmax(variance12)])
+
+
+def threshold_triangle(image: np.ndarray) -> int:
+    """
+    Triangle threshold of an integer image.
+
+    The threshold is the value with the largest distance to the line between the histogram
+    peak and the end of the longer tail of the histogram.
+
+    Parameters
+    ----------
+    image : np.ndarray
+        The uint8 or uint16 image.
+
+    Returns
+    -------
+    int
+        The threshold.
+
+    Raises
+    ------
+    ValueError
+        If the histogram peak is at the end of its longer tail, e.g. for an image with one value.
+
+    Example
+    -------
+    >>> mask = mask_below(image_green, threshold_triangle(image_green))
+    """
+    hist, bin_centers = histogram(image)
+    nbins = len(hist)
+
+    # Find peak, lowest and highest gray levels
+    arg_peak_height = np.argmax(hist)
+    peak_height = hist[arg_peak_height]
+    arg_low_level, arg_high_level = np.where(hist > 0)[0][[0, -1]]
+
+    # Work on the longer tail, flip the histogram if it is on the right
+    flip = arg_peak_height - arg_low_level < arg_high_level - arg_peak_height
+    if flip:
+        hist = hist[::-1]
+        arg_low_level = nbins - arg_high_level - 1
+        arg_peak_height = nbins - arg_peak_height - 1
+
+    width = arg_peak_height - arg_low_level
+    if width == 0:
+        raise ValueError('Triangle thresholding needs a histogram tail, the image only contains one value.')
+    x1 = np.arange(width)
+    y1 = hist[x1 + arg_low_level]
+
+    # Normalize and maximize the distance to the line
+    norm = np.sqrt(peak_height ** 2 + width ** 2)
+    length = (peak_height / norm) * x1 - (width / norm) * y1
+    arg_level = np.argmax(length) + arg_low_level
+
+    if flip:
+        arg_level = nbins - arg_level - 1
+    return int(bin_centers[arg_level])
+
+
+def mask_below(image: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Binary mask of the pixels below a threshold.
+
+    Parameters
+    ----------
+    image : np.ndarray
+        The image.
+    threshold : int
+        The threshold.
+
+    Returns
+    -------
+    np.ndarray
+        The uint8 mask (255 = below the threshold, 0 = otherwise).
+    """
+    # The boolean mask is turned into the uint8 mask in place
+    mask = (image < threshold).view(np.uint8)
+    mask *= 255
+    return mask
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Training data of the leaf scoring, packed into tar shards.
+
+Every detected leaf is one sample of three members with the same key
+(``<experiment>_<plate_id>_<lane>_<leaf>``):
+
+* ``<key>.rgb.png``: the RGB crop of the leaf.
+* ``<key>.binary.png``: the prediction mask of the leaf (255 = pathogen), only for scored leaves.
+* ``<key>.json``: the sidecar with the columns of the results per leaf (``index``, ``expNr``,
+  ``dai``, ``Plate_ID``, ``Lane_ID``, ``Leaf_ID`` and ``%_Inf``, which is None for leaves
+  which are not scored).
+
+The samples are appended to ``<prefix>-00000.tar``, ``<prefix>-00001.tar``, ... in the training
+data directory. A shard is closed when it reaches ``max_bytes``. Shards are written as
+``.tar.partial`` files and renamed when they are complete, so readers only see complete shards.
+
+The `ShardWriter` writes the shards sequentially on a background thread, so the analysis does
+not wait for the network share. Instead of two small files per leaf, the share only sees a few
+large sequential writes. `read_samples` reads the shards back.
+"""
+
+import glob
+import io
+import json
+import os
+import queue
+import tarfile
+import threading
+import time
+
+import cv2
+import numpy as np
+
+# Upper bound of the size of a shard in bytes
+SHARD_SIZE = 256 * 2 ** 20
+# Suffixes of the members of a sample
+SUFFIXES = ('.rgb.png', '.binary.png', '.json')
+# Tar header and padding of the members
+_BLOCK_SIZE = tarfile.BLOCKSIZE
+
+
+def sample_key(experiment: str, plate_id: str, lane_position: int, leaf_id: int) -> str:
+    """Return the key of the sample of a leaf."""
+    return f'{experiment}_{plate_id}_{lane_position}_{leaf_id}'
+
+
+def _member_size(data: bytes) -> int:
+    return _BLOCK_SIZE + -(-len(data) // _BLOCK_SIZE) * _BLOCK_SIZE
+
+
+class ShardWriter(object):
+    """
+    Writes training samples to size-bounded tar shards on a background thread.
+
+    Samples are encoded by the caller and queued, the thread creates the directory and the
+    shards when the first sample arrives. If the directory cannot be written (e.g. the share
+    is not reachable), the following samples are dropped and `close` raises the error.
+
+    Attributes:
+        path (str): Directory of the shards.
+        prefix (str): File name prefix of the shards.
+        max_bytes (int): Upper bound of the size of a shard (a single larger sample gets its own shard).
+        shards (list): Paths of the completed shards.
+        samples (int): Number of written samples.
+        bytes (int): Size of the written samples in the shards.
+        error (Exception): Error of the background thread, None if all samples were written.
+    """
+
+    def __init__(self, path, prefix='leaves', max_bytes=SHARD_SIZE, queue_size=256):
+        self.path = str(path)
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.shards = []
+        self.samples = 0
+        self.bytes = 0
+        self.error = None
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._tar = None
+        self._file = None
+        self._shard_path = None
+        self._shard_bytes = 0
+        self._seconds = 0.0
+        self._thread = threading.Thread(target=self._run, name=f'ShardWriter-{prefix}', daemon=True)
+        self._thread.start()
+
+    def add(self, key: str, members: dict) -> None:
+        """
+        Queue a sample.
+
+        :param key: Key of the sample, see `sample_key`.
+        :param members: The encoded members of the sample by suffix, e.g. ``{'.json': b'{...}'}``.
+        """
+        if self.error is None:
+            # Blocks while the queue is full, so a slow share limits the memory of the queued samples
+            self._queue.put((key, members))
+
+    def add_leaf(self, index: str, experiment: str, dai: str, plate_id: str, leaf, percent_infection=None) -> None:
+        """
+        Queue the sample of a leaf.
+
+        :param index: Identifier of the lane in the results, see `results.LeafRecords.append`.
+        :param experiment: Name of the experiment.
+        :param dai: Days after inoculation.
+        :param plate_id: Identifier of the plate.
+        :param leaf: The `lanes.Leaf` with RGB and prediction images.
+        :param percent_infection: Infection of the leaf in percent, None for leaves which are not scored.
+        """
+        members = {'.rgb.png': cv2.imencode('.png', leaf.rgb)[1].tobytes()}
+        if percent_infection is not None:
+            members['.binary.png'] = cv2.imencode('.png', leaf.prediction)[1].tobytes()
+            percent_infection = int(percent_infection)
+        members['.json'] = json.dumps({
+            'index': index, 'expNr': experiment, 'dai': dai, 'Plate_ID': plate_id,
+            'Lane_ID': int(leaf.lane.position), 'Leaf_ID': int(leaf.leaf_id), '%_Inf': percent_infection,
+        }).encode()
+        self.add(sample_key(experiment, plate_id, leaf.lane.position, leaf.leaf_id), members)
+
+    def close(self) -> dict:
+        """
+        Write the queued samples and complete the last shard.
+
+        :return: Statistics with the number of shards, samples and bytes and the rate of the writes in MB/s.
+        :raises OSError: If the shards could not be written.
+        """
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        if self.error is not None:
+            raise self.error
+        return {'shards': len(self.shards), 'samples': self.samples, 'bytes': self.bytes,
+                'mb_per_second': self.bytes / 2 ** 20 / self._seconds if self._seconds else 0.0}
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                continue
+            started = time.perf_counter()
+            try:
+                self._write(*item)
+            except (OSError, tarfile.TarError) as error:
+                self.error = error
+            self._seconds += time.perf_counter() - started
+        try:
+            self._complete_shard()
+        except OSError as error:
+            self.error = self.error or error
+
+    def _write(self, key, members):
+        size = sum(_member_size(data) for data in members.values())
+        if self._tar is not None and self._shard_bytes + size > self.max_bytes:
+            self._complete_shard()
+        if self._tar is None:
+            self._open_shard()
+        for suffix, data in members.items():
+            info = tarfile.TarInfo(key + suffix)
+            info.size = len(data)
+            info.mtime = time.time()
+            self._tar.addfile(info, io.BytesIO(data))
+        self._shard_bytes += size
+        self.samples += 1
+        self.bytes += size
+
+    def _open_shard(self):
+        os.makedirs(self.path, exist_ok=True)
+        # Continue the numbering of the shards of earlier writers with the same prefix
+        index = len(glob.glob(os.path.join(glob.escape(self.path), f'{glob.escape(self.prefix)}-*.tar')))
+        self._shard_path = os.path.join(self.path, f'{self.prefix}-{index:05d}.tar')
+        self._file = open(self._shard_path + '.partial', 'wb', buffering=2 ** 20)
+        self._tar = tarfile.open(fileobj=self._file, mode='w')
+        self._shard_bytes = 0
+
+    def _complete_shard(self):
+        if self._tar is None:
+            return
+        self._tar.close()
+        self._file.close()
+        self._tar = self._file = None
+        os.replace(self._shard_path + '.partial', self._shard_path)
+        self.shards.append(self._shard_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def list_shards(path: str, prefix: str = None) -> list:
+    """
+    List the complete shards of a training data directory.
+
+    :param path: Directory of the shards.
+    :param prefix: Only shards with this prefix (optional).
+    :return: Sorted paths of the shards.
+    """
+    pattern = f'{glob.escape(prefix)}-*.tar' if prefix is not None else '*.tar'
+    return sorted(glob.glob(os.path.join(glob.escape(str(path)), pattern)))
+
+
+def _split_name(name):
+    for suffix in SUFFIXES:
+        if name.endswith(suffix):
+            return name[:-len(suffix)], suffix
+    return None, None
+
+
+def read_samples(shards, decode: bool = True):
+    """
+    Read the samples of tar shards, streaming each shard sequentially.
+
+    :param shards: Path of a shard, of a directory with shards or a list of shard paths.
+    :param decode: Decode the images to arrays and the sidecar to a dictionary, else return the encoded bytes.
+    :return: Generator of samples, dictionaries with the ``key``, the sidecar as ``metadata``,
+             the RGB crop as ``rgb`` and the prediction mask as ``binary`` (None for leaves which are not scored).
+    """
+    if isinstance(shards, (str, os.PathLike)):
+        shards = list_shards(shards) if os.path.isdir(shards) else [shards]
+
+    def sample(key, members):
+        rgb, binary, metadata = members.get('.rgb.png'), members.get('.binary.png'), members.get('.json')
+        if decode:
+            rgb = None if rgb is None else cv2.imdecode(np.frombuffer(rgb, np.uint8), cv2.IMREAD_COLOR)
+            binary = None if binary is None else cv2.imdecode(np.frombuffer(binary, np.uint8), cv2.IMREAD_GRAYSCALE)
+            metadata = None if metadata is None else json.loads(metadata)
+        return {'key': key, 'metadata': metadata, 'rgb': rgb, 'binary': binary}
+
+    for shard in shards:
+        with tarfile.open(shard, mode='r|') as tar:
+            # The members of a sample are consecutive
+            key, members = None, {}
+            for info in tar:
+                member_key, suffix = _split_name(info.name)
+                if not info.isfile() or member_key is None:
+                    continue
+                if member_key != key:
+                    if members:
+                        yield sample(key, members)
+                    key, members = member_key, {}
+                members[suffix] = tar.extractfile(info).read()
+            if members:
+                yield sample(key, members)